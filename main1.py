@@ -1,6 +1,14 @@
 import cv2
 import time
 
+from motion.detectors import FrameDiffDetector
+from motion.illumination import IlluminationNormalizer, NormalizedDetector
+from motion.roi import contour_boxes
+
+# 光照归一化：'gain'（全局增益/偏移）或 'histogram'（直方图匹配），差分前将第一帧的亮度匹配到第二帧；
+# None 表示不归一化
+illumination = None
+
 # 开始计时
 # start = time.time()
 start = time.perf_counter()
@@ -8,28 +16,19 @@ start = time.perf_counter()
 image1 = cv2.imread('ECSP2963.JPG')
 image2 = cv2.imread('ECSP2964.JPG')
 
-# 将照片转换为灰度图像
-gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
-
-# 计算第一帧和第二帧之间的差值
-frameDelta = cv2.absdiff(gray1, gray2)
-
-# 二值化处理
-thresh = cv2.threshold(frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
-
-# 形态学操作去除噪点
-thresh = cv2.erode(thresh, None, iterations=2)
-thresh = cv2.dilate(thresh, None, iterations=2)
+# 转换为灰度图像，计算第一帧和第二帧之间的差值并二值化处理
+detector = FrameDiffDetector(25)
+if illumination is not None:
+    detector = NormalizedDetector(detector, IlluminationNormalizer(illumination))
+thresh = detector.detect([image1, image2])
+if illumination is not None:
+    print(f"Illumination: {detector.normalizer.stats()}")
 
-# 查找轮廓
-contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+# 形态学操作去除噪点，查找面积不小于225的轮廓
+boxes = contour_boxes(thresh, min_area=225)
 
 # 在第二张图片上标记运动物体
-for contour in contours:
-    if cv2.contourArea(contour) < 225:
-        continue
-    (x, y, w, h) = cv2.boundingRect(contour)
+for (x, y, w, h) in boxes:
     cv2.rectangle(image2, (x, y), (x + w, y + h), (0, 255, 0), 2)
 
 # 显示结果
@@ -1,9 +1,22 @@
-import cv2
 import time
 import numpy as np
 import os
 from tqdm import tqdm
 
+from motion.buffers import BufferSet
+from motion.detectors import FarnebackDetector
+from motion.framestack import open_frame_store
+from motion.grouping import split_bursts
+from motion.illumination import IlluminationNormalizer, NormalizedDetector
+from motion.manifest import open_manifest
+from motion.maskstore import open_mask_store
+from motion.memory import format_bytes, memory_report
+from motion.overlay import OverlayRenderer
+from motion.pipeline import PerThread, three_stage_pipeline
+from motion.screen import cascade_summary, make_cascade, merge_cascade_stats, screening_flow_detector
+from motion.stream import stream_windows
+from motion.writer import ImageWriter
+
 # 开始时间
 start = time.perf_counter()
 
@@ -12,50 +25,310 @@ root = r'D:\RPCA\cai'
 save_root = r'D:\RPCA\cai_tf'
 save_root_mask = r'D:\RPCA\cai_tf_mask'
 
+# 光流计算方式：'full' 全分辨率，'downscale' 缩小后计算再放大掩码，'tiled' 多线程分块计算，
+# 'sparse' 只用 Lucas-Kanade 跟踪帧差变化处的点，'warm' 以上一帧对的光流为初值（滑动窗口模式下有效）
+flow_mode = 'full'
+flow_scale = 0.25  # downscale 模式的缩放比例
+flow_tile_size = 1024  # tiled 模式的分块大小
+
+# 处理记录（SQLite 文件）：已处理且输入与参数未变的图像对在重新运行时跳过；None 表示不记录
+manifest_path = None
+
+# 滑动窗口模式：在连续编号的连拍内逐对滑动，每帧只读取一次，每对光流只计算一次
+sliding_window = False
+
+# 后台写入：编码与写文件由写线程完成，队列满时计算循环等待；0 表示同步写入
+write_workers = 2
+write_queue_size = 32
+jpeg_quality = None  # None 表示使用 OpenCV 默认质量（95）
+
+# 低分辨率筛选：先以 1/2、1/4 或 1/8 尺寸解码灰度图并计算光流，无运动的图像对不再全分辨率解码，
+# 也不输出结果；None 表示不筛选（仅用于非滑动窗口模式）
+screen_factor = None
+
+# 全局特征预筛（在低分辨率筛选之前执行）：比较每帧粗网格上的块均值，优先取 EXIF 内嵌的缩略图，
+# 不必解码原图；所有块的变化都不超过该灰度值的图像对判为静止并跳过。None 表示不预筛（仅用于非滑动窗口模式）
+signature_threshold = None
+signature_source = 'exif'  # 'exif'（没有缩略图时退回缩小解码）或 'reduced'
+
+# 帧堆栈（python -m motion.framestack 导出的文件夹）：从内存映射文件读取灰度帧，不再重复解码 JPEG；
+# None 表示直接读取原图
+frame_stack_path = None
+
+# 光照归一化：'gain'（全局增益/偏移）或 'histogram'（直方图匹配），计算光流前将第一帧的亮度匹配到第二帧，
+# 自动曝光变化不再使整幅图像被判为运动；None 表示不归一化（仅用于非滑动窗口模式）
+illumination = None
+
+# 掩码存储（文件夹）：掩码按位打包或游程编码后写入分片文件并建立索引，无损且远小于 JPEG；
+# None 表示仍保存为 _mask.jpg。mask_scale < 1 时以缩小的分辨率保存（任一像素有运动即保留）
+mask_store_path = None
+mask_encoding = 'packbits'  # 'packbits' 或 'rle'
+mask_scale = 1.0
+
+# 是否保存叠加图像；只需要掩码时设为 False，跳过叠加渲染与编码
+save_overlay = True
+
+# 多线程流水线：读取线程解码、计算线程计算光流并叠加、写线程编码保存，各阶段之间为有界队列，结束时报告
+# 各阶段的繁忙程度与队列占用，找出瓶颈阶段。例如 dict(readers=2, compute_workers=2, writers=2, queue_size=8)；
+# None 表示按顺序处理（不用于滑动窗口模式与光照归一化）
+pipeline_options = None
+if pipeline_options is not None and (sliding_window or illumination is not None):
+    print("流水线模式不支持滑动窗口与光照归一化，改为按顺序处理")
+    pipeline_options = None
+
 img_list = os.listdir(root)
 
-for i in tqdm(range(0, len(img_list) - 2, 3)):
-    img_names = img_list[i: i + 3]
-    # 读取三张连续的照片
-    image1 = cv2.imread(os.path.join(root, img_names[0]))
-    image2 = cv2.imread(os.path.join(root, img_names[1]))
-    image3 = cv2.imread(os.path.join(root, img_names[2]))
+# 每张图像只解码一次，彩色与灰度平面共享缓存（或直接读取帧堆栈）
+frame_store = open_frame_store(frame_stack_path)
+
+# 设定阈值来确定运动物体
+threshold = 1
+flow_options = dict(mode=flow_mode, scale=flow_scale, tile_size=flow_tile_size)
+
+# 工作缓冲区按图像尺寸只分配一次，尺寸变化时才重新分配
+buffers = BufferSet()
+detector_options = dict(threshold=threshold, winsize=45, flow_options=flow_options)
+detector = FarnebackDetector(buffers=buffers, **detector_options)
+# 透明度掩码：0.5 表示半透明，运动区域叠加在第一个通道上，其余区域亮度减半（与 addWeighted 结果一致）
+alpha = 0.5
+overlay_options = dict(color=(255, 0, 0), alpha=alpha, image_weight=1 - alpha, unmasked_weight=1 - alpha)
+renderer = OverlayRenderer(buffers=buffers, **overlay_options)
+normalizer = None
+if illumination is not None:
+    normalizer = IlluminationNormalizer(illumination)
+    detector = NormalizedDetector(detector, normalizer)
+# 筛选级联：先比较块均值，再在低分辨率下计算光流，只有两级都通过的图像对才全分辨率处理
+screener = make_cascade(
+    None if screen_factor is None else screening_flow_detector(threshold, 45, screen_factor, buffers=buffers),
+    screen_factor, signature_threshold, dict(source=signature_source))
+
+manifest = open_manifest(manifest_path, 'main_tf', dict(flow_options, threshold=threshold, winsize=45,
+                                                        screen_factor=screen_factor, illumination=illumination,
+                                                        signature_threshold=signature_threshold,
+                                                        signature_source=signature_source,
+                                                        save_overlay=save_overlay,
+                                                        mask_store=None if mask_store_path is None else dict(
+                                                            path=os.path.abspath(mask_store_path),
+                                                            encoding=mask_encoding, scale=mask_scale),
+                                                        save_root=os.path.abspath(save_root),
+                                                        save_root_mask=os.path.abspath(save_root_mask)))
+
+
+def output_paths(name2):
+    return [os.path.join(save_root, name2), os.path.join(save_root_mask, name2.split('.')[0] + '_mask' + '.jpg')]
+
+
+def is_done(paths, count=True):
+    return manifest is not None and manifest.is_done(os.path.abspath(paths[-1]), paths, count)
+
+
+def iter_motion_masks():
+    """
+    Yields (input paths, name of the second frame, second frame, uint8 flow motion mask) for each
+    processed pair. Pairs already recorded in the manifest are skipped.
+    """
+    if sliding_window:
+        for burst in split_bursts(sorted(img_list), min_length=2):
+            paths = [os.path.join(root, name) for name in burst]
+            # 整个连拍都已处理过时不再计算光流
+            if all(is_done([a, b], count=False) for a, b in zip(paths, paths[1:])):
+                manifest.skipped += len(paths) - 1
+                continue
+            for window in stream_windows(paths, window=2, use_diff=False, use_flow=True,
+                                         flow_threshold=threshold, winsize=45,
+                                         flow_options=flow_options, store=frame_store):
+                if is_done(window.names):
+                    continue
+                mask = buffers.get('mask', window.flow_mask.shape)
+                mask[...] = window.flow_mask
+                mask *= 255
+                yield window.names, os.path.basename(window.names[1]), window.images[1], mask
+        return
+
+    for i in tqdm(range(0, len(img_list) - 2, 3)):
+        img_names = img_list[i: i + 3]
+        paths = [os.path.join(root, name) for name in img_names[:2]]
+        if is_done(paths):
+            continue
+        # 低分辨率下没有运动的图像对直接跳过，并记为已处理（无输出）
+        if screener is not None and not screener.passes(paths):
+            if manifest is not None:
+                manifest.mark_done(os.path.abspath(paths[-1]), paths)
+            continue
+        # 读取三张连续的照片（光流只用到前两张的灰度图像）
+        image2 = frame_store.bgr(os.path.join(root, img_names[1]))
+        gray1 = frame_store.gray(os.path.join(root, img_names[0]))
+        gray2 = frame_store.gray(os.path.join(root, img_names[1]))
+        if image2 is None or gray1 is None:
+            continue
+
+        # 计算光流；光照归一化要用彩色帧判断日间/红外模式，灰度图由检测器自行转换
+        if normalizer is not None:
+            image1 = frame_store.bgr(paths[0])
+            if image1 is None:
+                continue
+            yield paths, img_names[1], image2, detector.detect([image1, image2])
+        else:
+            yield paths, img_names[1], image2, detector.detect([gray1, gray2])
+
+
+def pipeline_screener():
+    # 每个读取线程一个筛选级联（各自的工作缓冲区），结束时合并统计
+    return make_cascade(
+        None if screen_factor is None else screening_flow_detector(threshold, 45, screen_factor, buffers=BufferSet()),
+        screen_factor, signature_threshold, dict(source=signature_source))
+
+
+def iter_pipelined(tasks, writer, mask_store, pipeline_options, detector_options, overlay_options,
+                   screeners=None, frame_stack_path=None, save_overlay=True):
+    """
+    Runs the pairs on reader, compute and writer threads and yields (input paths, written
+    outputs, uint8 motion mask, mask path) for each pair in completion order. Pairs skipped
+    by screening yield no outputs and no mask.
+
+    Parameters:
+    - tasks: List of (input paths, overlay path, mask path) of the pairs to process.
+    - writer: ImageWriter used by the writer threads (synchronous, workers=0).
+    - mask_store: MaskStore the caller puts the masks into, or None to write mask images.
+    - pipeline_options: Keyword arguments for motion.pipeline.three_stage_pipeline.
+    - detector_options: Keyword arguments for the FarnebackDetector of each compute thread.
+    - overlay_options: Keyword arguments for the OverlayRenderer of each compute thread.
+    - screeners: Optional PerThread of screening cascades, one per reader thread.
+    - frame_stack_path: Optional frame stack to read the frames from.
+    - save_overlay: Render and write the overlay images.
+    """
+    # 每个线程使用自己的帧缓存、检测器与工作缓冲区
+    stores = PerThread(lambda: open_frame_store(frame_stack_path))
+
+    def make_worker():
+        worker_buffers = BufferSet()
+        return (FarnebackDetector(buffers=worker_buffers, **detector_options),
+                OverlayRenderer(buffers=worker_buffers, **overlay_options))
+    workers = PerThread(make_worker)
+
+    def read(task):
+        paths, overlay_path, mask_path = task
+        if screeners is not None and not screeners.get().passes(paths):
+            return paths, None
+        store = stores.get()
+        image2 = store.bgr(paths[1])
+        gray1 = store.gray(paths[0])
+        gray2 = store.gray(paths[1])
+        if image2 is None or gray1 is None:
+            return None
+        return paths, (overlay_path, mask_path, image2, gray1, gray2)
+
+    def compute(item):
+        paths, frames = item
+        if frames is None:
+            return item
+        overlay_path, mask_path, image2, gray1, gray2 = frames
+        pair_detector, pair_renderer = workers.get()
+        # 掩码缓冲区会被本线程的下一对覆盖，交给后续阶段前复制
+        motion_mask = pair_detector.detect([gray1, gray2]).copy()
+        overlay = pair_renderer.render(image2, motion_mask, dst=np.empty_like(image2)) if save_overlay else None
+        return paths, (overlay_path, mask_path, overlay, motion_mask)
+
+    def write(item):
+        paths, frames = item
+        if frames is None:
+            return paths, [], None, None
+        overlay_path, mask_path, overlay, motion_mask = frames
+        outputs = []
+        if overlay is not None:
+            writer.write(overlay_path, overlay, copy=False)
+            outputs.append(overlay_path)
+        if mask_store is None:
+            writer.write(mask_path, motion_mask, copy=False)
+            outputs.append(mask_path)
+        return paths, outputs, motion_mask, mask_path
+
+    pipeline = three_stage_pipeline(read, compute, write, **pipeline_options)
+    yield from pipeline.run(tasks)
+    print(pipeline.summary())
 
-    # 将照片转换为灰度图像
-    gray1 = cv2.cvtColor(image1, cv2.COLOR_BGR2GRAY)
-    gray2 = cv2.cvtColor(image2, cv2.COLOR_BGR2GRAY)
-    gray3 = cv2.cvtColor(image3, cv2.COLOR_BGR2GRAY)
 
-    # 计算光流
-    flow = cv2.calcOpticalFlowFarneback(gray1, gray2, None, 0.5, 3, 45, 3, 5, 1.2, 0)
+# 流水线模式下写线程直接同步写入，不再另设写入队列
+writer = ImageWriter(0 if pipeline_options is not None else write_workers, write_queue_size, jpeg_quality)
+mask_store = open_mask_store(mask_store_path, mask_encoding, mask_scale)
+if manifest is not None and mask_store is not None:
+    # 清单提交前先将掩码分片与索引落盘，清单中记为已处理的图像对，其掩码一定已写入索引
+    manifest.before_commit = mask_store.flush
+try:
+    if pipeline_options is not None:
+        # 清单只在主线程中访问：先挑出尚未处理的图像对
+        tasks = []
+        for i in range(0, len(img_list) - 2, 3):
+            img_names = img_list[i: i + 3]
+            paths = [os.path.join(root, name) for name in img_names[:2]]
+            if not is_done(paths):
+                tasks.append((paths, *output_paths(img_names[1])))
+        pipeline_screeners = None if screener is None else PerThread(pipeline_screener)
+        for paths, outputs, motion_mask, mask_path in iter_pipelined(
+                tasks, writer, mask_store, pipeline_options, detector_options, overlay_options,
+                pipeline_screeners, frame_stack_path, save_overlay):
+            # 掩码存储与清单只在主线程中写入；筛选跳过的图像对记为已处理（无输出）
+            if mask_store is not None and motion_mask is not None:
+                outputs.append(mask_store.put(os.path.splitext(os.path.basename(mask_path))[0], motion_mask))
+            if manifest is not None:
+                manifest.mark_done(os.path.abspath(paths[-1]), paths, outputs)
+    else:
+        for paths, name2, image2, motion_mask in iter_motion_masks():
+            overlay_path, mask_path = output_paths(name2)
+            outputs = []
+            if save_overlay:
+                # 将透明度掩码应用到第二张图片上（只对掩码内的像素着色，结果写入复用的缓冲区）
+                overlay = renderer.render(image2, motion_mask)
 
-    # 计算光流的幅度和角度
-    magnitude, angle = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+                # 保存结果图像（写入器会复制缓冲区，之后可立即复用）
+                writer.write(overlay_path, overlay)
+                outputs.append(overlay_path)
 
-    # 设定阈值来确定运动物体
-    threshold = 1
-    motion_mask = magnitude > threshold
+            # 保存运动区域的灰度图像（或写入掩码存储，以 mask 文件名去掉扩展名为键）
+            if mask_store is not None:
+                mask_path = mask_store.put(os.path.splitext(os.path.basename(mask_path))[0], motion_mask)
+            else:
+                writer.write(mask_path, motion_mask)
+            outputs.append(mask_path)
 
-    # 创建一个透明度掩码
-    alpha = 0.5  # 透明度，0.5表示半透明
-    color_mask = np.zeros_like(image2)
-    color_mask[motion_mask] = [255, 0, 0]  # 使用运动掩码的红色通道
+            if manifest is not None:
+                manifest.mark_done(os.path.abspath(paths[-1]), paths, outputs)
 
-    # 将透明度掩码应用到第二张图片上
-    overlay = image2.copy()
-    cv2.addWeighted(color_mask, alpha, overlay, 1 - alpha, 0, overlay)
+            # 显示结果
+            # cv2.imshow('FL', overlay)
+            # cv2.waitKey(0)
+            # cv2.destroyAllWindows()
+finally:
+    # 等待所有排队的图像写完，并报告写入失败的文件
+    write_report = writer.close()
+    print(f"Wrote {write_report['written']} images ({write_report['failed']} failed), "
+          f"peak write queue: {write_report['max_queue_depth']}")
+    if mask_store is not None:
+        mask_report = mask_store.close()
+        print(f"Stored {mask_report['stored']} masks in {format_bytes(mask_report['stored_bytes'])} "
+              f"({mask_report['ratio']:.0f}x smaller than 8-bit masks)")
 
-    # 保存结果图像
-    cv2.imwrite(os.path.join(save_root, img_names[1]), overlay)
+if screener is not None:
+    if pipeline_options is not None:
+        screen_stats = merge_cascade_stats(pipeline_screeners.values())
+    else:
+        screen_stats = screener.stats()
+    print(f"Screening: {screen_stats['passed']} of {screen_stats['screened']} pairs passed "
+          f"({screen_stats['rejected']} skipped); {cascade_summary(screen_stats)}")
 
-    # 保存运动区域的灰度图像
-    cv2.imwrite(os.path.join(save_root_mask, img_names[1].split('.')[0] + '_mask' + '.jpg'), (motion_mask * 255).astype(np.uint8))
+if normalizer is not None:
+    illumination_stats = normalizer.stats()
+    print(f"Illumination ({illumination}): normalized {illumination_stats['normalized']} of "
+          f"{illumination_stats['triplets']} pairs ({illumination_stats['mode_switches']} day/IR switches), "
+          f"{illumination_stats['moved_to_static']} moved from motion to static")
 
-    # 显示结果
-    # cv2.imshow('FL', overlay)
-    # cv2.waitKey(0)
-    # cv2.destroyAllWindows()
+if manifest is not None:
+    print(f"Skipped {manifest.skipped} pairs already in the manifest.")
+    manifest.close()
 
 # 结束时间
 end = time.perf_counter()
 print('Running time: %s Seconds' % (end - start))
+report = memory_report(buffers)
+print(f"Peak RSS: {format_bytes(report['peak_rss_bytes'])}, work buffers: {format_bytes(report['buffer_bytes'])} "
+      f"({report['buffer_allocations']} allocations)")
@@ -0,0 +1,6 @@
+"""
+Shared helpers for the camera-trap motion detection scripts.
+"""
+from motion.buffers import BufferSet
+from motion.detectors import (CombinedDetector, Detector, FarnebackDetector, FrameDiffDetector,
+                              ThreeFrameDiffDetector, make_detector)
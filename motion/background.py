@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from motion.buffers import BufferSet
+from motion.detect import motion_fraction
+from motion.profiling import NULL_PROFILER
+
+BACKGROUND_METHODS = ('gaussian', 'median')
+BACKGROUND_VERSION = 1
+
+
+class BackgroundModel:
+    """
+    Per-camera background model that is updated as bursts stream in and saved between runs.
+
+    Two per-pixel models are available, both kept at a reduced resolution:
+    - 'gaussian': running mean and variance per pixel (a single-component MOG). A pixel is
+      foreground when |frame - mean| > max(k * std, threshold), so pixels that keep moving in
+      the wind learn a large variance and stop triggering.
+    - 'median': approximate running median (each pixel steps towards the frame by `step`
+      grey levels per update). A pixel is foreground when |frame - median| > threshold.
+
+    Only background pixels are learned at the full rate; foreground pixels are learned
+    foreground_rate times as fast (the median still moves at least one grey level), so an
+    animal that stays still is not absorbed at once.
+    When more than reset_fraction of the frame is foreground (day/night or IR switch, camera
+    moved) the model restarts from that frame.
+
+    Parameters:
+    - method: 'gaussian' or 'median'.
+    - threshold: Minimum grey-level difference counted as foreground.
+    - scale: Resize factor of the model relative to the frames (0.25 keeps 1/16 of the pixels).
+    - learning_rate: Weight of a new frame in the running mean/variance ('gaussian').
+    - k: Foreground distance in standard deviations ('gaussian').
+    - min_std: Lower bound of the standard deviation ('gaussian').
+    - step: Grey levels the median moves per update ('median').
+    - foreground_rate: Relative learning rate of foreground pixels.
+    - warmup: Frames to learn before the model scores anything.
+    - reset_fraction: Foreground fraction above which the model restarts.
+    - profiler: Optional motion.profiling.Profiler timing 'background'.
+    """
+
+    def __init__(self, method='gaussian', threshold=25, scale=0.25, learning_rate=0.02, k=3.0,
+                 min_std=4.0, step=2, foreground_rate=0.1, warmup=6, reset_fraction=0.6, profiler=None):
+        if method not in BACKGROUND_METHODS:
+            raise ValueError(f"Unknown background method: {method}")
+        self.params = dict(method=method, threshold=threshold, scale=scale, learning_rate=learning_rate,
+                           k=k, min_std=min_std, step=step, foreground_rate=foreground_rate,
+                           warmup=warmup, reset_fraction=reset_fraction)
+        self.method = method
+        self.threshold = threshold
+        self.scale = scale
+        self.learning_rate = learning_rate
+        self.k = k
+        self.min_std = min_std
+        self.step = step
+        self.foreground_rate = foreground_rate
+        self.warmup = warmup
+        self.reset_fraction = reset_fraction
+        self.profiler = profiler or NULL_PROFILER
+        self.frames_seen = 0
+        self.resets = 0
+        self.mean = None
+        self.var = None
+        self.buffers = BufferSet()
+
+    @property
+    def ready(self):
+        """True once the model has learned warmup frames since its last (re)start."""
+        return self.mean is not None and self.frames_seen >= self.warmup
+
+    @property
+    def shape(self):
+        """(height, width) of the model, or None before the first frame."""
+        return None if self.mean is None else self.mean.shape
+
+    def apply(self, frames, score_index=1):
+        """
+        Scores frames[score_index] against the model, then learns every frame in order.
+
+        Parameters:
+        - frames: BGR or grayscale uint8 frames of one burst, in capture order.
+        - score_index: Frame whose foreground is returned (the middle frame of a triplet).
+
+        Returns:
+        - uint8 foreground mask (0/255) at the size of the frames, or None while the model is
+          warming up. The mask is a reused buffer, overwritten by the next call.
+        """
+        with self.profiler.stage('background'):
+            smalls = [self._prepare(frame) for frame in frames]
+            if self.mean is not None and self.mean.shape != smalls[0].shape:
+                logging.info(f"Frame size changed to {smalls[0].shape}; restarting the background model.")
+                self.mean = None
+            foreground = None
+            if self.ready:
+                foreground = self._foreground(smalls[score_index], 'scored')
+            for small in smalls:
+                self.update(small)
+            if foreground is None or not self.ready:
+                return None
+            height, width = frames[score_index].shape[:2]
+            return cv2.resize(foreground, (width, height), dst=self.buffers.get('mask', (height, width)),
+                              interpolation=cv2.INTER_NEAREST)
+
+    def _foreground(self, small, key):
+        # 前景掩码（0/255）写入名为 key 的缓冲区；small 已缩放到模型尺寸
+        if self.method == 'median':
+            distance = cv2.absdiff(small, self.mean, dst=self.buffers.get('distance', small.shape))
+            return cv2.compare(distance, self.threshold, cv2.CMP_GT, dst=self.buffers.get(key, small.shape))
+
+        # 比较平方距离与 max(k² · var, threshold²)，避免开方
+        frame = self.buffers.get('frame', small.shape, np.float32)
+        frame[...] = small
+        distance = cv2.absdiff(frame, self.mean, dst=self.buffers.get('distance', small.shape, np.float32))
+        cv2.multiply(distance, distance, dst=distance)
+        limit = cv2.multiply(self.var, self.k * self.k, dst=self.buffers.get('limit', small.shape, np.float32))
+        cv2.max(limit, float(self.threshold) ** 2, dst=limit)
+        return cv2.compare(distance, limit, cv2.CMP_GT, dst=self.buffers.get(key, small.shape))
+
+    def update(self, small):
+        """Learns one frame at the model's size; restarts the model on a global change."""
+        if self.mean is None:
+            self._restart(small)
+            return
+
+        foreground = self._foreground(small, 'foreground')
+        if motion_fraction(foreground) > self.reset_fraction:
+            logging.info("Most of the frame changed; restarting the background model.")
+            self.resets += 1
+            self._restart(small)
+            return
+        background = cv2.bitwise_not(foreground, dst=self.buffers.get('background', small.shape))
+
+        if self.method == 'median':
+            self._step_median(small, background, self.step)
+            self._step_median(small, foreground, max(1, int(round(self.step * self.foreground_rate))))
+        else:
+            # 预热期间用 1/n 的学习率，使均值与方差尽快收敛
+            rate = max(self.learning_rate, 1.0 / (self.frames_seen + 1))
+            frame = self.buffers.get('frame', small.shape, np.float32)
+            frame[...] = small
+            distance = cv2.subtract(frame, self.mean, dst=self.buffers.get('distance', small.shape, np.float32))
+            cv2.multiply(distance, distance, dst=distance)
+            for mask, mask_rate in ((background, rate), (foreground, rate * self.foreground_rate)):
+                cv2.accumulateWeighted(distance, self.var, mask_rate, mask=mask)
+                cv2.accumulateWeighted(frame, self.mean, mask_rate, mask=mask)
+            cv2.max(self.var, self.min_std * self.min_std, dst=self.var)
+        self.frames_seen += 1
+
+    def save(self, path):
+        """Writes the model to an .npz file (atomically, via a temporary file)."""
+        if self.mean is None:
+            return
+        arrays = {'mean': self.mean}
+        if self.var is not None:
+            arrays['var'] = self.var
+        state = dict(version=BACKGROUND_VERSION, params=self.params, frames_seen=self.frames_seen,
+                     resets=self.resets)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, state=np.array(json.dumps(state)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, profiler=None, **params):
+        """
+        Returns the model saved at path, or a new model if there is none or it was saved with
+        different parameters. params are BackgroundModel keyword arguments.
+        """
+        model = cls(profiler=profiler, **params)
+        if not os.path.exists(path):
+            return model
+        with np.load(path) as data:
+            state = json.loads(str(data['state']))
+            if state.get('version') != BACKGROUND_VERSION or state.get('params') != model.params:
+                logging.warning(f"Background model {path} was saved with other parameters; starting a new one.")
+                return model
+            model.mean = data['mean'].copy()
+            model.var = data['var'].copy() if 'var' in data else None
+        model.frames_seen = state['frames_seen']
+        model.resets = state['resets']
+        return model
+
+    def _prepare(self, frame):
+        if self.scale != 1:
+            height, width = frame.shape[:2]
+            size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return frame
+
+    def _restart(self, small):
+        self.frames_seen = 1
+        if self.method == 'median':
+            self.mean = small.copy()
+            self.var = None
+        else:
+            self.mean = small.astype(np.float32)
+            self.var = np.full(small.shape, self.min_std * self.min_std, dtype=np.float32)
+
+    def _step_median(self, small, mask, step):
+        # 中值近似：帧值高于背景的像素上调 step，低于的下调 step（仅在 mask 内）
+        higher = cv2.compare(small, self.mean, cv2.CMP_GT, dst=self.buffers.get('higher', small.shape))
+        lower = cv2.compare(small, self.mean, cv2.CMP_LT, dst=self.buffers.get('lower', small.shape))
+        cv2.bitwise_and(higher, mask, dst=higher)
+        cv2.bitwise_and(lower, mask, dst=lower)
+        cv2.add(self.mean, step, dst=self.mean, mask=higher)
+        cv2.subtract(self.mean, step, dst=self.mean, mask=lower)
+
+
+def background_path(background_dir, input_folder):
+    """
+    Model file for a camera: one .npz per input folder in background_dir, named after the
+    folder and a short hash of its full path, so equally named camera folders of different
+    sites (siteA/cam01, siteB/cam01) get separate models.
+    """
+    folder = os.path.normcase(os.path.normpath(os.path.abspath(input_folder)))
+    digest = hashlib.sha1(folder.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(background_dir, f'{os.path.basename(folder)}-{digest}.npz')
+
+
+def open_background(background_dir, input_folder, profiler=None, **params):
+    """
+    Loads (or starts) the background model of the camera behind input_folder, or returns
+    None when background_dir is None.
+
+    Returns:
+    - (model, path) or (None, None).
+    """
+    if background_dir is None:
+        return None, None
+    path = background_path(background_dir, input_folder)
+    model = BackgroundModel.load(path, profiler=profiler, **params)
+    logging.info(f"Background model {path}: {model.frames_seen} frames learned"
+                 f"{'' if model.ready else ' (warming up)'}")
+    return model, path
@@ -0,0 +1,215 @@
+"""
+Benchmark of every motion-detection stage on synthetic camera-trap triplets.
+
+Usage:
+    python -m motion.bench --resolutions 1920x1080,4000x3000 --iterations 20 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from motion.detect import GatedDetector
+from motion.detectors import FarnebackDetector, FrameDiffDetector, ThreeFrameDiffDetector
+from motion.flow import compare_masks
+from motion.memory import peak_rss_bytes
+
+DEFAULT_RESOLUTIONS = ((640, 480), (1920, 1080), (4000, 3000))
+# 各脚本中使用的 Farneback 窗口大小
+WINSIZES = (30, 35, 45)
+
+
+def synthetic_triplet(width, height, blob_radius=None, step=None, seed=0):
+    """
+    Three BGR frames of blurred textured noise with a bright blob moving across them.
+
+    Parameters:
+    - width, height: Frame size.
+    - blob_radius: Blob radius in pixels (default: 1/20 of the smaller side).
+    - step: Blob displacement per frame in pixels (default: half the radius).
+    - seed: Random seed for the background texture.
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 3)
+    radius = blob_radius or max(4, min(width, height) // 20)
+    step = step or max(1, radius // 2)
+    frames = []
+    for i in range(3):
+        frame = background.copy()
+        center = (width // 3 + i * step, height // 2 + i * step // 3)
+        cv2.circle(frame, center, radius, (40, 180, 220), -1)
+        frames.append(frame)
+    return frames
+
+
+def benchmark_stages(width, height, iterations=10, winsizes=WINSIZES, model=None, batch_size=8):
+    """
+    Times each stage on one synthetic triplet.
+
+    Parameters:
+    - width, height: Frame size.
+    - iterations: Timed repetitions per stage (one untimed warm-up run is added).
+    - winsizes: Farneback window sizes to benchmark.
+    - model: Optional detector model for the gating path; without it only the gating
+      decision is timed.
+    - batch_size: Batch size for the gating path.
+
+    Returns:
+    - Dict of stage name -> list of per-iteration seconds.
+    """
+    frames = synthetic_triplet(width, height)
+    encoded = [cv2.imencode('.jpg', frame)[1] for frame in frames]
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+
+    stages = {
+        'decode': lambda: [cv2.imdecode(data, cv2.IMREAD_COLOR) for data in encoded],
+        'decode_reduced_gray_4': lambda: [cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4) for data in encoded],
+        'grayscale': lambda: [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames],
+    }
+    diff = FrameDiffDetector(25)
+    three = ThreeFrameDiffDetector(25)
+    stages['frame_diff'] = lambda: diff.detect(grays)
+    stages['three_frame_diff'] = lambda: three.detect(grays)
+    for winsize in winsizes:
+        detector = FarnebackDetector(1, winsize)
+        stages[f'farneback_w{winsize}'] = lambda detector=detector: detector.detect(grays)
+        # 三帧光流：两个帧对都从零开始，或第二个帧对以第一个帧对的光流为初值
+        for name, flow_options in ((f'farneback3_w{winsize}', None), (f'farneback3_warm_w{winsize}', {'mode': 'warm'})):
+            detector = FarnebackDetector(1, winsize, frames=3, flow_options=flow_options)
+            stages[name] = lambda detector=detector: detector.detect(grays)
+
+    mask = three.detect(grays).copy()
+    gated = GatedDetector(model or (lambda images: [None] * len(images)), 0.001, batch_size)
+
+    def gating_path():
+        # 门控判断，加上（若提供模型）一个批次的推理
+        if gated.gate(mask):
+            for _ in range(batch_size):
+                gated.submit(None, frames[1])
+    stages['yolo_gating' if model is not None else 'gating_decision'] = gating_path
+
+    timings = {}
+    for name, stage in stages.items():
+        stage()  # 预热
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            stage()
+            samples.append(time.perf_counter() - start)
+        timings[name] = samples
+    return timings
+
+
+def warm_start_agreement(width, height, winsizes=WINSIZES):
+    """
+    Compares the three-frame flow mask of warm-started flow ('warm' mode) with cold-start
+    flow on one synthetic triplet; one compare_masks dict per window size.
+    """
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in synthetic_triplet(width, height)]
+    results = []
+    for winsize in winsizes:
+        cold = FarnebackDetector(1, winsize, frames=3).detect(grays)
+        warm = FarnebackDetector(1, winsize, frames=3, flow_options={'mode': 'warm'}).detect(grays)
+        results.append(dict(stage=f'farneback3_warm_w{winsize}_agreement', width=width, height=height,
+                            **compare_masks(cold, warm)))
+    return results
+
+
+def summarize(samples):
+    """Latency percentiles (ms) and throughput (per second) of a list of durations."""
+    values = np.asarray(samples) * 1000.0
+    mean = float(values.mean())
+    return {
+        'iterations': len(samples),
+        'mean_ms': mean,
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'throughput_per_s': 1000.0 / mean if mean else None,
+    }
+
+
+def run_case(width, height, iterations, winsizes, model_path=None, batch_size=8):
+    """Benchmarks one resolution; meant to run in a fresh process so peak RSS is per case."""
+    model = None
+    if model_path:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+    timings = benchmark_stages(width, height, iterations, winsizes, model, batch_size)
+    results = []
+    for stage, samples in timings.items():
+        results.append(dict(stage=stage, width=width, height=height, **summarize(samples)))
+    triplet_seconds = sum(np.mean(timings[name]) for name in ('decode', 'grayscale', 'three_frame_diff'))
+    results.append(dict(stage='three_frame_diff_pipeline', width=width, height=height,
+                        iterations=iterations, throughput_per_s=1.0 / triplet_seconds))
+    results.extend(warm_start_agreement(width, height, winsizes))
+    return results, peak_rss_bytes()
+
+
+def run_benchmark(resolutions=DEFAULT_RESOLUTIONS, iterations=10, winsizes=WINSIZES, model_path=None,
+                  batch_size=8):
+    """
+    Runs every resolution in its own process and returns a JSON-serialisable report.
+    """
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': multiprocessing.cpu_count(),
+        'results': [],
+    }
+    context = multiprocessing.get_context('spawn')
+    for width, height in resolutions:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results, peak = pool.submit(run_case, width, height, iterations, winsizes, model_path,
+                                        batch_size).result()
+        for result in results:
+            result['peak_rss_bytes'] = peak
+        report['results'].extend(results)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _parse_resolutions(text):
+    return [tuple(int(v) for v in item.lower().split('x')) for item in text.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m motion.bench', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--resolutions', default=','.join(f'{w}x{h}' for w, h in DEFAULT_RESOLUTIONS))
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--winsizes', default=','.join(str(w) for w in WINSIZES))
+    parser.add_argument('--model', default=None, help='YOLO weights to include real inference in the gating path')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--output', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(_parse_resolutions(args.resolutions), args.iterations,
+                           [int(w) for w in args.winsizes.split(',')], args.model, args.batch_size)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
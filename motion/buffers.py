@@ -0,0 +1,30 @@
+import numpy as np
+
+
+class BufferSet:
+    """
+    Named work buffers that are allocated once per shape/dtype and reused across calls.
+
+    Arrays returned by get() are overwritten by the next call using the same name, so copy
+    anything that has to outlive the current frame.
+    """
+
+    def __init__(self):
+        self.allocations = 0
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Returns the buffer called name, reallocating it only if shape or dtype changed."""
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self._buffers[name] = buffer
+            self.allocations += 1
+        return buffer
+
+    @property
+    def nbytes(self):
+        """Total bytes currently held by the buffers."""
+        return sum(buffer.nbytes for buffer in self._buffers.values())
@@ -0,0 +1,110 @@
+import argparse
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from motion.detectors import make_detector
+from motion.framestore import FrameStore
+from motion.grouping import split_bursts
+from motion.index import list_images
+from motion.overlay import OverlayRenderer
+
+
+def iter_windows(input_folder, size, sliding=False):
+    """
+    Yields lists of size file names: sorted files in strides of size, or with sliding=True
+    every overlapping window inside each burst of consecutively numbered files.
+    """
+    files = list_images(input_folder)
+    if not sliding:
+        for i in range(0, len(files) - size + 1, size):
+            yield files[i:i + size]
+        return
+    for burst in split_bursts(files, min_length=size):
+        for i in range(len(burst) - size + 1):
+            yield burst[i:i + size]
+
+
+def overlay_mask(image, mask, alpha=0.5, color=(0, 0, 255)):
+    """Blends color over the pixels where mask is set and returns the new image."""
+    return OverlayRenderer(color, alpha).render(image, mask, dst=np.empty_like(image))
+
+
+def run(input_folder, output_folder, detector, sliding=False, save_mask=True, save_overlay=True):
+    """
+    Runs a detector over an image folder and writes masks and overlays.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where outputs will be saved.
+    - detector: A motion.detectors.Detector.
+    - sliding: Use overlapping windows inside consecutive bursts.
+    - save_mask: Save '<name>_mask.png' for the middle (or last) frame of each window.
+    - save_overlay: Save 'motion_<name>' with the mask blended over that frame.
+
+    Returns:
+    - Number of windows processed.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    store = FrameStore()
+    size = detector.frames_required
+    count = 0
+    for names in iter_windows(input_folder, size, sliding):
+        paths = [os.path.join(input_folder, name) for name in names]
+        images, grays = store.frames(paths)
+        if images is None:
+            logging.warning(f"Could not read one or more images: {names}")
+            continue
+
+        mask = detector.detect(grays)
+        # 结果保存在中间帧（两帧方法为第二帧）
+        index = size // 2
+        stem, _ = os.path.splitext(names[index])
+        if save_mask:
+            cv2.imwrite(os.path.join(output_folder, f'{stem}_mask.png'), mask)
+        if save_overlay:
+            cv2.imwrite(os.path.join(output_folder, f'motion_{names[index]}'), overlay_mask(images[index], mask))
+        count += 1
+    return count
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m motion', description='Camera-trap motion detection.')
+    parser.add_argument('input_folder', help='folder containing the input images')
+    parser.add_argument('output_folder', help='folder for masks and overlays')
+    parser.add_argument('--detector', default='three-diff', choices=['diff', 'three-diff', 'flow', 'combined'])
+    parser.add_argument('--threshold', type=float, default=None,
+                        help='difference threshold (default 25) or flow magnitude threshold (default 1)')
+    parser.add_argument('--winsize', type=int, default=35, help='Farneback window size')
+    parser.add_argument('--frames', type=int, default=3, choices=[2, 3], help='frames per window for --detector flow')
+    parser.add_argument('--flow-mode', default='full', choices=['full', 'downscale', 'tiled', 'sparse', 'warm'])
+    parser.add_argument('--flow-scale', type=float, default=0.25)
+    parser.add_argument('--sliding', action='store_true', help='slide the window inside consecutive bursts')
+    parser.add_argument('--no-mask', action='store_true', help='do not save masks')
+    parser.add_argument('--no-overlay', action='store_true', help='do not save overlays')
+    return parser
+
+
+def detector_from_args(args):
+    """Builds the detector selected on the command line."""
+    flow_options = dict(mode=args.flow_mode, scale=args.flow_scale)
+    if args.detector == 'flow':
+        threshold = 1 if args.threshold is None else args.threshold
+        return make_detector('flow', threshold=threshold, winsize=args.winsize, frames=args.frames,
+                             flow_options=flow_options)
+    if args.detector == 'combined':
+        diff_threshold = 25 if args.threshold is None else args.threshold
+        return make_detector('combined', diff_threshold=diff_threshold, winsize=args.winsize,
+                             flow_options=flow_options)
+    threshold = 25 if args.threshold is None else args.threshold
+    return make_detector(args.detector, threshold=threshold)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+    count = run(args.input_folder, args.output_folder, detector_from_args(args), sliding=args.sliding,
+                save_mask=not args.no_mask, save_overlay=not args.no_overlay)
+    logging.info(f"Processed {count} windows.")
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+
+
+def motion_fraction(motion_mask):
+    """Returns the fraction of pixels set in a motion mask (bool or 0/255)."""
+    return np.count_nonzero(motion_mask) / motion_mask.size
+
+
+class GatedDetector:
+    """
+    Detector stage that skips low-motion triplets and runs the model on fixed-size batches.
+
+    Usage: call gate(mask) first; if it returns True, submit(key, image). submit returns the
+    (key, result) pairs of any batch it ran; call flush() at the end for the remainder.
+
+    Parameters:
+    - model: Callable taking a list of images and returning one result per image
+      (e.g. an ultralytics YOLO model).
+    - min_motion_fraction: Triplets whose motion mask covers less than this are skipped.
+    - batch_size: Number of images per model call.
+    """
+
+    def __init__(self, model, min_motion_fraction=0.0, batch_size=8):
+        self.model = model
+        self.min_motion_fraction = min_motion_fraction
+        self.batch_size = max(1, batch_size)
+        self.gated = 0
+        self.inferred = 0
+        self.batches = 0
+        self.inference_seconds = 0.0
+        self._keys = []
+        self._images = []
+
+    def gate(self, motion_mask):
+        """Returns True if the mask has enough motion to be worth running the model on."""
+        if motion_mask is not None and motion_fraction(motion_mask) < self.min_motion_fraction:
+            self.gated += 1
+            return False
+        return True
+
+    def submit(self, key, image):
+        """Queues an image; returns the finished (key, result) pairs when a batch is run."""
+        self._keys.append(key)
+        self._images.append(image)
+        if len(self._images) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Runs the model on any queued images and returns their (key, result) pairs."""
+        if not self._images:
+            return []
+        keys, images = self._keys, self._images
+        self._keys, self._images = [], []
+
+        start = time.perf_counter()
+        results = self.model(images)
+        self.inference_seconds += time.perf_counter() - start
+        self.inferred += len(images)
+        self.batches += 1
+        return list(zip(keys, results))
+
+    def stats(self):
+        """Returns gating and inference counters, with the inference time the gate saved."""
+        per_image = self.inference_seconds / self.inferred if self.inferred else 0.0
+        return {
+            'total': self.gated + self.inferred + len(self._images),
+            'gated': self.gated,
+            'inferred': self.inferred,
+            'batches': self.batches,
+            'inference_seconds': self.inference_seconds,
+            'seconds_per_image': per_image,
+            'estimated_seconds_saved': per_image * self.gated,
+        }
+
+
+def has_boxes(result, min_confidence=None):
+    """True if a detection result has at least one box (above min_confidence if given)."""
+    if result.boxes is None or len(result.boxes) == 0:
+        return False
+    if min_confidence is None:
+        return True
+    return bool((result.boxes.conf > min_confidence).any())
@@ -0,0 +1,236 @@
+import cv2
+import numpy as np
+
+from motion.buffers import BufferSet
+from motion.flow import WINSIZE, WarmStartFlow, farneback, flow_motion_mask
+from motion.profiling import NULL_PROFILER
+
+
+class Detector:
+    """
+    Base class for motion detectors working on numpy frames.
+
+    detect(frames) takes BGR or grayscale uint8 frames of the same size and returns a uint8
+    motion mask (0/255). The mask lives in the detector's BufferSet and is overwritten by the
+    next call, so copy it if it must be kept.
+
+    Parameters:
+    - buffers: BufferSet shared with other detectors (a new one is created if None).
+    - name: Prefix for this detector's buffers; must be unique within a shared BufferSet.
+    - profiler: Optional motion.profiling.Profiler timing the grayscale, diff/flow and
+      threshold stages.
+    """
+
+    frames_required = 2
+
+    def __init__(self, buffers=None, name=None, profiler=None):
+        self.buffers = buffers if buffers is not None else BufferSet()
+        self.name = name or type(self).__name__
+        self.profiler = profiler or NULL_PROFILER
+
+    def detect(self, frames):
+        raise NotImplementedError
+
+    def _grays(self, frames):
+        if len(frames) < self.frames_required:
+            raise ValueError(f"{self.name} needs {self.frames_required} frames, got {len(frames)}")
+        if all(frame.ndim == 2 for frame in frames[:self.frames_required]):
+            return list(frames[:self.frames_required])
+        grays = []
+        with self.profiler.stage('grayscale'):
+            for i, frame in enumerate(frames[:self.frames_required]):
+                if frame.ndim == 2:
+                    grays.append(frame)
+                else:
+                    gray = self.buffers.get(f'gray{i}', frame.shape[:2])
+                    grays.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray))
+        return grays
+
+    def _buffer(self, key, shape, dtype=np.uint8):
+        return self.buffers.get(f'{self.name}.{key}', shape, dtype)
+
+
+class FrameDiffDetector(Detector):
+    """
+    Two-frame difference (main1.py): |frame1 - frame2| > threshold.
+
+    Parameters:
+    - threshold: Difference threshold (25 in main1.py).
+    """
+
+    frames_required = 2
+
+    def __init__(self, threshold=25, buffers=None, name=None, profiler=None):
+        super().__init__(buffers, name, profiler)
+        self.threshold = threshold
+
+    def detect(self, frames):
+        gray1, gray2 = self._grays(frames)
+        with self.profiler.stage('diff'):
+            diff = cv2.absdiff(gray1, gray2, dst=self._buffer('diff', gray1.shape))
+        with self.profiler.stage('threshold'):
+            cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY, dst=diff)
+        return diff
+
+
+class ThreeFrameDiffDetector(Detector):
+    """
+    Three-frame difference: motion in either |f1 - f2| or |f2 - f3|.
+
+    Parameters:
+    - threshold: Difference threshold (25 in new.py, 30 in 帧差法.py).
+    - merge: 'threshold_first' thresholds each difference and ORs the masks (new.py);
+      'or_first' ORs the raw differences and thresholds the result (帧差法.py).
+    """
+
+    frames_required = 3
+
+    def __init__(self, threshold=25, merge='threshold_first', buffers=None, name=None, profiler=None):
+        super().__init__(buffers, name, profiler)
+        if merge not in ('threshold_first', 'or_first'):
+            raise ValueError(f"Unknown merge: {merge}")
+        self.threshold = threshold
+        self.merge = merge
+
+    def detect(self, frames):
+        gray1, gray2, gray3 = self._grays(frames)
+        with self.profiler.stage('diff'):
+            diff1 = cv2.absdiff(gray1, gray2, dst=self._buffer('diff1', gray1.shape))
+            diff2 = cv2.absdiff(gray2, gray3, dst=self._buffer('diff2', gray1.shape))
+            if self.merge == 'or_first':
+                cv2.bitwise_or(diff1, diff2, dst=diff1)
+        with self.profiler.stage('threshold'):
+            if self.merge == 'or_first':
+                cv2.threshold(diff1, self.threshold, 255, cv2.THRESH_BINARY, dst=diff1)
+                return diff1
+            cv2.threshold(diff1, self.threshold, 255, cv2.THRESH_BINARY, dst=diff1)
+            cv2.threshold(diff2, self.threshold, 255, cv2.THRESH_BINARY, dst=diff2)
+            return cv2.bitwise_or(diff1, diff2, dst=diff1)
+
+
+class FarnebackDetector(Detector):
+    """
+    Dense Farneback flow: flow magnitude > threshold, per consecutive pair.
+
+    Parameters:
+    - threshold: Flow magnitude threshold (1 in all scripts).
+    - winsize: Farneback window size (35 in main.py, 45 in main_tf.py, 30 in new202471.py).
+    - frames: 2 for a single pair, 3 to combine the (f1, f2) and (f2, f3) pairs.
+    - combine: 'and' (三联加光流版本二.py) or 'or' (new202471.py) for 3 frames.
+    - flow_options: Extra keyword arguments for motion.flow.flow_motion_mask. In 'warm' mode
+      the second pair of a triplet starts from the flow of the first (motion.flow.WarmStartFlow).
+    """
+
+    def __init__(self, threshold=1, winsize=WINSIZE, frames=2, combine='and', flow_options=None,
+                 buffers=None, name=None, profiler=None):
+        super().__init__(buffers, name, profiler)
+        self.threshold = threshold
+        self.winsize = winsize
+        self.frames_required = frames
+        self.combine = combine
+        self.flow_options = flow_options or {}
+        self.warm_start = WarmStartFlow() if self.flow_options.get('mode') == 'warm' else None
+
+    def detect(self, frames):
+        grays = self._grays(frames)
+        mask = self._buffer('mask', grays[0].shape)
+        for i in range(len(grays) - 1):
+            pair = self._pair_mask(grays[i], grays[i + 1], mask if i == 0 else None)
+            if i == 0:
+                continue
+            if self.combine == 'and':
+                cv2.bitwise_and(mask, pair, dst=mask)
+            else:
+                cv2.bitwise_or(mask, pair, dst=mask)
+        return mask
+
+    def _pair_mask(self, gray1, gray2, dst=None):
+        # 全分辨率模式下光流、幅度与角度都写入复用的缓冲区
+        if self.flow_options.get('mode', 'full') not in ('full', 'warm'):
+            with self.profiler.stage('flow'):
+                pair = flow_motion_mask(gray1, gray2, self.threshold, self.winsize, **self.flow_options)
+            pair = pair.view(np.uint8) * np.uint8(255)
+            if dst is None:
+                return pair
+            dst[...] = pair
+            return dst
+        shape = gray1.shape
+        with self.profiler.stage('flow'):
+            if self.warm_start is not None:
+                flow = self.warm_start.flow(gray1, gray2, self.winsize)
+            else:
+                flow = farneback(gray1, gray2, self.winsize, flow=self._buffer('flow', shape + (2,), np.float32))
+        with self.profiler.stage('threshold'):
+            fx = cv2.extractChannel(flow, 0, dst=self._buffer('fx', shape, np.float32))
+            fy = cv2.extractChannel(flow, 1, dst=self._buffer('fy', shape, np.float32))
+            magnitude, _ = cv2.cartToPolar(fx, fy, magnitude=self._buffer('magnitude', shape, np.float32),
+                                           angle=self._buffer('angle', shape, np.float32))
+            if dst is None:
+                dst = self._buffer('pair', shape)
+            return cv2.compare(magnitude, self.threshold, cv2.CMP_GT, dst=dst)
+
+
+class CombinedDetector(Detector):
+    """
+    Combines several detectors with a per-pixel AND or OR. Each sub-detector sees the first
+    frames_required frames and all of them share this detector's BufferSet.
+
+    Parameters:
+    - detectors: List of Detector instances.
+    - how: 'and' or 'or'.
+    """
+
+    def __init__(self, detectors, how='and', buffers=None, name=None, profiler=None):
+        super().__init__(buffers, name, profiler)
+        self.detectors = detectors
+        self.how = how
+        self.frames_required = max(detector.frames_required for detector in detectors)
+        for i, detector in enumerate(detectors):
+            detector.buffers = self.buffers
+            detector.profiler = self.profiler
+            detector.name = f'{self.name}.{i}.{detector.name}'
+
+    def detect(self, frames):
+        grays = self._grays(frames)
+        mask = None
+        for detector in self.detectors:
+            result = detector.detect(grays)
+            if mask is None:
+                mask = self._buffer('mask', result.shape)
+                mask[...] = result
+            elif self.how == 'and':
+                cv2.bitwise_and(mask, result, dst=mask)
+            else:
+                cv2.bitwise_or(mask, result, dst=mask)
+        return mask
+
+
+# 命令行与配置中使用的检测器名称
+DETECTORS = {
+    'diff': FrameDiffDetector,
+    'three-diff': ThreeFrameDiffDetector,
+    'flow': FarnebackDetector,
+}
+
+
+def make_detector(name, buffers=None, profiler=None, **params):
+    """
+    Builds a detector by name: 'diff', 'three-diff', 'flow', or 'combined'
+    (three-frame difference AND 3-frame Farneback flow).
+
+    Parameters:
+    - name: Detector name.
+    - buffers: Optional shared BufferSet.
+    - profiler: Optional motion.profiling.Profiler.
+    - params: Constructor keyword arguments; for 'combined', 'diff_threshold',
+      'flow_threshold', 'winsize' and 'flow_options' are used.
+    """
+    if name == 'combined':
+        return CombinedDetector([
+            ThreeFrameDiffDetector(params.get('diff_threshold', 25)),
+            FarnebackDetector(params.get('flow_threshold', 1), params.get('winsize', WINSIZE), frames=3,
+                              flow_options=params.get('flow_options')),
+        ], how='and', buffers=buffers, profiler=profiler)
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown detector: {name}")
+    return DETECTORS[name](buffers=buffers, profiler=profiler, **params)
@@ -0,0 +1,149 @@
+import csv
+import errno
+import os
+import shutil
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+LINK_MODES = ('auto', 'reflink', 'copy')
+
+# Linux 的 FICLONE ioctl：在 btrfs、XFS 等写时复制文件系统上克隆文件而不复制数据
+FICLONE = 0x40049409
+
+# 链接失败时改为复制的错误码：跨设备、文件系统不支持、无权限
+_FALLBACK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                    errno.EMLINK)
+
+# 清单中的一行：窗口内第 frame 张图像（从 1 开始）对应的源文件与存储的文件（相对目标文件夹）
+WindowEntry = namedtuple('WindowEntry', ['folder', 'window', 'frame', 'name', 'source', 'stored'])
+MANIFEST_FIELDS = list(WindowEntry._fields)
+
+
+def reflink(src, dst):
+    """Clones src to dst with the Linux FICLONE ioctl; raises OSError where unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+
+
+class FileStorer:
+    """
+    Stores files in a target folder, each with the cheapest method the filesystems allow:
+    a hard link when source and target are on the same filesystem, a reflink (copy-on-write
+    clone) where the filesystem supports it, and a plain copy otherwise. A method that fails
+    for a source device is not tried again for that device. Thread-safe.
+
+    A hard link shares its data with the source file, so editing either edits both; use
+    mode 'reflink' or 'copy' when the extracted files will be modified.
+
+    Parameters:
+    - mode: 'auto' (hard link, reflink, copy), 'reflink' (reflink, copy) or 'copy'.
+    """
+
+    def __init__(self, mode='auto'):
+        if mode not in LINK_MODES:
+            raise ValueError(f"Unknown link mode: {mode}")
+        self.mode = mode
+        self.counts = {'existing': 0, 'hardlink': 0, 'reflink': 0, 'copy': 0, 'bytes_copied': 0}
+        self._disabled = set()
+        self._lock = threading.Lock()
+
+    def store(self, src, dst):
+        """
+        Stores src as dst unless dst is already up to date from an earlier run: a hard link to
+        src, or a copy with the same size and modification time (copies and reflinks get the
+        modification time of their source, so a replaced source is stored again).
+
+        Returns:
+        - The method used: 'existing', 'hardlink', 'reflink' or 'copy'.
+        """
+        source = os.stat(src)
+        if os.path.isfile(dst):
+            target = os.stat(dst)
+            if os.path.samestat(source, target) or (
+                    target.st_size == source.st_size and target.st_mtime_ns == source.st_mtime_ns):
+                return self._count('existing')
+        if os.path.lexists(dst):
+            os.remove(dst)
+        size = source.st_size
+        device = source.st_dev
+        methods = {'auto': ('hardlink', 'reflink'), 'reflink': ('reflink',), 'copy': ()}[self.mode]
+        for method in methods:
+            if (method, device) in self._disabled:
+                continue
+            try:
+                if method == 'hardlink':
+                    os.link(src, dst)
+                else:
+                    reflink(src, dst)
+                    os.utime(dst, ns=(source.st_atime_ns, source.st_mtime_ns))
+                return self._count(method)
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRORS:
+                    raise
+                # 该设备不支持此方式，之后不再尝试
+                with self._lock:
+                    self._disabled.add((method, device))
+        shutil.copyfile(src, dst)
+        os.utime(dst, ns=(source.st_atime_ns, source.st_mtime_ns))
+        return self._count('copy', size)
+
+    def _count(self, method, size=0):
+        with self._lock:
+            self.counts[method] += 1
+            self.counts['bytes_copied'] += size
+        return method
+
+
+def store_files(pairs, mode='auto', workers=8):
+    """
+    Stores every (src, dst) pair on a thread pool (file I/O releases the GIL).
+
+    Returns:
+    - (counts, failed): the FileStorer counts, and a dict of dst -> error message for the
+      files that could not be stored.
+    """
+    storer = FileStorer(mode)
+    failed = {}
+
+    def store(pair):
+        src, dst = pair
+        try:
+            storer.store(src, dst)
+        except OSError as e:
+            return dst, f"{type(e).__name__}: {e}"
+        return dst, None
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        for dst, error in pool.map(store, pairs):
+            if error is not None:
+                failed[dst] = error
+    return storer.counts, failed
+
+
+def write_window_manifest(path, entries):
+    """Writes WindowEntry rows to a CSV file (atomically, via a temporary file)."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_FIELDS)
+        writer.writerows(entries)
+    os.replace(tmp_path, path)
+
+
+def read_window_manifest(path):
+    """Reads the WindowEntry rows written by write_window_manifest."""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [WindowEntry(folder, window, int(frame), name, source, stored)
+                for folder, window, frame, name, source, stored in reader]
@@ -0,0 +1,340 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+FLOW_MODES = ('full', 'downscale', 'tiled', 'sparse', 'warm')
+
+# Farneback 默认参数，与各脚本中的写法一致（winsize 在各脚本中为 30/35/45）
+PYR_SCALE = 0.5
+LEVELS = 3
+WINSIZE = 35
+ITERATIONS = 3
+POLY_N = 5
+POLY_SIGMA = 1.2
+
+# 以上一帧对的光流为初值（'warm' 模式）时的金字塔层数与迭代次数：初值已接近结果，每层迭代一次
+WARM_LEVELS = 3
+WARM_ITERATIONS = 1
+
+# 稀疏光流（'sparse' 模式）的默认参数：种子取自帧差阈值 25（与 new.py 一致），每 8×8 像素一个种子
+SEED_THRESHOLD = 25
+SEED_SPACING = 8
+MAX_SEEDS = 4000
+LK_WINSIZE = 21
+LK_LEVELS = 3
+LK_CRITERIA = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+
+
+def farneback(gray1, gray2, winsize=WINSIZE, levels=LEVELS, iterations=ITERATIONS,
+              flow=None, flags=0):
+    """
+    Dense Farneback flow with the parameters used throughout the scripts.
+
+    Parameters:
+    - gray1, gray2: Grayscale frames of the same size.
+    - winsize: Averaging window size.
+    - levels: Number of pyramid levels.
+    - iterations: Iterations per pyramid level.
+    - flow: Optional initial flow / output buffer.
+    - flags: Farneback flags (e.g. cv2.OPTFLOW_USE_INITIAL_FLOW).
+    """
+    return cv2.calcOpticalFlowFarneback(gray1, gray2, flow, PYR_SCALE, levels, winsize,
+                                        iterations, POLY_N, POLY_SIGMA, flags)
+
+
+class WarmStartFlow:
+    """
+    Full-resolution Farneback flow over the consecutive pairs of a burst, each pair starting
+    from the flow of the previous pair (cv2.OPTFLOW_USE_INITIAL_FLOW) instead of zero.
+
+    Frames of a burst are about a second apart and the motion field barely changes between
+    pairs, so a seeded pair needs fewer iterations per pyramid level (and, for slow motion,
+    fewer levels). A pair is seeded only
+    when its first frame is the very array passed as the second frame of the previous pair
+    (and the size and window are unchanged); any other pair starts cold with the usual
+    parameters, so calls for unrelated pairs are safe.
+
+    Parameters:
+    - levels, iterations: Pyramid levels and iterations of cold pairs.
+    - warm_levels, warm_iterations: Pyramid levels and iterations of seeded pairs.
+    """
+
+    def __init__(self, levels=LEVELS, iterations=ITERATIONS, warm_levels=WARM_LEVELS,
+                 warm_iterations=WARM_ITERATIONS):
+        self.levels = levels
+        self.iterations = iterations
+        self.warm_levels = warm_levels
+        self.warm_iterations = warm_iterations
+        self.cold = 0
+        self.warm = 0
+        self._flow = None
+        self._last = None
+        self._winsize = None
+
+    def flow(self, gray1, gray2, winsize=WINSIZE):
+        """
+        Returns the flow from gray1 to gray2. The array is reused as the seed (and output) of
+        the next pair, so copy it to keep it past the next call.
+        """
+        seeded = (self._flow is not None and gray1 is self._last and winsize == self._winsize
+                  and self._flow.shape[:2] == gray1.shape[:2])
+        if seeded:
+            # 以上一帧对的光流为初值，原地更新
+            self.warm += 1
+            self._flow = farneback(gray1, gray2, winsize, self.warm_levels, self.warm_iterations,
+                                   flow=self._flow, flags=cv2.OPTFLOW_USE_INITIAL_FLOW)
+        else:
+            self.cold += 1
+            flow = self._flow if self._flow is not None and self._flow.shape[:2] == gray1.shape[:2] else None
+            self._flow = farneback(gray1, gray2, winsize, self.levels, self.iterations, flow=flow)
+        self._last = gray2
+        self._winsize = winsize
+        return self._flow
+
+    def reset(self):
+        """Starts the next pair cold (e.g. at the start of a new burst)."""
+        self._last = None
+
+    def stats(self):
+        return {'cold': self.cold, 'warm': self.warm}
+
+
+def compute_flow(gray1, gray2, winsize=WINSIZE, mode='full', scale=0.5, tile_size=1024,
+                 overlap=None, workers=None, warm_start=None):
+    """
+    Computes dense flow between two grayscale frames with the selected engine.
+
+    Parameters:
+    - gray1, gray2: Grayscale frames of the same size.
+    - winsize: Farneback window size at full resolution.
+    - mode: 'full', 'downscale' (flow on a reduced image, upsampled back) or
+      'tiled' (overlapping tiles computed on a thread pool).
+    - scale: Resize factor for 'downscale' mode, e.g. 0.5 or 0.25.
+    - tile_size: Tile edge length in pixels for 'tiled' mode.
+    - overlap: Tile overlap in pixels for 'tiled' mode (default: 2 * winsize).
+    - workers: Thread count for 'tiled' mode (default: CPU count).
+    - warm_start: WarmStartFlow carrying the previous pair's flow for 'warm' mode; without it
+      the pair is computed cold, as in 'full' mode.
+
+    Returns:
+    - Flow field of shape (H, W, 2) in full-resolution pixel units.
+    """
+    if mode == 'sparse':
+        raise ValueError("The sparse mode tracks points only and has no dense flow field")
+    if mode == 'full':
+        return farneback(gray1, gray2, winsize)
+    if mode == 'warm':
+        return (warm_start or WarmStartFlow()).flow(gray1, gray2, winsize)
+    if mode == 'downscale':
+        return _downscaled_flow(gray1, gray2, winsize, scale)
+    if mode == 'tiled':
+        return _tiled_flow(gray1, gray2, winsize, tile_size, overlap, workers)
+    raise ValueError(f"Unknown flow mode: {mode}")
+
+
+def flow_magnitude(flow):
+    """Returns the per-pixel magnitude of a flow field."""
+    magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+    return magnitude
+
+
+def flow_motion_mask(gray1, gray2, threshold=1, winsize=WINSIZE, mode='full', scale=0.5,
+                     tile_size=1024, overlap=None, workers=None, sparse_options=None, warm_start=None):
+    """
+    Boolean motion mask (flow magnitude > threshold) at full resolution.
+
+    In 'downscale' mode the magnitude is thresholded at the reduced size (with the threshold
+    scaled accordingly) and only the mask is upsampled, so the full-size flow is never built.
+    In 'sparse' mode only points seeded by the frame difference are tracked, see
+    sparse_flow_mask (sparse_options are its keyword arguments; winsize is not used).
+    Other parameters are as for compute_flow.
+    """
+    if mode == 'sparse':
+        return sparse_flow_mask(gray1, gray2, threshold, **(sparse_options or {}))
+    if mode == 'downscale':
+        small1, small2 = _resize_pair(gray1, gray2, scale)
+        small_flow = farneback(small1, small2, scaled_winsize(winsize, scale))
+        small_mask = (flow_magnitude(small_flow) > threshold * scale).astype(np.uint8)
+        height, width = gray1.shape[:2]
+        return cv2.resize(small_mask, (width, height), interpolation=cv2.INTER_NEAREST).astype(bool)
+    flow = compute_flow(gray1, gray2, winsize, mode, scale, tile_size, overlap, workers, warm_start)
+    return flow_magnitude(flow) > threshold
+
+
+def seed_points(gray1, gray2, diff_threshold=SEED_THRESHOLD, spacing=SEED_SPACING, max_points=MAX_SEEDS):
+    """
+    Candidate points for sparse flow: the centers of the spacing x spacing cells in which the
+    frame difference |gray1 - gray2| exceeds diff_threshold anywhere.
+
+    Returns:
+    - (points, cells): float32 (N, 1, 2) points in (x, y) order for calcOpticalFlowPyrLK, and
+      the (row, column) cell of each point. When more than max_points cells change, an evenly
+      spread subset is returned.
+    """
+    height, width = gray1.shape[:2]
+    diff = cv2.absdiff(gray1, gray2)
+    cv2.threshold(diff, diff_threshold, 255, cv2.THRESH_BINARY, dst=diff)
+    # 按单元格取最大值：以单元格左上角为锚点膨胀后每隔 spacing 取样，单元格内任一像素变化即保留
+    cv2.dilate(diff, np.ones((spacing, spacing), np.uint8), dst=diff, anchor=(0, 0))
+    rows, cols = np.nonzero(diff[::spacing, ::spacing])
+    if len(rows) > max_points:
+        keep = np.linspace(0, len(rows) - 1, max_points).astype(np.intp)
+        rows, cols = rows[keep], cols[keep]
+    points = np.empty((len(rows), 1, 2), dtype=np.float32)
+    points[:, 0, 0] = np.minimum(cols * spacing + spacing // 2, width - 1)
+    points[:, 0, 1] = np.minimum(rows * spacing + spacing // 2, height - 1)
+    return points, (rows, cols)
+
+
+def track_points(gray1, gray2, points, win_size=LK_WINSIZE, max_level=LK_LEVELS, fb_threshold=1.0):
+    """
+    Tracks points from gray1 to gray2 with pyramidal Lucas-Kanade and checks each track by
+    tracking it back (forward-backward error).
+
+    Returns:
+    - (displacement, tracked): per-point displacement length in pixels, and whether the point
+      was tracked reliably (found both ways, returning within fb_threshold pixels).
+    """
+    if len(points) == 0:
+        return np.zeros(0, np.float32), np.zeros(0, bool)
+    lk = dict(winSize=(win_size, win_size), maxLevel=max_level, criteria=LK_CRITERIA)
+    forward, status, _ = cv2.calcOpticalFlowPyrLK(gray1, gray2, points, None, **lk)
+    backward, back_status, _ = cv2.calcOpticalFlowPyrLK(gray2, gray1, forward, None, **lk)
+    displacement = np.linalg.norm((forward - points).reshape(-1, 2), axis=1)
+    error = np.linalg.norm((backward - points).reshape(-1, 2), axis=1)
+    tracked = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < fb_threshold)
+    return displacement, tracked
+
+
+def sparse_flow_mask(gray1, gray2, threshold=1, diff_threshold=SEED_THRESHOLD, spacing=SEED_SPACING,
+                     max_points=MAX_SEEDS, win_size=LK_WINSIZE, max_level=LK_LEVELS, fb_threshold=1.0,
+                     untracked_as_motion=True, grow=1, stats=None):
+    """
+    Boolean motion mask from sparse Lucas-Kanade flow seeded by the frame difference, at cell
+    resolution: a cell is moving when its seed moves more than threshold pixels. The cost
+    follows the amount of changed content instead of the frame area.
+
+    Parameters:
+    - gray1, gray2: Grayscale frames of the same size.
+    - threshold: Displacement (pixels) above which a point moves, as the dense magnitude threshold.
+    - diff_threshold: Frame-difference threshold selecting the seed cells.
+    - spacing: Cell size in pixels (one seed per changed cell).
+    - max_points: Upper bound on the number of tracked points.
+    - win_size, max_level: Lucas-Kanade window size and pyramid levels.
+    - fb_threshold: Forward-backward error (pixels) above which a track is unreliable.
+    - untracked_as_motion: Count changed cells whose point cannot be tracked reliably
+      (occlusion, fast motion) as moving, as dense flow usually does.
+    - grow: Cells added around every moving cell, since dense flow spreads motion over its window.
+    - stats: Optional dict; 'points', 'tracked' and 'moving' counts are added to it.
+    """
+    height, width = gray1.shape[:2]
+    points, (rows, cols) = seed_points(gray1, gray2, diff_threshold, spacing, max_points)
+    displacement, tracked = track_points(gray1, gray2, points, win_size, max_level, fb_threshold)
+    moving = (displacement > threshold) & tracked
+    if untracked_as_motion:
+        moving |= ~tracked
+    if stats is not None:
+        stats['points'] = stats.get('points', 0) + len(points)
+        stats['tracked'] = stats.get('tracked', 0) + int(np.count_nonzero(tracked))
+        stats['moving'] = stats.get('moving', 0) + int(np.count_nonzero(moving))
+
+    cells = np.zeros((-(-height // spacing), -(-width // spacing)), dtype=np.uint8)
+    cells[rows[moving], cols[moving]] = 1
+    if grow > 0 and moving.any():
+        cv2.dilate(cells, np.ones((2 * grow + 1, 2 * grow + 1), np.uint8), dst=cells)
+    # 单元格掩码放大回原图尺寸（裁掉最后一行/列单元格超出的部分）
+    mask = np.repeat(np.repeat(cells, spacing, axis=0), spacing, axis=1)[:height, :width]
+    return mask.astype(bool)
+
+
+def scaled_winsize(winsize, scale):
+    """Odd Farneback window size covering the same physical area on an image resized by scale."""
+    return max(5, int(round(winsize * scale)) | 1)
+
+
+def compare_masks(reference, candidate):
+    """
+    Measures how far a candidate mask is from a reference (full-resolution) mask.
+
+    Returns:
+    - dict with disagreement (fraction of differing pixels), iou, precision and recall.
+    """
+    reference = reference.astype(bool)
+    candidate = candidate.astype(bool)
+    intersection = np.count_nonzero(reference & candidate)
+    union = np.count_nonzero(reference | candidate)
+    ref_count = np.count_nonzero(reference)
+    cand_count = np.count_nonzero(candidate)
+    return {
+        'disagreement': float(np.count_nonzero(reference ^ candidate)) / reference.size,
+        'iou': float(intersection) / union if union else 1.0,
+        'precision': float(intersection) / cand_count if cand_count else 1.0,
+        'recall': float(intersection) / ref_count if ref_count else 1.0,
+    }
+
+
+def evaluate_flow_modes(gray1, gray2, configs, threshold=1, winsize=WINSIZE):
+    """
+    Times each flow configuration and compares its mask with full-resolution flow.
+
+    Parameters:
+    - gray1, gray2: Grayscale frames of the same size.
+    - configs: List of keyword dicts for flow_motion_mask, e.g.
+      [{'mode': 'downscale', 'scale': 0.25}, {'mode': 'tiled', 'workers': 4}].
+    - threshold: Flow magnitude threshold.
+    - winsize: Farneback window size at full resolution.
+
+    Returns:
+    - List of dicts: the config, 'seconds', and the compare_masks fields. The first entry
+      is the full-resolution reference.
+    """
+    start = time.perf_counter()
+    reference = flow_motion_mask(gray1, gray2, threshold, winsize)
+    report = [dict(mode='full', seconds=time.perf_counter() - start, **compare_masks(reference, reference))]
+    for config in configs:
+        start = time.perf_counter()
+        mask = flow_motion_mask(gray1, gray2, threshold, winsize, **config)
+        seconds = time.perf_counter() - start
+        report.append(dict(config, seconds=seconds, **compare_masks(reference, mask)))
+    return report
+
+
+def _resize_pair(gray1, gray2, scale):
+    height, width = gray1.shape[:2]
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return (cv2.resize(gray1, size, interpolation=cv2.INTER_AREA),
+            cv2.resize(gray2, size, interpolation=cv2.INTER_AREA))
+
+
+def _downscaled_flow(gray1, gray2, winsize, scale):
+    small1, small2 = _resize_pair(gray1, gray2, scale)
+    small_flow = farneback(small1, small2, scaled_winsize(winsize, scale))
+    height, width = gray1.shape[:2]
+    flow = cv2.resize(small_flow, (width, height), interpolation=cv2.INTER_LINEAR)
+    # 将位移换算回原图像素单位
+    flow[..., 0] *= width / small_flow.shape[1]
+    flow[..., 1] *= height / small_flow.shape[0]
+    return flow
+
+
+def _tiled_flow(gray1, gray2, winsize, tile_size, overlap, workers):
+    height, width = gray1.shape[:2]
+    overlap = 2 * winsize if overlap is None else overlap
+    flow = np.empty((height, width, 2), dtype=np.float32)
+
+    def run_tile(box):
+        # 在带重叠边界的区域上计算光流，只写回中心区域，避免边界效应
+        y0, y1, x0, x1 = box
+        py0, py1 = max(0, y0 - overlap), min(height, y1 + overlap)
+        px0, px1 = max(0, x0 - overlap), min(width, x1 + overlap)
+        tile_flow = farneback(gray1[py0:py1, px0:px1], gray2[py0:py1, px0:px1], winsize)
+        flow[y0:y1, x0:x1] = tile_flow[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    boxes = [(y, min(y + tile_size, height), x, min(x + tile_size, width))
+             for y in range(0, height, tile_size) for x in range(0, width, tile_size)]
+    # OpenCV 在计算时释放 GIL，线程即可并行
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run_tile, boxes))
+    return flow
@@ -0,0 +1,146 @@
+"""
+Accuracy and speed of a cheaper flow mode against dense Farneback flow, triplet by triplet.
+
+Usage:
+    python -m motion.flowcompare D:\\RPCA\\cai --mode sparse --frames 3 --combine and --winsize 35
+    python -m motion.flowcompare D:\\RPCA\\cai --mode downscale --flow-scale 0.25 --output compare.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from motion.detect import motion_fraction
+from motion.detectors import FarnebackDetector
+from motion.flow import FLOW_MODES, WINSIZE, compare_masks
+from motion.framestack import open_frame_store
+from motion.index import list_images
+from motion.sweep import iter_triplets
+
+COMPARE_FIELDS = ['name', 'dense_seconds', 'seconds', 'dense_fraction', 'fraction', 'iou', 'precision',
+                  'recall', 'disagreement', 'dense_motion', 'motion']
+
+
+def compare_folder(input_folder, flow_options, threshold=1, winsize=WINSIZE, frames=3, combine='and',
+                   min_fraction=0.0, sliding=False, frame_stack_path=None):
+    """
+    Runs dense Farneback flow and the flow mode in flow_options on every triplet of a folder.
+
+    Parameters:
+    - input_folder: Folder with the images.
+    - flow_options: Keyword arguments for motion.flow.flow_motion_mask, e.g. {'mode': 'sparse'}.
+    - threshold, winsize, frames, combine: As for motion.detectors.FarnebackDetector.
+    - min_fraction: Motion-area fraction above which a triplet counts as motion.
+    - sliding: Slide over bursts instead of stepping in strides of 3.
+    - frame_stack_path: Optional motion.framestack stack of input_folder to read frames from.
+
+    Returns:
+    - List of dicts with COMPARE_FIELDS, one per triplet.
+    """
+    dense = FarnebackDetector(threshold, winsize, frames, combine)
+    candidate = FarnebackDetector(threshold, winsize, frames, combine, flow_options)
+    store = open_frame_store(frame_stack_path)
+
+    rows = []
+    for triplet in iter_triplets(list_images(input_folder), sliding):
+        grays = [store.gray(os.path.join(input_folder, name)) for name in triplet[:frames]]
+        if any(gray is None for gray in grays):
+            logging.warning(f"Could not read one or more images of {triplet}. Skipping.")
+            continue
+        start = time.perf_counter()
+        reference = dense.detect(grays)
+        dense_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        mask = candidate.detect(grays)
+        seconds = time.perf_counter() - start
+
+        row = dict(name=triplet[1], dense_seconds=dense_seconds, seconds=seconds,
+                   dense_fraction=motion_fraction(reference), fraction=motion_fraction(mask),
+                   **compare_masks(reference, mask))
+        row['dense_motion'] = row['dense_fraction'] > min_fraction
+        row['motion'] = row['fraction'] > min_fraction
+        rows.append(row)
+    return rows
+
+
+def summarize(rows):
+    """Mean IoU/recall/precision, triplet decision agreement and speedup over all triplets."""
+    if not rows:
+        return {'triplets': 0}
+    dense_seconds = sum(row['dense_seconds'] for row in rows)
+    seconds = sum(row['seconds'] for row in rows)
+    return {
+        'triplets': len(rows),
+        'mean_iou': float(np.mean([row['iou'] for row in rows])),
+        'mean_precision': float(np.mean([row['precision'] for row in rows])),
+        'mean_recall': float(np.mean([row['recall'] for row in rows])),
+        'agreement': sum(row['motion'] == row['dense_motion'] for row in rows) / len(rows),
+        'missed': sum(row['dense_motion'] and not row['motion'] for row in rows),
+        'extra': sum(row['motion'] and not row['dense_motion'] for row in rows),
+        'dense_seconds': dense_seconds,
+        'seconds': seconds,
+        'speedup': dense_seconds / seconds if seconds else None,
+    }
+
+
+def write_rows(f, rows):
+    writer = csv.DictWriter(f, fieldnames=COMPARE_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: f'{value:.6g}' if isinstance(value, float) else value for key, value in row.items()})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m motion.flowcompare', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='folder with the images')
+    parser.add_argument('--mode', choices=[mode for mode in FLOW_MODES if mode != 'full'], default='sparse')
+    parser.add_argument('--threshold', type=float, default=1)
+    parser.add_argument('--winsize', type=int, default=WINSIZE)
+    parser.add_argument('--frames', type=int, choices=[2, 3], default=3)
+    parser.add_argument('--combine', choices=['and', 'or'], default='and')
+    parser.add_argument('--flow-scale', type=float, default=0.25)
+    parser.add_argument('--seed-threshold', type=int, default=None, help="frame-difference threshold of the 'sparse' seeds")
+    parser.add_argument('--seed-spacing', type=int, default=None, help="cell size of the 'sparse' seeds in pixels")
+    parser.add_argument('--min-fraction', type=float, default=0.0,
+                        help='motion-area fraction above which a triplet counts as motion')
+    parser.add_argument('--sliding', action='store_true')
+    parser.add_argument('--stack', default=None, help='frame stack of the input folder (motion.framestack)')
+    parser.add_argument('--output', default=None, help='CSV of per-triplet results (default: stdout)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    flow_options = dict(mode=args.mode, scale=args.flow_scale)
+    if args.mode == 'sparse':
+        sparse_options = {}
+        if args.seed_threshold is not None:
+            sparse_options['diff_threshold'] = args.seed_threshold
+        if args.seed_spacing is not None:
+            sparse_options['spacing'] = args.seed_spacing
+        flow_options['sparse_options'] = sparse_options
+    rows = compare_folder(args.input, flow_options, args.threshold, args.winsize, args.frames, args.combine,
+                          args.min_fraction, args.sliding, args.stack)
+
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            write_rows(f, rows)
+    else:
+        write_rows(sys.stdout, rows)
+
+    summary = summarize(rows)
+    if not summary['triplets']:
+        logging.info("No triplets compared.")
+        return
+    logging.info(f"{summary['triplets']} triplets, {args.mode} vs dense: mean IoU {summary['mean_iou']:.3f}, "
+                 f"precision {summary['mean_precision']:.3f}, recall {summary['mean_recall']:.3f}")
+    logging.info(f"Motion decisions agree on {summary['agreement']:.1%} of triplets "
+                 f"({summary['missed']} missed, {summary['extra']} extra); "
+                 f"{summary['dense_seconds']:.2f} s dense vs {summary['seconds']:.2f} s "
+                 f"({summary['speedup'] or 0:.1f}x faster)")
+
+
+if __name__ == '__main__':
+    main()
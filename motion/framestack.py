@@ -0,0 +1,221 @@
+"""
+Memory-mapped frame stacks: a dataset decoded once into uint8 planes on disk.
+
+Usage:
+    python -m motion.framestack D:\\RPCA\\cai D:\\RPCA\\cai_stack --bgr
+"""
+import argparse
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from motion.framestore import FrameStore
+from motion.grouping import split_bursts
+from motion.index import scan_images
+
+STACK_VERSION = 1
+INDEX_FILE = 'index.json'
+GRAY_FILE = 'gray.npy'
+BGR_FILE = 'bgr.npy'
+
+
+def export_frame_stack(input_folder, stack_folder, include_bgr=False, files=None):
+    """
+    Decodes every image of input_folder once into memory-mapped .npy planes.
+
+    Frames are stored in file-name order; frames whose size differs from the first readable
+    one are resized to it, and unreadable files are left out. The index (written last, so an
+    interrupted export is never opened) records the file names, their size and mtime, and
+    the burst boundaries.
+
+    Parameters:
+    - input_folder: Folder with the source images.
+    - stack_folder: Output folder for gray.npy, bgr.npy and index.json.
+    - include_bgr: Also store the BGR planes (3x the size), so overlays need no decoding.
+    - files: Optional subset of file names; default is every image in input_folder.
+
+    Returns:
+    - The index dict.
+    """
+    entries = {name: (size, mtime) for name, size, mtime in scan_images(input_folder)}
+    names = sorted(files) if files is not None else sorted(entries)
+
+    first = None
+    for name in names:
+        first = cv2.imread(os.path.join(input_folder, name))
+        if first is not None:
+            break
+    if first is None:
+        raise ValueError(f"No readable images in {input_folder}")
+    height, width = first.shape[:2]
+
+    os.makedirs(stack_folder, exist_ok=True)
+    index_path = os.path.join(stack_folder, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    gray = np.lib.format.open_memmap(os.path.join(stack_folder, GRAY_FILE), mode='w+', dtype=np.uint8,
+                                     shape=(len(names), height, width))
+    bgr = None
+    if include_bgr:
+        bgr = np.lib.format.open_memmap(os.path.join(stack_folder, BGR_FILE), mode='w+', dtype=np.uint8,
+                                        shape=(len(names), height, width, 3))
+
+    kept = []
+    for name in names:
+        image = cv2.imread(os.path.join(input_folder, name))
+        if image is None:
+            logging.warning(f"Could not read image: {name}. Leaving it out of the stack.")
+            continue
+        if image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height))
+        i = len(kept)
+        gray[i] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if bgr is not None:
+            bgr[i] = image
+        size, mtime = entries.get(name, (None, None))
+        kept.append([name, size, mtime])
+
+    gray.flush()
+    del gray
+    if bgr is not None:
+        bgr.flush()
+        del bgr
+
+    # 连拍边界记录为 [起始下标, 结束下标)
+    positions = {name: i for i, (name, _, _) in enumerate(kept)}
+    bursts = [[positions[burst[0]], positions[burst[0]] + len(burst)]
+              for burst in split_bursts([name for name, _, _ in kept])]
+    index = {
+        'version': STACK_VERSION,
+        'source': os.path.abspath(input_folder),
+        'shape': [height, width],
+        'count': len(kept),
+        'bgr': include_bgr,
+        'files': kept,
+        'bursts': bursts,
+    }
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    return index
+
+
+class FrameStack:
+    """
+    Read-only view of an exported frame stack with the same bgr/gray/frames interface as
+    motion.framestore.FrameStore, so scripts can use either.
+
+    Frames of the stack's source folder are returned as zero-copy views into the memory-mapped
+    planes. Other paths, and BGR frames when the stack has none, are decoded from disk through
+    a FrameStore.
+
+    Parameters:
+    - stack_folder: Folder written by export_frame_stack.
+    - fallback_bytes: Cache size of the FrameStore used for frames not in the stack.
+    - profiler: Optional motion.profiling.Profiler for the fallback decodes.
+    """
+
+    def __init__(self, stack_folder, fallback_bytes=256 * 1024 * 1024, profiler=None):
+        with open(os.path.join(stack_folder, INDEX_FILE), encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != STACK_VERSION:
+            raise ValueError(f"Unsupported frame stack version: {index.get('version')}")
+        self.source = os.path.normcase(index['source'])
+        self.names = [name for name, _, _ in index['files']]
+        self._files = index['files']
+        self._bursts = index['bursts']
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        count = index['count']
+        self._gray = np.load(os.path.join(stack_folder, GRAY_FILE), mmap_mode='r')[:count]
+        self._bgr = np.load(os.path.join(stack_folder, BGR_FILE), mmap_mode='r')[:count] if index['bgr'] else None
+        self._fallback = FrameStore(fallback_bytes, profiler)
+
+    def __len__(self):
+        return len(self.names)
+
+    def position(self, path):
+        """Index of path in the stack, or None if it is not a frame of the source folder."""
+        if os.path.normcase(os.path.dirname(os.path.abspath(path))) != self.source:
+            return None
+        return self._positions.get(os.path.basename(path))
+
+    def gray(self, path):
+        """Grayscale frame for path: a view into the stack, or decoded if not stored."""
+        i = self.position(path)
+        return self._fallback.gray(path) if i is None else self._gray[i]
+
+    def bgr(self, path):
+        """BGR frame for path: a view into the stack if BGR planes were exported, else decoded."""
+        i = self.position(path)
+        if i is None or self._bgr is None:
+            return self._fallback.bgr(path)
+        return self._bgr[i]
+
+    def frames(self, paths):
+        """Returns (bgr_list, gray_list) for paths; both are None if any frame is unavailable."""
+        images = [self.bgr(path) for path in paths]
+        if any(image is None for image in images):
+            return None, None
+        return images, [self.gray(path) for path in paths]
+
+    def gray_stack(self, start=0, stop=None):
+        """Zero-copy (N, H, W) view of the grayscale planes from start to stop."""
+        return self._gray[start:stop]
+
+    def bursts(self, min_length=1):
+        """Bursts of consecutively numbered frames, each a list of file names."""
+        return [self.names[start:stop] for start, stop in self._bursts if stop - start >= min_length]
+
+    def exclude(self, names):
+        """Stops serving the given frames from the stack; they are decoded from disk instead."""
+        for name in names:
+            self._positions.pop(name, None)
+
+    def stale_files(self):
+        """
+        Names of stored frames whose source file is missing or changed (size or mtime) since
+        the export; re-export when this is not empty.
+        """
+        stale = []
+        for name, size, mtime in self._files:
+            try:
+                stat = os.stat(os.path.join(self.source, name))
+            except OSError:
+                stale.append(name)
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                stale.append(name)
+        return stale
+
+
+def open_frame_store(stack_folder=None, profiler=None):
+    """
+    Returns a FrameStack for stack_folder, or a FrameStore that decodes from disk when
+    stack_folder is None. Frames changed since the export are decoded from disk.
+    """
+    if stack_folder is None:
+        return FrameStore(profiler=profiler)
+    stack = FrameStack(stack_folder, profiler=profiler)
+    stale = stack.stale_files()
+    if stale:
+        logging.warning(f"{len(stale)} frames changed since the stack was exported; re-export {stack_folder}")
+        stack.exclude(stale)
+    return stack
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m motion.framestack', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='folder with the source images')
+    parser.add_argument('output', help='folder for the frame stack')
+    parser.add_argument('--bgr', action='store_true', help='also store the BGR planes')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = export_frame_stack(args.input, args.output, include_bgr=args.bgr)
+    logging.info(f"Exported {index['count']} frames in {len(index['bursts'])} bursts to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import shutil
+from collections import OrderedDict
+
+import cv2
+
+from motion.profiling import NULL_PROFILER
+
+
+class FrameStore:
+    """
+    Decodes each image file once and keeps its BGR and grayscale planes in an LRU cache
+    bounded by total bytes.
+
+    Parameters:
+    - max_bytes: Upper bound on the bytes held by cached planes (default 512 MB).
+    - profiler: Optional motion.profiling.Profiler timing the decode and grayscale stages.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, profiler=None):
+        self.max_bytes = max_bytes
+        self.profiler = profiler or NULL_PROFILER
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path -> [bgr, gray]
+
+    def bgr(self, path):
+        """Returns the decoded BGR image for path, or None if it cannot be read."""
+        entry = self._entry(path)
+        return None if entry is None else entry[0]
+
+    def gray(self, path):
+        """Returns the grayscale plane for path, converting it at most once."""
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        if entry[1] is None:
+            with self.profiler.stage('grayscale'):
+                entry[1] = cv2.cvtColor(entry[0], cv2.COLOR_BGR2GRAY)
+            self.cached_bytes += entry[1].nbytes
+            self._evict()
+        return entry[1]
+
+    def frames(self, paths):
+        """Returns (bgr_list, gray_list) for paths; both are None if any file is unreadable."""
+        images = [self.bgr(path) for path in paths]
+        if any(image is None for image in images):
+            return None, None
+        return images, [self.gray(path) for path in paths]
+
+    def discard(self, path):
+        """Drops path from the cache."""
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.cached_bytes -= _entry_bytes(entry)
+
+    def stats(self):
+        """Returns hit/miss counters and the current cache size."""
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                'cached_bytes': self.cached_bytes}
+
+    def _entry(self, path):
+        entry = self._entries.get(path)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(path)
+            return entry
+        self.misses += 1
+        with self.profiler.stage('decode'):
+            image = cv2.imread(path)
+        if image is None:
+            return None
+        entry = [image, None]
+        self._entries[path] = entry
+        self.cached_bytes += image.nbytes
+        self._evict()
+        return entry
+
+    def _evict(self):
+        # 超出字节上限时淘汰最久未使用的帧，但至少保留最新的一帧
+        while self.cached_bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self.cached_bytes -= _entry_bytes(entry)
+
+
+def copy_through(src, dst):
+    """Copies an input image to the output unchanged, without a decode/encode round trip."""
+    shutil.copyfile(src, dst)
+
+
+def _entry_bytes(entry):
+    return sum(plane.nbytes for plane in entry if plane is not None)
@@ -0,0 +1,76 @@
+import re
+
+# 正则表达式提取文件名前缀和后缀（_1, _2, _3），扩展名不区分大小写
+GROUP_PATTERN = re.compile(r'(.*)_(\d)\.jpe?g$', re.IGNORECASE)
+
+
+def group_frames(files, pattern=GROUP_PATTERN):
+    """
+    Groups burst frames named like '<prefix>_1.jpg', '<prefix>_2.jpg', '<prefix>_3.jpg'.
+
+    Parameters:
+    - files: Iterable of file names.
+    - pattern: Compiled regex with the prefix as group 1 and the frame number as group 2.
+
+    Returns:
+    - dict mapping prefix -> {frame number: file name}, in first-seen order.
+    """
+    grouped_files = {}
+    for file in files:
+        match = pattern.match(file)
+        if match:
+            prefix = match.group(1)
+            suffix = int(match.group(2))
+            grouped_files.setdefault(prefix, {})[suffix] = file
+    return grouped_files
+
+
+def complete_triplets(grouped_files):
+    """
+    Splits grouped frames into complete triplets (_1, _2, _3) and the prefixes missing frames.
+
+    Returns:
+    - (triplets, missing): list of (prefix, group) and list of prefixes.
+    """
+    triplets = []
+    missing = []
+    for prefix, group in grouped_files.items():
+        if all(k in group for k in [1, 2, 3]):
+            triplets.append((prefix, group))
+        else:
+            missing.append(prefix)
+    return triplets, missing
+
+
+# 文件名中的序号，例如 'ECSP2963.JPG' -> ('ECSP', 2963)
+SEQUENCE_PATTERN = re.compile(r'^(.*?)(\d+)\.(jpe?g|png)$', re.IGNORECASE)
+
+
+def split_bursts(sorted_files, min_length=1, pattern=SEQUENCE_PATTERN):
+    """
+    Splits sorted file names into bursts of consecutive sequence numbers.
+
+    Parameters:
+    - sorted_files: File names in ascending order.
+    - min_length: Drop bursts shorter than this.
+    - pattern: Compiled regex with the name prefix as group 1 and the number as group 2.
+
+    Returns:
+    - List of bursts, each a list of file names in order.
+    """
+    bursts = []
+    current = []
+    last_key = None
+    for file in sorted_files:
+        match = pattern.match(file)
+        if not match:
+            continue
+        key = (match.group(1), int(match.group(2)))
+        if current and (key[0] != last_key[0] or key[1] != last_key[1] + 1):
+            bursts.append(current)
+            current = []
+        current.append(file)
+        last_key = key
+    if current:
+        bursts.append(current)
+    return [burst for burst in bursts if len(burst) >= min_length]
@@ -0,0 +1,180 @@
+import cv2
+import numpy as np
+
+from motion.buffers import BufferSet
+from motion.detect import motion_fraction
+from motion.detectors import Detector
+from motion.profiling import NULL_PROFILER
+
+ILLUMINATION_METHODS = ('gain', 'histogram')
+
+
+def is_infrared(image, max_chroma=4.0, step=8):
+    """
+    True if a frame was taken in night IR mode: IR frames are (almost) grey, so the mean
+    difference between color channels is small. Only every step-th pixel is looked at.
+    Returns None for grayscale frames, whose mode cannot be told.
+    """
+    if image.ndim == 2:
+        return None
+    sample = image[::step, ::step]
+    blue, green, red = cv2.split(sample)
+    chroma = (cv2.mean(cv2.absdiff(blue, green))[0] + cv2.mean(cv2.absdiff(green, red))[0]) / 2
+    return chroma < max_chroma
+
+
+def gain_offset_lut(gray, reference):
+    """
+    Lookup table mapping gray onto the mean and standard deviation of reference
+    (a global gain and offset, as produced by auto-exposure).
+    """
+    mean, std = (value[0][0] for value in cv2.meanStdDev(gray))
+    ref_mean, ref_std = (value[0][0] for value in cv2.meanStdDev(reference))
+    gain = ref_std / std if std > 0 else 1.0
+    levels = np.arange(256, dtype=np.float64)
+    return np.clip(np.rint((levels - mean) * gain + ref_mean), 0, 255).astype(np.uint8)
+
+
+def histogram_lut(gray, reference):
+    """Lookup table matching the grey-level histogram of gray to that of reference."""
+    cdf = np.cumsum(cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel())
+    ref_cdf = np.cumsum(cv2.calcHist([reference], [0], None, [256], [0, 256]).ravel())
+    cdf /= cdf[-1]
+    ref_cdf /= ref_cdf[-1]
+    return np.clip(np.searchsorted(ref_cdf, cdf, side='left'), 0, 255).astype(np.uint8)
+
+
+class IlluminationNormalizer:
+    """
+    Matches the brightness of the frames of a burst to one reference frame before they are
+    differenced, so auto-exposure changes between frames do not show up as motion.
+
+    Frames whose mean and standard deviation are within min_change grey levels of the
+    reference are left untouched. Bursts that switch between day color and night IR are
+    always histogram matched, since the tone curve changes with the mode.
+
+    Parameters:
+    - method: 'gain' (global gain/offset) or 'histogram' (histogram matching).
+    - min_change: Brightness change in grey levels below which frames are not normalized.
+    - min_motion_fraction: Motion-area fraction above which a triplet counts as motion when
+      reporting triplets moved from motion to static.
+    - audit: Also run the detector on the raw frames of normalized triplets to count the
+      triplets that normalization moved from motion to static (costs a second detection on
+      those triplets only).
+    - profiler: Optional motion.profiling.Profiler timing 'illumination'.
+    """
+
+    def __init__(self, method='gain', min_change=2.0, min_motion_fraction=0.0, audit=True, profiler=None):
+        if method not in ILLUMINATION_METHODS:
+            raise ValueError(f"Unknown illumination method: {method}")
+        self.method = method
+        self.min_change = min_change
+        self.min_motion_fraction = min_motion_fraction
+        self.audit = audit
+        self.profiler = profiler or NULL_PROFILER
+        self.buffers = BufferSet()
+        self.triplets = 0
+        self.infrared = 0
+        self.mode_switches = 0
+        self.normalized = 0
+        self.audited = 0
+        self.moved_to_static = 0
+        self.moved_to_motion = 0
+
+    def normalize(self, frames, grays=None, reference_index=1):
+        """
+        Returns grayscale frames matched to frames[reference_index].
+
+        Parameters:
+        - frames: BGR (or grayscale) frames of one burst; used for the IR-mode check.
+        - grays: Grayscale versions of frames if already available.
+        - reference_index: Frame the others are matched to (the middle frame of a triplet).
+
+        Returns:
+        - (grays, changed): the frames to difference, and whether any was normalized. Changed
+          frames are reused buffers, overwritten by the next call.
+        """
+        with self.profiler.stage('illumination'):
+            self.triplets += 1
+            if grays is None:
+                grays = [frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+            modes = [mode for mode in (is_infrared(frame) for frame in frames) if mode is not None]
+            if modes and all(modes):
+                self.infrared += 1
+            method = self.method
+            if any(modes) and not all(modes):
+                # 连拍中途切换了日间彩色 / 夜间红外模式，色调曲线不同，改用直方图匹配
+                self.mode_switches += 1
+                method = 'histogram'
+
+            reference = grays[reference_index]
+            ref_mean, ref_std = (value[0][0] for value in cv2.meanStdDev(reference))
+            normalized = list(grays)
+            changed = False
+            for i, gray in enumerate(grays):
+                if i == reference_index:
+                    continue
+                mean, std = (value[0][0] for value in cv2.meanStdDev(gray))
+                if method == self.method and abs(mean - ref_mean) < self.min_change \
+                        and abs(std - ref_std) < self.min_change:
+                    continue
+                lut = histogram_lut(gray, reference) if method == 'histogram' else gain_offset_lut(gray, reference)
+                normalized[i] = cv2.LUT(gray, lut, dst=self.buffers.get(f'normalized{i}', gray.shape))
+                changed = True
+            if changed:
+                self.normalized += 1
+            return normalized, changed
+
+    def record(self, raw_mask, mask):
+        """Counts a triplet whose raw and normalized motion masks were both computed."""
+        self.audited += 1
+        raw_motion = motion_fraction(raw_mask) > self.min_motion_fraction
+        motion = motion_fraction(mask) > self.min_motion_fraction
+        if raw_motion and not motion:
+            self.moved_to_static += 1
+        elif motion and not raw_motion:
+            self.moved_to_motion += 1
+
+    def stats(self):
+        """Returns the triplet, IR, mode switch, normalized and motion-to-static counts."""
+        return {
+            'triplets': self.triplets,
+            'infrared': self.infrared,
+            'mode_switches': self.mode_switches,
+            'normalized': self.normalized,
+            'audited': self.audited,
+            'moved_to_static': self.moved_to_static,
+            'moved_to_motion': self.moved_to_motion,
+        }
+
+
+class NormalizedDetector(Detector):
+    """
+    Runs another detector on illumination-normalized frames (see IlluminationNormalizer).
+
+    Parameters:
+    - detector: Detector to run on the normalized frames.
+    - normalizer: IlluminationNormalizer (a new 'gain' normalizer if None).
+    """
+
+    def __init__(self, detector, normalizer=None, buffers=None, name=None, profiler=None):
+        super().__init__(buffers if buffers is not None else detector.buffers, name, profiler or detector.profiler)
+        self.detector = detector
+        self.normalizer = normalizer or IlluminationNormalizer(profiler=self.profiler)
+        self.frames_required = detector.frames_required
+
+    def detect(self, frames):
+        grays = self._grays(frames)
+        reference_index = 1 if len(grays) > 1 else 0
+        normalized, changed = self.normalizer.normalize(frames[:self.frames_required], grays, reference_index)
+        if not changed:
+            return self.detector.detect(grays)
+        if not self.normalizer.audit:
+            return self.detector.detect(normalized)
+        # 先在原始帧上检测，记录结果后再在归一化的帧上检测（两者共用同一个掩码缓冲区）
+        raw_mask = self.detector.detect(grays)
+        saved = self._buffer('raw_mask', raw_mask.shape)
+        saved[...] = raw_mask
+        mask = self.detector.detect(normalized)
+        self.normalizer.record(saved, mask)
+        return mask
@@ -0,0 +1,217 @@
+import os
+import sqlite3
+from datetime import datetime
+
+from motion.grouping import SEQUENCE_PATTERN, group_frames
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# EXIF 标签：DateTimeOriginal 位于 Exif 子 IFD，DateTime 位于主 IFD
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 36867
+DATETIME = 306
+
+
+def scan_images(folder):
+    """
+    Lists the image files of one folder with os.scandir.
+
+    Returns:
+    - List of (name, size, mtime_ns) sorted by name.
+    """
+    entries = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    entries.sort()
+    return entries
+
+
+def list_images(folder):
+    """Sorted image file names in folder (os.scandir based, extension match ignores case)."""
+    return [name for name, _, _ in scan_images(folder)]
+
+
+def folder_files(folder, index_path=None):
+    """
+    Sorted image file names in folder, read from the FolderIndex at index_path (updated
+    first) when given, otherwise scanned directly.
+    """
+    if index_path is None:
+        return list_images(folder)
+    with FolderIndex(index_path) as index:
+        index.update(folder)
+        return index.files(folder)
+
+
+def iter_image_folders(root):
+    """Yields root and every subfolder below it, depth first, using os.scandir."""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        yield folder
+        try:
+            with os.scandir(folder) as it:
+                subfolders = sorted(entry.path for entry in it if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+        stack.extend(reversed(subfolders))
+
+
+def exif_timestamp(path):
+    """
+    Capture time of an image from its EXIF data as a POSIX timestamp, or None.
+    Needs Pillow; returns None if it is not installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+    except Exception:
+        return None
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').timestamp()
+    except ValueError:
+        return None
+
+
+class FolderIndex:
+    """
+    Persistent SQLite index of the image files in camera folders, used to query bursts and
+    triplets without re-listing folders with hundreds of thousands of entries.
+
+    update(folder) rescans a folder only when its directory mtime changed (files added,
+    removed or renamed), and then only new or modified files are parsed again.
+
+    Parameters:
+    - path: SQLite database file (created if missing).
+    - use_exif: Also store the EXIF capture time of each file.
+    """
+
+    def __init__(self, path, use_exif=False):
+        self.use_exif = use_exif
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS folders ("
+            " folder TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS files ("
+            " folder TEXT NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, prefix TEXT, seq INTEGER, taken REAL,"
+            " PRIMARY KEY (folder, name));")
+        self._conn.commit()
+
+    def update(self, folder, force=False):
+        """
+        Brings the index of folder up to date.
+
+        Returns:
+        - True if the folder was rescanned, False if it was unchanged.
+        """
+        folder = os.path.abspath(folder)
+        mtime_ns = os.stat(folder).st_mtime_ns
+        row = self._conn.execute("SELECT mtime_ns FROM folders WHERE folder = ?", (folder,)).fetchone()
+        if row is not None and row[0] == mtime_ns and not force:
+            return False
+
+        known = {name: (size, mtime) for name, size, mtime in self._conn.execute(
+            "SELECT name, size, mtime_ns FROM files WHERE folder = ?", (folder,))}
+        scanned = scan_images(folder)
+        current = set()
+        rows = []
+        for name, size, mtime in scanned:
+            current.add(name)
+            if known.get(name) == (size, mtime):
+                continue
+            match = SEQUENCE_PATTERN.match(name)
+            prefix, seq = (match.group(1), int(match.group(2))) if match else (None, None)
+            taken = exif_timestamp(os.path.join(folder, name)) if self.use_exif else None
+            rows.append((folder, name, size, mtime, prefix, seq, taken))
+
+        removed = [(folder, name) for name in known if name not in current]
+        self._conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self._conn.executemany("DELETE FROM files WHERE folder = ? AND name = ?", removed)
+        self._conn.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, mtime_ns))
+        self._conn.commit()
+        return True
+
+    def update_tree(self, root):
+        """
+        Updates every folder under root that contains images.
+
+        Returns:
+        - List of the folders that hold at least one image.
+        """
+        folders = []
+        for folder in iter_image_folders(root):
+            self.update(folder)
+            if self.files(folder):
+                folders.append(folder)
+        return folders
+
+    def files(self, folder):
+        """Sorted image file names of an indexed folder."""
+        return [name for name, in self._conn.execute(
+            "SELECT name FROM files WHERE folder = ? ORDER BY name", (os.path.abspath(folder),))]
+
+    def bursts(self, folder, min_length=1, max_gap_seconds=None):
+        """
+        Bursts of consecutively numbered files in folder.
+
+        Parameters:
+        - folder: Indexed folder.
+        - min_length: Drop bursts shorter than this.
+        - max_gap_seconds: If set (and EXIF times are indexed), also split a burst where two
+          neighbouring shots are further apart than this.
+
+        Returns:
+        - List of bursts, each a list of file names.
+        """
+        bursts = []
+        current = []
+        last = None
+        for name, prefix, seq, taken in self._conn.execute(
+                "SELECT name, prefix, seq, taken FROM files WHERE folder = ? AND seq IS NOT NULL ORDER BY name",
+                (os.path.abspath(folder),)):
+            if current:
+                consecutive = prefix == last[0] and seq == last[1] + 1
+                if consecutive and max_gap_seconds is not None and taken is not None and last[2] is not None:
+                    consecutive = taken - last[2] <= max_gap_seconds
+                if not consecutive:
+                    bursts.append(current)
+                    current = []
+            current.append(name)
+            last = (prefix, seq, taken)
+        if current:
+            bursts.append(current)
+        return [burst for burst in bursts if len(burst) >= min_length]
+
+    def triplets(self, folder, sliding=True, max_gap_seconds=None):
+        """
+        Consecutive triplets of file names: every window of 3 inside each burst (sliding) or
+        non-overlapping windows of 3 (sliding=False).
+        """
+        step = 1 if sliding else 3
+        return [burst[i:i + 3]
+                for burst in self.bursts(folder, 3, max_gap_seconds)
+                for i in range(0, len(burst) - 2, step)]
+
+    def groups(self, folder):
+        """Frames grouped by '<prefix>_<n>.jpg' naming, as motion.grouping.group_frames."""
+        return group_frames(self.files(folder))
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+def params_hash(params):
+    """Stable short hash of a JSON-serialisable parameter dict."""
+    encoded = json.dumps(params, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def inputs_signature(paths):
+    """
+    Hash of (path, size, mtime) for every input file; changes whenever an input is replaced.
+    Missing files are included as such, so they never match a finished record.
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+        except OSError:
+            digest.update(f"{os.path.abspath(path)}|missing\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    SQLite record of processed tasks, so interrupted or repeated runs skip finished work.
+
+    A task is done when a row exists for (stage, key, parameter hash) whose input signature
+    still matches and whose recorded outputs still exist. Changing the parameters only
+    invalidates the rows of that stage; other stages and parameter sets are kept.
+
+    Parameters:
+    - path: SQLite database file (created if missing).
+    - stage: Name of the processing stage, e.g. 'new.three_frame_difference'.
+    - params: Dict of the parameters that affect the outputs.
+    - commit_every: Number of mark_done calls between commits.
+    - before_commit: Optional callable run before every commit, e.g. the flush of the store
+      the outputs are written to (motion.maskstore.MaskStore.flush), so no task is committed
+      as done before its outputs are. Can also be set later as an attribute.
+    """
+
+    def __init__(self, path, stage, params, commit_every=100, before_commit=None):
+        self.stage = stage
+        self.params_hash = params_hash(params)
+        self.commit_every = commit_every
+        self.before_commit = before_commit
+        self.skipped = 0
+        self._pending = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " stage TEXT NOT NULL, key TEXT NOT NULL, params_hash TEXT NOT NULL,"
+            " inputs_sig TEXT NOT NULL, outputs TEXT NOT NULL, finished REAL NOT NULL,"
+            " PRIMARY KEY (stage, key, params_hash))")
+        self._conn.commit()
+
+    def is_done(self, key, input_paths, count=True):
+        """
+        True if key was finished with the current parameters, inputs and outputs.
+        Finished keys are counted in self.skipped unless count is False.
+        """
+        row = self._conn.execute(
+            "SELECT inputs_sig, outputs FROM tasks WHERE stage = ? AND key = ? AND params_hash = ?",
+            (self.stage, key, self.params_hash)).fetchone()
+        if row is None or row[0] != inputs_signature(input_paths):
+            return False
+        if not all(os.path.exists(output) for output in json.loads(row[1])):
+            return False
+        if count:
+            self.skipped += 1
+        return True
+
+    def mark_done(self, key, input_paths, outputs=()):
+        """Records key as finished with the given input files and output paths."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)",
+            (self.stage, key, self.params_hash, inputs_signature(input_paths),
+             json.dumps(list(outputs)), time.time()))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        if self.before_commit is not None:
+            self.before_commit()
+        self._conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_manifest(path, stage, params):
+    """Returns a Manifest for path, or None when path is None (manifest disabled)."""
+    return None if path is None else Manifest(path, stage, params)
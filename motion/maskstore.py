@@ -0,0 +1,298 @@
+"""
+Compact, exact storage for binary motion masks: bit-packed or run-length encoded records in
+shard files, with an SQLite index for lazy decoding by name.
+
+Usage:
+    python -m motion.maskstore info D:\\RPCA\\cai_tf_masks
+    python -m motion.maskstore export D:\\RPCA\\cai_tf_masks D:\\RPCA\\cai_tf_mask_png
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import zlib
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+MASK_ENCODINGS = ('packbits', 'rle')
+INDEX_FILE = 'index.sqlite'
+SHARD_PATTERN = 'masks-{:05d}.bin'
+
+# 编码后的掩码：原始尺寸、存储尺寸、编码方式与压缩后的数据
+EncodedMask = namedtuple('EncodedMask', ['height', 'width', 'stored_height', 'stored_width', 'encoding', 'data'])
+
+
+class MaskEncoder:
+    """
+    Encodes binary masks losslessly (at the stored resolution).
+
+    Picklable, so worker processes can encode masks and hand the records to the process
+    that owns the MaskStore.
+
+    Parameters:
+    - encoding: 'packbits' (one bit per pixel) or 'rle' (run lengths), both zlib compressed.
+    - scale: Resize factor of the stored mask; a stored pixel is set if any pixel it covers
+      is set, so reduced masks never lose motion. 1.0 keeps masks exact.
+    - level: zlib compression level.
+    """
+
+    def __init__(self, encoding='packbits', scale=1.0, level=6):
+        if encoding not in MASK_ENCODINGS:
+            raise ValueError(f"Unknown mask encoding: {encoding}")
+        self.encoding = encoding
+        self.scale = scale
+        self.level = level
+
+    def encode(self, mask):
+        """Encodes a bool or 0/255 mask and returns an EncodedMask."""
+        height, width = mask.shape[:2]
+        stored = mask.view(np.uint8) if mask.dtype == bool else mask
+        if self.scale != 1:
+            stored = max_pool(stored, (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale)))))
+        bits = stored.reshape(-1) > 0
+        if self.encoding == 'packbits':
+            payload = np.packbits(bits).tobytes()
+        else:
+            # 交替的 0/1 游程长度，第一个游程总是 0（可为空）
+            changes = np.flatnonzero(bits[1:] != bits[:-1]) + 1
+            runs = np.diff(np.concatenate(([0], changes, [bits.size])))
+            if bits.size and bits[0]:
+                runs = np.concatenate(([0], runs))
+            payload = runs.astype('<u4').tobytes()
+        return EncodedMask(height, width, stored.shape[0], stored.shape[1], self.encoding,
+                           zlib.compress(payload, self.level))
+
+
+def max_pool(mask, size):
+    """
+    Resizes a mask to size (width, height) so that every output pixel is the maximum of the
+    block of input pixels it covers: no set pixel is lost, however small the output.
+    """
+    width, height = size
+    rows, cols = _block_starts(mask.shape[0], height), _block_starts(mask.shape[1], width)
+    return np.maximum.reduceat(np.maximum.reduceat(mask, rows, axis=0), cols, axis=1)
+
+
+def expand_blocks(mask, size):
+    """Inverse of max_pool: every pixel of the size (width, height) output takes the value of its block."""
+    width, height = size
+    # 每个输出行/列所在的块（与 max_pool 的分块一致）
+    rows = np.searchsorted(_block_starts(height, mask.shape[0]), np.arange(height), side='right') - 1
+    cols = np.searchsorted(_block_starts(width, mask.shape[1]), np.arange(width), side='right') - 1
+    return mask[rows[:, None], cols]
+
+
+def _block_starts(length, blocks):
+    # 长度为 length 的轴分成 blocks 块时各块的起始下标（blocks > length 时下标重复）
+    return np.arange(blocks) * length // blocks
+
+
+def decode_mask(record, full_size=True):
+    """
+    Decodes an EncodedMask to a uint8 mask (0/255), upsampled to the original size when
+    full_size is True and the mask was stored at reduced resolution.
+    """
+    payload = zlib.decompress(record.data)
+    count = record.stored_height * record.stored_width
+    if record.encoding == 'packbits':
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8), count=count)
+    else:
+        runs = np.frombuffer(payload, dtype='<u4')
+        values = np.arange(len(runs), dtype=np.uint8) & 1
+        bits = np.repeat(values, runs)
+    mask = bits.reshape(record.stored_height, record.stored_width) * np.uint8(255)
+    if full_size and mask.shape != (record.height, record.width):
+        mask = expand_blocks(mask, (record.width, record.height))
+    return mask
+
+
+class MaskStore:
+    """
+    Masks stored by name in append-only shard files, indexed in SQLite.
+
+    Records are appended to the current shard, which rolls over once it exceeds shard_bytes.
+    Index rows are committed only after their bytes are flushed, so an interrupted run never
+    indexes a partial record. Storing a name again replaces its index row; the old bytes stay
+    in the shard until the store is rewritten.
+
+    Parameters:
+    - folder: Store folder (created if missing).
+    - encoder: MaskEncoder used by put() (default: bit-packed at full resolution).
+    - shard_bytes: Size after which a new shard file is started.
+    - commit_every: Number of stored masks between index commits.
+    """
+
+    def __init__(self, folder, encoder=None, shard_bytes=256 * 1024 * 1024, commit_every=100):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.encoder = encoder or MaskEncoder()
+        self.shard_bytes = shard_bytes
+        self.commit_every = commit_every
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.stored = 0
+        self._pending = 0
+        self._readers = {}
+        self._conn = sqlite3.connect(os.path.join(folder, INDEX_FILE))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS masks ("
+            " name TEXT PRIMARY KEY, shard INTEGER NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL,"
+            " height INTEGER NOT NULL, width INTEGER NOT NULL, stored_height INTEGER NOT NULL,"
+            " stored_width INTEGER NOT NULL, encoding TEXT NOT NULL)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT MAX(shard) FROM masks").fetchone()
+        self._shard = row[0] or 0
+        self._file = None
+
+    def shard_path(self, shard):
+        return os.path.join(self.folder, SHARD_PATTERN.format(shard))
+
+    def put(self, name, mask):
+        """Encodes and stores a mask; returns the shard file it was written to."""
+        return self.put_encoded(name, self.encoder.encode(mask))
+
+    def put_encoded(self, name, record):
+        """Stores an EncodedMask (e.g. from a worker process); returns its shard file."""
+        while self._file is None or self._file.tell() >= self.shard_bytes:
+            self._open_shard()
+        offset = self._file.tell()
+        self._file.write(record.data)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO masks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, self._shard, offset, len(record.data), record.height, record.width,
+             record.stored_height, record.stored_width, record.encoding))
+        self.stored += 1
+        self.raw_bytes += record.height * record.width
+        self.stored_bytes += len(record.data)
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+        return self.shard_path(self._shard)
+
+    def get(self, name, full_size=True):
+        """Decodes the mask stored under name (see decode_mask), or returns None."""
+        record = self.record(name)
+        return None if record is None else decode_mask(record, full_size)
+
+    def record(self, name):
+        """Reads the EncodedMask stored under name without decoding it, or returns None."""
+        row = self._conn.execute(
+            "SELECT shard, offset, length, height, width, stored_height, stored_width, encoding"
+            " FROM masks WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        shard, offset, length = row[:3]
+        if self._file is not None and shard == self._shard:
+            self._file.flush()
+        reader = self._readers.get(shard)
+        if reader is None:
+            reader = self._readers[shard] = open(self.shard_path(shard), 'rb')
+        reader.seek(offset)
+        return EncodedMask(*row[3:], reader.read(length))
+
+    def names(self):
+        return [row[0] for row in self._conn.execute("SELECT name FROM masks ORDER BY name")]
+
+    def __contains__(self, name):
+        return self._conn.execute("SELECT 1 FROM masks WHERE name = ?", (name,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM masks").fetchone()[0]
+
+    def flush(self):
+        """
+        Flushes the shard and commits the index rows of everything stored so far; does
+        nothing once the store is closed.
+        """
+        if self._conn is None:
+            return
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._conn.commit()
+        self._pending = 0
+
+    def totals(self):
+        """(mask count, stored bytes, pixels) over every mask in the index."""
+        count, stored, pixels = self._conn.execute(
+            "SELECT COUNT(*), SUM(length), SUM(height * width) FROM masks").fetchone()
+        return count, stored or 0, pixels or 0
+
+    def report(self):
+        """Masks stored in this session, their uncompressed (1 byte/pixel) and stored sizes."""
+        return {
+            'stored': self.stored,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.stored_bytes,
+            'ratio': self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+        }
+
+    def close(self):
+        if self._conn is None:
+            return self.report()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+        self._conn.close()
+        self._conn = None
+        return self.report()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open_shard(self):
+        # 当前分片已满时切换到下一个分片；追加模式打开时位于文件末尾
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._shard += 1
+        self._file = open(self.shard_path(self._shard), 'ab')
+
+
+def open_mask_store(folder, encoding='packbits', scale=1.0):
+    """Returns a MaskStore for folder, or None when folder is None (masks written as images)."""
+    return None if folder is None else MaskStore(folder, MaskEncoder(encoding, scale))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m motion.maskstore', description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    info = subparsers.add_parser('info', help='count and size of the stored masks')
+    info.add_argument('store')
+    export = subparsers.add_parser('export', help='decode masks to PNG files')
+    export.add_argument('store')
+    export.add_argument('output')
+    export.add_argument('--names', default=None, help='comma separated mask names (default: all)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with MaskStore(args.store) as store:
+        if args.command == 'info':
+            count, stored, pixels = store.totals()
+            logging.info(f"{count} masks, {stored} bytes stored for {pixels} pixels"
+                         f" ({pixels / stored if stored else 0:.1f}x smaller than 8-bit masks)")
+            return
+        os.makedirs(args.output, exist_ok=True)
+        names = args.names.split(',') if args.names else store.names()
+        exported = 0
+        for name in names:
+            mask = store.get(name)
+            if mask is None:
+                logging.warning(f"No mask named {name}")
+                continue
+            cv2.imwrite(os.path.join(args.output, f'{name}.png'), mask)
+            exported += 1
+        logging.info(f"Exported {exported} masks to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes(children=False):
+    """
+    Peak resident set size of this process (or of its finished child processes), in bytes.
+
+    Uses the resource module where available and falls back to psutil's peak working set on
+    Windows. Returns None if neither is available.
+    """
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+        # Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+        return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    return getattr(info, 'peak_wset', info.rss)
+
+
+def memory_report(buffers=None):
+    """
+    Peak memory of the run plus the size of a BufferSet and how often it reallocated.
+
+    Parameters:
+    - buffers: Optional motion.buffers.BufferSet used by the run.
+    """
+    report = {
+        'peak_rss_bytes': peak_rss_bytes(),
+        'peak_rss_children_bytes': peak_rss_bytes(children=True),
+    }
+    if buffers is not None:
+        report['buffer_bytes'] = buffers.nbytes
+        report['buffer_allocations'] = buffers.allocations
+    return report
+
+
+def format_bytes(count):
+    """Formats a byte count as MB for log lines ('n/a' for None)."""
+    return 'n/a' if count is None else f"{count / (1024 * 1024):.1f} MB"
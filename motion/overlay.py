@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+
+from motion.buffers import BufferSet
+
+# 掩码外接矩形超过整幅图像的该比例时（如噪点遍布全图），改为整幅 addWeighted 混合
+MAX_BOX_FRACTION = 0.4
+
+def blend_lut(weight, offset=0.0):
+    """
+    Lookup table of saturate(round(weight * v + offset)) for every grey level v, computed in
+    float32 and rounded half to even like cv2.addWeighted.
+    """
+    levels = np.arange(256, dtype=np.float32)
+    values = levels * np.float32(weight) + np.float32(offset)
+    return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+
+class OverlayRenderer:
+    """
+    Tints the masked pixels of a BGR image in one pass, reproducing the cv2.addWeighted
+    overlays of the scripts without building a full-frame color plane.
+
+    Masked pixels become image_weight * v + alpha * color (per channel); the other pixels
+    become unmasked_weight * v, and are not touched at all when it is 1 and the image is
+    rendered in place. The blend is applied through lookup tables, only inside the mask's
+    bounding rectangle and only to the channels the tint changes, so the result is identical
+    to the addWeighted version. When the bounding rectangle covers most of the frame, a
+    single full-frame addWeighted is cheaper and gives the same pixels.
+
+    Parameters:
+    - color: BGR tint; channels with 0 are only scaled by image_weight.
+    - alpha: Weight of the tint.
+    - image_weight: Weight of the image under the mask.
+    - unmasked_weight: Weight of the image outside the mask (1 leaves it unchanged).
+    - buffers: BufferSet for the output and scratch buffers (a new one if None).
+    - name: Prefix of this renderer's buffers.
+    """
+
+    def __init__(self, color=(0, 0, 255), alpha=0.5, image_weight=None, unmasked_weight=1.0,
+                 buffers=None, name='overlay'):
+        if image_weight is None:
+            image_weight = 1 - alpha
+        self.buffers = buffers if buffers is not None else BufferSet()
+        self.name = name
+        self.color = tuple(float(c) for c in color)
+        self.alpha = alpha
+        self.image_weight = image_weight
+        self.unmasked_weight = unmasked_weight
+        # 每个通道一张查表：掩码内为 image_weight * v + alpha * color[c]
+        self.channel_luts = [blend_lut(image_weight, alpha * c) for c in color]
+        self.unmasked_lut = blend_lut(unmasked_weight)
+        # 各通道查表相同时整体查表一次，否则只对掩码内外结果不同的通道查表
+        same = all(np.array_equal(lut, self.channel_luts[0]) for lut in self.channel_luts)
+        self._shared_lut = self.channel_luts[0] if same else None
+        self._solid_shape = None
+        self._tinted_channels = [] if same else [
+            channel for channel, lut in enumerate(self.channel_luts) if not np.array_equal(lut, self.unmasked_lut)]
+
+    def render(self, image, mask, dst=None, in_place=False):
+        """
+        Returns the overlay of mask (bool or 0/255, same height and width) on image.
+
+        Parameters:
+        - image: BGR uint8 image.
+        - mask: Motion mask.
+        - dst: Optional output array; by default a reused buffer, overwritten by the next call.
+        - in_place: Draw into image itself (it must be writable).
+        """
+        if in_place:
+            dst = image
+        elif dst is None:
+            dst = self.buffers.get(f'{self.name}.result', image.shape)
+        mask = mask.view(np.uint8) if mask.dtype == bool else mask
+
+        # 只在掩码的外接矩形内着色；先按原始像素算好着色结果，再处理掩码外的像素（支持原地绘制）
+        x, y, width, height = cv2.boundingRect(mask)
+        if width * height > MAX_BOX_FRACTION * mask.size and self.unmasked_weight in (
+                self.image_weight, self.image_weight + self.alpha):
+            return self._blend(image, mask, dst)
+        box = (slice(y, y + height), slice(x, x + width))
+        tinted = self._tint(image[box], mask[box]) if width and height else []
+        if self.unmasked_weight != 1:
+            cv2.addWeighted(image, self.unmasked_weight, image, 0, 0, dst=dst)
+        elif dst is not image:
+            np.copyto(dst, image)
+
+        for channel, values in tinted:
+            if channel is None:
+                cv2.copyTo(values, mask[box], dst[box])
+            else:
+                # 单通道结果写回：取出该通道，按掩码复制后再放回
+                plane = cv2.extractChannel(dst[box], channel, dst=self.buffers.get(f'{self.name}.plane', values.shape))
+                cv2.copyTo(values, mask[box], plane)
+                dst[box][:, :, channel] = plane
+        return dst
+
+    def _blend(self, image, mask, dst):
+        # 整幅混合：掩码外为 unmasked_weight * v，掩码内为 image_weight * v + alpha * color
+        color_plane = self.buffers.get(f'{self.name}.color', image.shape)
+        if self.unmasked_weight == self.image_weight:
+            color_plane.fill(0)
+        else:
+            # 掩码外用图像本身参与混合：alpha * v + image_weight * v
+            np.copyto(color_plane, image)
+        solid = self.buffers.get(f'{self.name}.solid', image.shape)
+        if self._solid_shape != image.shape:
+            solid[...] = self.color
+            self._solid_shape = image.shape
+        cv2.copyTo(solid, mask, color_plane)
+        return cv2.addWeighted(image, self.image_weight, color_plane, self.alpha, 0, dst=dst)
+
+    def _tint(self, image, mask):
+        if self._shared_lut is not None:
+            values = cv2.LUT(image, self._shared_lut, dst=self.buffers.get(f'{self.name}.tinted', image.shape))
+            return [(None, values)]
+        tinted = []
+        for channel in self._tinted_channels:
+            plane = cv2.extractChannel(image, channel, dst=self.buffers.get(f'{self.name}.source{channel}', mask.shape))
+            values = cv2.LUT(plane, self.channel_luts[channel],
+                             dst=self.buffers.get(f'{self.name}.tinted{channel}', mask.shape))
+            tinted.append((channel, values))
+        return tinted
@@ -0,0 +1,110 @@
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# 每个任务的结果：index 为提交顺序，error 为 None 表示成功
+TaskResult = namedtuple('TaskResult', ['index', 'args', 'value', 'error'])
+
+
+def default_workers():
+    """Returns the default worker count: one per CPU core."""
+    return os.cpu_count() or 1
+
+
+def run_in_pool(func, tasks, workers=None, max_in_flight=None, ordered=True):
+    """
+    Runs func(*args) for every args tuple in tasks on a process pool and yields the results.
+
+    An exception raised by func is caught in the worker and reported in the result, so one
+    bad triplet never stops the run. If a worker process dies (e.g. a native crash while
+    decoding a corrupt JPEG), the pool is rebuilt and the tasks that were in flight are
+    re-run one at a time in a separate process, so only the task that kills its worker is
+    reported as failed.
+
+    Parameters:
+    - func: Picklable top-level function executed in the workers.
+    - tasks: Iterable of argument tuples; consumed lazily.
+    - workers: Number of worker processes (default: CPU count).
+    - max_in_flight: Upper bound on submitted but unfinished tasks (default: 2 * workers).
+    - ordered: Yield results in submission order if True, in completion order otherwise.
+
+    Yields:
+    - TaskResult(index, args, value, error) for every task.
+    """
+    workers = workers or default_workers()
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+
+    task_iter = enumerate(tasks)
+    exhausted = False
+    in_flight = {}  # future -> (index, args)
+    pending = {}  # 有序输出时等待前面任务的结果
+    next_index = 0
+
+    def emit(result):
+        nonlocal next_index
+        if not ordered:
+            yield result
+            return
+        pending[result.index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            # 补充任务直到达到在途上限
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    index, args = next(task_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(_call, func, args)] = (index, args)
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                index, args = in_flight.pop(future)
+                try:
+                    value, error = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    in_flight[future] = (index, args)
+                    continue
+                yield from emit(TaskResult(index, args, value, error))
+
+            if broken:
+                # 进程池已损坏：重建进程池，并逐个隔离重跑所有在途任务以找出导致崩溃的任务
+                suspects = sorted(in_flight.values(), key=lambda item: item[0])
+                in_flight.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                logging.warning(f"Worker process died; re-running {len(suspects)} in-flight tasks in isolation.")
+                for index, args in suspects:
+                    yield from emit(_run_isolated(func, index, args))
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _run_isolated(func, index, args):
+    # 单独的进程中运行一个任务；若进程再次崩溃则只记录该任务失败
+    with ProcessPoolExecutor(max_workers=1) as solo:
+        try:
+            value, error = solo.submit(_call, func, args).result()
+        except BrokenProcessPool:
+            value, error = None, 'worker process crashed'
+    return TaskResult(index, args, value, error)
+
+
+def _call(func, args):
+    # 在工作进程中捕获异常，避免单个任务失败影响整个批处理
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
@@ -0,0 +1,272 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from motion.profiling import NULL_PROFILER
+
+# 流水线的一个阶段：func(item) 的返回值交给下一阶段（None 表示丢弃该项），workers 为该阶段的线程数
+Stage = namedtuple('Stage', ['name', 'func', 'workers'])
+
+# 阶段结束标记：每个下游线程收到一个
+_DONE = object()
+
+# 等待队列时检查停止标志的间隔（秒）
+_POLL_SECONDS = 0.1
+
+
+class _OccupancyQueue:
+    """Bounded queue that integrates its fill level over time for the occupancy report."""
+
+    def __init__(self, maxsize):
+        self.maxsize = max(1, maxsize)
+        self._queue = queue.Queue(self.maxsize)
+        self._lock = threading.Lock()
+        self._level = 0
+        self._area = 0.0
+        self._full_seconds = 0.0
+        self._since = time.perf_counter()
+        self.peak = 0
+        self.put_wait = 0.0
+        self.get_wait = 0.0
+
+    def put(self, item, stop):
+        # 先计入再放入队列，消费者取走并减一时该项一定已计入，占用不会小于 0
+        counted = item is not _DONE
+        if counted:
+            with self._lock:
+                self._change(1)
+        start = time.perf_counter()
+        while True:
+            try:
+                self._queue.put(item, timeout=_POLL_SECONDS)
+                break
+            except queue.Full:
+                if stop.is_set():
+                    with self._lock:
+                        self.put_wait += time.perf_counter() - start
+                        if counted:
+                            self._change(-1)
+                    return False
+        with self._lock:
+            self.put_wait += time.perf_counter() - start
+        return True
+
+    def get(self, stop):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self._queue.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    return _DONE
+        with self._lock:
+            self.get_wait += time.perf_counter() - start
+            if item is not _DONE:
+                self._change(-1)
+        return item
+
+    def _change(self, delta):
+        # 按时间积分队列长度：平均占用 = 面积 / 时长
+        # _level 还包括正等待放入的项，队列本身最多 maxsize 项
+        now = time.perf_counter()
+        elapsed = now - self._since
+        occupancy = min(self._level, self.maxsize)
+        self._area += occupancy * elapsed
+        if occupancy >= self.maxsize:
+            self._full_seconds += elapsed
+        self._since = now
+        self._level += delta
+        self.peak = max(self.peak, min(self._level, self.maxsize))
+
+    def stats(self, elapsed):
+        with self._lock:
+            self._change(0)
+            return {
+                'queue_size': self.maxsize,
+                'mean_occupancy': self._area / elapsed if elapsed else 0.0,
+                'peak_occupancy': self.peak,
+                'full_fraction': self._full_seconds / elapsed if elapsed else 0.0,
+                'put_wait_seconds': self.put_wait,
+                'get_wait_seconds': self.get_wait,
+            }
+
+
+class Pipeline:
+    """
+    Staged producer/consumer pipeline on threads, e.g. readers -> compute -> writers.
+
+    Every stage runs its func on its own threads and feeds the next stage through a bounded
+    queue, so a slow stage blocks the ones before it instead of letting work pile up in
+    memory. OpenCV releases the GIL while decoding, computing and encoding, so the stages
+    overlap disk and CPU work. Results of the last stage are yielded to the caller's thread
+    (for work that must stay on one thread, such as a MaskStore or manifest), in completion
+    order.
+
+    An exception raised by a stage is logged and counted, and only that item is dropped.
+    Functions running on more than one thread must not share work buffers; see PerThread.
+
+    Parameters:
+    - stages: List of Stage(name, func, workers).
+    - queue_size: Capacity of each queue between stages (and of the result queue).
+    - profiler: Optional motion.profiling.Profiler timing every stage under its name.
+    """
+
+    def __init__(self, stages, queue_size=8, profiler=None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = [Stage(stage.name, stage.func, max(1, stage.workers)) for stage in stages]
+        self.queue_size = queue_size
+        self.profiler = profiler or NULL_PROFILER
+        self._report = None
+
+    def run(self, items):
+        """
+        Feeds items through the stages and yields the results of the last stage.
+
+        Stopping the iteration early stops every stage; items in flight are discarded.
+        """
+        queues = [_OccupancyQueue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        lock = threading.Lock()
+        remaining = [stage.workers for stage in self.stages]
+        counters = [dict(processed=0, dropped=0, errors=0, busy_seconds=0.0) for _ in self.stages]
+        start = time.perf_counter()
+
+        def feed():
+            try:
+                for item in items:
+                    if not queues[0].put(item, stop):
+                        return
+            except Exception as e:
+                logging.error(f"Pipeline input failed: {type(e).__name__}: {e}")
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE, stop)
+
+        def work(index):
+            stage = self.stages[index]
+            downstream = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            counter = counters[index]
+            while not stop.is_set():
+                item = queues[index].get(stop)
+                if item is _DONE:
+                    break
+                began = time.perf_counter()
+                try:
+                    with self.profiler.stage(stage.name):
+                        result = stage.func(item)
+                except Exception as e:
+                    result = None
+                    with lock:
+                        counter['errors'] += 1
+                    logging.error(f"Pipeline stage {stage.name} failed: {type(e).__name__}: {e}")
+                with lock:
+                    counter['busy_seconds'] += time.perf_counter() - began
+                    counter['processed'] += 1
+                    if result is None:
+                        counter['dropped'] += 1
+                if result is not None and not queues[index + 1].put(result, stop):
+                    break
+            # 本阶段最后一个线程结束时通知下游的每个线程
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last:
+                for _ in range(downstream):
+                    queues[index + 1].put(_DONE, stop)
+
+        threads = [threading.Thread(target=feed, name='pipeline-feed', daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=work, args=(index,), name=f'pipeline-{stage.name}-{i}', daemon=True)
+                        for i in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                result = queues[-1].get(stop)
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            self._report = self._build_report(elapsed, queues, counters)
+
+    def report(self):
+        """
+        Per-stage statistics of the last run: items processed and dropped, errors, busy time,
+        utilization (busy time / (elapsed * workers)) and the occupancy of the stage's input
+        queue. The bottleneck is the stage with the highest utilization; the queue in front of
+        it is usually the fullest.
+        """
+        return self._report
+
+    def summary(self):
+        """One line per stage with its utilization and input-queue occupancy, and the bottleneck."""
+        report = self._report
+        if report is None:
+            return 'Pipeline has not run'
+        lines = [f"Pipeline: {report['elapsed']:.2f} s, bottleneck: {report['bottleneck']}"]
+        for stage in report['stages']:
+            lines.append(f"  {stage['name']} x{stage['workers']}: {stage['processed']} items "
+                         f"({stage['dropped']} dropped, {stage['errors']} errors), "
+                         f"{stage['utilization']:.0%} busy, input queue {stage['mean_occupancy']:.1f}/"
+                         f"{stage['queue_size']} on average, full {stage['full_fraction']:.0%} of the time")
+        return '\n'.join(lines)
+
+    def _build_report(self, elapsed, queues, counters):
+        stages = []
+        for index, stage in enumerate(self.stages):
+            stats = dict(name=stage.name, workers=stage.workers, **counters[index])
+            stats['utilization'] = stats['busy_seconds'] / (elapsed * stage.workers) if elapsed else 0.0
+            stats.update(queues[index].stats(elapsed))
+            stages.append(stats)
+        bottleneck = max(stages, key=lambda stats: stats['utilization'])['name']
+        return {'elapsed': elapsed, 'bottleneck': bottleneck, 'stages': stages,
+                'results': queues[-1].stats(elapsed)}
+
+
+class PerThread:
+    """
+    One object per thread, created on first use by factory() (e.g. a detector with its own
+    motion.buffers.BufferSet), for stage functions running on several threads.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._values = []
+
+    def get(self):
+        value = getattr(self._local, 'value', None)
+        if value is None:
+            value = self._local.value = self.factory()
+            with self._lock:
+                self._values.append(value)
+        return value
+
+    def values(self):
+        """Every object created so far (e.g. to merge per-thread statistics)."""
+        with self._lock:
+            return list(self._values)
+
+
+def three_stage_pipeline(read, compute, write, readers=2, compute_workers=2, writers=2, queue_size=8,
+                         profiler=None):
+    """
+    Pipeline of the scripts: reader threads decode, compute threads detect and render, writer
+    threads encode and save.
+
+    Parameters:
+    - read, compute, write: Stage functions (see Pipeline).
+    - readers, compute_workers, writers: Threads per stage.
+    - queue_size: Capacity of the queues between the stages.
+    - profiler: Optional motion.profiling.Profiler timing 'read', 'compute' and 'write'.
+    """
+    return Pipeline([Stage('read', read, readers), Stage('compute', compute, compute_workers),
+                     Stage('write', write, writers)], queue_size, profiler)
@@ -0,0 +1,180 @@
+import json
+import logging
+import signal
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+# 直方图桶的上界（秒），与 Prometheus 的 le 标签对应
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 各脚本计时的处理阶段
+STAGES = ('decode', 'grayscale', 'diff', 'flow', 'threshold', 'overlay', 'encode', 'write')
+
+_NULL_STAGE = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """
+    Per-stage latency histograms for a run.
+
+    Wrap each stage in `with profiler.stage('decode'):`. A disabled profiler returns a shared
+    no-op context manager, so leaving the hooks in place costs one method call per stage.
+
+    Parameters:
+    - enabled: Record timings (False makes every hook a no-op).
+    - buckets: Upper bounds of the histogram buckets in seconds.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        # 可重入锁：信号处理函数可能在主线程记录过程中调用 dump
+        self._lock = threading.RLock()
+        self._stages = {}
+
+    def stage(self, name):
+        """Context manager timing one execution of the named stage."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds):
+        """Adds one duration (in seconds) to the histogram of a stage."""
+        with self._lock:
+            histogram = self._stages.get(name)
+            if histogram is None:
+                histogram = self._stages[name] = _empty_histogram(len(self.buckets))
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['min'] = seconds if histogram['min'] is None else min(histogram['min'], seconds)
+            histogram['max'] = max(histogram['max'], seconds)
+            histogram['counts'][bisect_left(self.buckets, seconds)] += 1
+
+    def merge(self, snapshot):
+        """
+        Adds the histograms of a snapshot() taken elsewhere, e.g. in a worker process.
+        The snapshot must use the same buckets.
+        """
+        if tuple(snapshot['buckets']) != self.buckets:
+            raise ValueError("Cannot merge profiles with different buckets")
+        with self._lock:
+            for name, other in snapshot['stages'].items():
+                histogram = self._stages.get(name)
+                if histogram is None:
+                    histogram = self._stages[name] = _empty_histogram(len(self.buckets))
+                histogram['count'] += other['count']
+                histogram['sum'] += other['sum']
+                if other['min'] is not None:
+                    histogram['min'] = other['min'] if histogram['min'] is None else min(histogram['min'], other['min'])
+                histogram['max'] = max(histogram['max'], other['max'])
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], other['counts'])]
+
+    def snapshot(self):
+        """
+        Returns a JSON-serialisable copy of the histograms.
+
+        Returns:
+        - {'buckets': [...], 'stages': {name: {'count', 'sum', 'min', 'max', 'counts'}}}, where
+          counts has one entry per bucket plus a final overflow entry.
+        """
+        with self._lock:
+            stages = {name: dict(histogram, counts=list(histogram['counts']))
+                      for name, histogram in self._ordered_stages()}
+        return {'buckets': list(self.buckets), 'stages': stages}
+
+    def summary(self):
+        """Returns {stage: (count, total_seconds, mean_seconds)} for log lines."""
+        with self._lock:
+            return {name: (h['count'], h['sum'], h['sum'] / h['count'] if h['count'] else 0.0)
+                    for name, h in self._ordered_stages()}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, metric='motion_stage_seconds'):
+        """Returns the histograms in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [f"# HELP {metric} Time spent per processing stage.", f"# TYPE {metric} histogram"]
+        for name, histogram in snapshot['stages'].items():
+            cumulative = 0
+            for bound, count in zip(snapshot['buckets'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {histogram["sum"]}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Writes the histograms to path: Prometheus text for .prom/.txt, JSON otherwise."""
+        text = self.to_prometheus() if path.lower().endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def dump_on_signal(self, path, signum=None):
+        """
+        Dumps the histograms to path whenever the process receives signum (default SIGUSR1),
+        so a long run can be inspected without stopping it.
+
+        Returns:
+        - False if the signal is not available on this platform (e.g. Windows).
+        """
+        signum = signum if signum is not None else getattr(signal, 'SIGUSR1', None)
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, lambda *_: self.dump(path))
+        return True
+
+    def _ordered_stages(self):
+        # 已知阶段按处理顺序排列，其余阶段按名称排列
+        order = {name: i for i, name in enumerate(STAGES)}
+        return sorted(self._stages.items(), key=lambda item: (order.get(item[0], len(order)), item[0]))
+
+
+# 未启用分析时各钩子共用的空实现
+NULL_PROFILER = Profiler(enabled=False)
+
+
+def open_profiler(path):
+    """
+    Returns an enabled Profiler dumping to path on SIGUSR1, or NULL_PROFILER when path is
+    None (profiling disabled). Call log_profile(profiler, path) at the end of the run.
+    """
+    if path is None:
+        return NULL_PROFILER
+    profiler = Profiler()
+    profiler.dump_on_signal(path)
+    return profiler
+
+
+def log_profile(profiler, path):
+    """
+    Writes the histograms of an enabled profiler to path and logs the time spent per stage.
+    Does nothing for a disabled profiler.
+    """
+    if not profiler.enabled:
+        return
+    profiler.dump(path)
+    for stage, (count, total, mean) in profiler.summary().items():
+        logging.info(f"Stage {stage}: {count} calls, {total:.2f} s total, {mean * 1000:.1f} ms mean")
+    logging.info(f"Wrote stage profile to {path}")
+
+
+def _empty_histogram(bucket_count):
+    return {'count': 0, 'sum': 0.0, 'min': None, 'max': 0.0, 'counts': [0] * (bucket_count + 1)}
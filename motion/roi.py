@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+
+def contour_boxes(mask, min_area=225, iterations=2):
+    """
+    Bounding boxes (x, y, w, h) of the motion regions in a binary mask, as in main1.py:
+    erode/dilate to remove noise, then keep external contours of at least min_area pixels.
+
+    Parameters:
+    - mask: uint8 (0/255) or bool motion mask.
+    - min_area: Minimum contour area in pixels.
+    - iterations: Erode/dilate iterations for the noise removal (0 to skip).
+    """
+    mask = mask.astype(np.uint8) * 255 if mask.dtype == bool else mask
+    if iterations:
+        mask = cv2.erode(mask, None, iterations=iterations)
+        mask = cv2.dilate(mask, None, iterations=iterations)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [cv2.boundingRect(contour) for contour in contours if cv2.contourArea(contour) >= min_area]
+
+
+def mask_to_rois(mask, min_area=225, padding=32, min_size=64, merge_gap=16, iterations=2):
+    """
+    Turns a motion mask into merged, padded regions of interest for the detector.
+
+    Parameters:
+    - mask: uint8 (0/255) or bool motion mask.
+    - min_area: Minimum contour area in pixels.
+    - padding: Context added on each side of a motion box, so animals only partly moving
+      are still fully inside the crop.
+    - min_size: Minimum ROI edge length; small boxes are grown around their centre.
+    - merge_gap: Boxes closer than this (after padding) are merged into one.
+    - iterations: Erode/dilate iterations for the noise removal.
+
+    Returns:
+    - List of (x0, y0, x1, y1) boxes clipped to the frame.
+    """
+    height, width = mask.shape[:2]
+    boxes = []
+    for x, y, w, h in contour_boxes(mask, min_area, iterations):
+        x0, y0, x1, y1 = x - padding, y - padding, x + w + padding, y + h + padding
+        # 太小的区域以中心为基准扩大到最小尺寸
+        if x1 - x0 < min_size:
+            cx = (x0 + x1) // 2
+            x0, x1 = cx - min_size // 2, cx + (min_size + 1) // 2
+        if y1 - y0 < min_size:
+            cy = (y0 + y1) // 2
+            y0, y1 = cy - min_size // 2, cy + (min_size + 1) // 2
+        boxes.append((max(0, x0), max(0, y0), min(width, x1), min(height, y1)))
+    return merge_boxes(boxes, merge_gap)
+
+
+def merge_boxes(boxes, gap=0):
+    """
+    Repeatedly merges boxes that overlap or lie within gap pixels of each other.
+
+    Parameters:
+    - boxes: List of (x0, y0, x1, y1).
+    - gap: Distance in pixels under which two boxes are merged.
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if _near(box, other, gap):
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def roi_pixel_fraction(rois, shape):
+    """Fraction of the frame area covered by the ROIs (boxes assumed non-overlapping)."""
+    area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in rois)
+    return area / float(shape[0] * shape[1])
+
+
+def crop_rois(image, rois):
+    """Returns views of image for each (x0, y0, x1, y1) ROI."""
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in rois]
+
+
+def to_full_frame(xyxy, roi):
+    """
+    Maps detection boxes from ROI crop coordinates back to full-frame coordinates.
+
+    Parameters:
+    - xyxy: (N, 4) array-like of boxes in crop coordinates (numpy array or torch tensor).
+    - roi: The (x0, y0, x1, y1) the crop was taken from.
+    """
+    if hasattr(xyxy, 'cpu'):
+        xyxy = xyxy.cpu().numpy()
+    boxes = np.array(xyxy, dtype=np.float32).reshape(-1, 4)
+    boxes[:, [0, 2]] += roi[0]
+    boxes[:, [1, 3]] += roi[1]
+    return boxes
+
+
+def _near(a, b, gap):
+    return not (a[2] + gap < b[0] or b[2] + gap < a[0] or a[3] + gap < b[1] or b[3] + gap < a[1])
@@ -0,0 +1,357 @@
+import struct
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from motion.detect import motion_fraction
+from motion.detectors import FarnebackDetector, ThreeFrameDiffDetector
+from motion.flow import WINSIZE, scaled_winsize
+from motion.profiling import NULL_PROFILER
+
+# 解码时直接缩小的灰度读取标志；JPEG 在 DCT 域内缩放，解码量随之减少
+REDUCED_GRAYSCALE = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+SIGNATURE_SOURCES = ('exif', 'reduced')
+
+
+def read_reduced_gray(path, factor=4):
+    """
+    Decodes an image straight to grayscale at 1/factor of its size (factor 1, 2, 4 or 8).
+    Returns None if the file cannot be read.
+    """
+    if factor not in REDUCED_GRAYSCALE:
+        raise ValueError(f"Unsupported reduction factor: {factor}")
+    return cv2.imread(path, REDUCED_GRAYSCALE[factor])
+
+
+def read_exif_thumbnail(path):
+    """
+    Returns the JPEG thumbnail embedded in the EXIF data of a JPEG file (IFD1), or None if
+    there is none. Only the file header is read, the image itself is not decoded.
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            header = f.read(4)
+            if len(header) < 4 or header[0] != 0xFF:
+                return None
+            marker, length = header[1], struct.unpack('>H', header[2:])[0]
+            if marker in (0xDA, 0xD9) or length < 2:
+                # 已到图像数据，之前没有 EXIF 段
+                return None
+            if marker == 0xE1:
+                segment = f.read(length - 2)
+                if segment.startswith(b'Exif\x00\x00'):
+                    return _tiff_thumbnail(segment[6:])
+            else:
+                f.seek(length - 2, 1)
+
+
+def _tiff_thumbnail(tiff):
+    # EXIF 数据为 TIFF 结构：IFD0 之后的 IFD1 记录缩略图的偏移（0x0201）和长度（0x0202）
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd0 = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[ifd0:ifd0 + 2])[0]
+        ifd1 = struct.unpack(order + 'I', tiff[ifd0 + 2 + 12 * count:ifd0 + 6 + 12 * count])[0]
+        if ifd1 == 0:
+            return None
+        tags = {}
+        for i in range(struct.unpack(order + 'H', tiff[ifd1:ifd1 + 2])[0]):
+            entry = tiff[ifd1 + 2 + 12 * i:ifd1 + 14 + 12 * i]
+            tag, kind = struct.unpack(order + 'HH', entry[:4])
+            tags[tag] = struct.unpack(order + ('H' if kind == 3 else 'I'), entry[8:10 if kind == 3 else 12])[0]
+    except (KeyError, struct.error):
+        return None
+    offset, length = tags.get(0x0201), tags.get(0x0202)
+    if not offset or not length or tiff[offset:offset + 2] != b'\xff\xd8':
+        return None
+    return tiff[offset:offset + length]
+
+
+def block_means(gray, grid=(16, 12)):
+    """Mean grey level of each cell of a (columns, rows) grid over a grayscale image, as float32."""
+    return cv2.resize(gray, grid, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def screening_diff_detector(threshold=25, merge='threshold_first', buffers=None):
+    """
+    Three-frame difference detector for reduced frames. Pixel differences do not depend on
+    the image scale, so the full-resolution threshold is kept.
+    """
+    return ThreeFrameDiffDetector(threshold, merge, buffers=buffers, name='screen')
+
+
+def screening_flow_detector(threshold=1, winsize=WINSIZE, factor=4, frames=2, combine='and', buffers=None):
+    """
+    Farneback detector for frames reduced by factor: flow magnitudes shrink with the image,
+    so the threshold is divided by factor and the window scaled to the same physical area.
+    """
+    return FarnebackDetector(threshold / factor, scaled_winsize(winsize, 1.0 / factor), frames, combine,
+                             buffers=buffers, name='screen')
+
+
+class Screener:
+    """
+    Cheap first pass that decodes frames at reduced resolution and runs a detector on them,
+    so full-resolution frames are only decoded for triplets that show motion.
+
+    Frames that cannot be decoded at reduced size pass, so the full-resolution path reports
+    them as usual.
+
+    Parameters:
+    - detector: Detector for the reduced frames, e.g. from screening_diff_detector() or
+      screening_flow_detector().
+    - factor: Reduction factor, 2, 4 or 8 (1 disables the reduction but still screens).
+    - min_motion_fraction: Frames pass when more than this fraction of the reduced mask
+      shows motion.
+    - profiler: Optional motion.profiling.Profiler timing 'screen_decode' and 'screen_detect'.
+    """
+
+    def __init__(self, detector, factor=4, min_motion_fraction=0.0, profiler=None):
+        if factor not in REDUCED_GRAYSCALE:
+            raise ValueError(f"Unsupported reduction factor: {factor}")
+        self.detector = detector
+        self.factor = factor
+        self.min_motion_fraction = min_motion_fraction
+        self.profiler = profiler or NULL_PROFILER
+        self.screened = 0
+        self.passed = 0
+        self.unreadable = 0
+
+    def passes(self, paths):
+        """
+        Returns True if the frames at paths show motion at reduced resolution (or could not
+        be decoded), False if they can be skipped.
+        """
+        self.screened += 1
+        with self.profiler.stage('screen_decode'):
+            grays = [read_reduced_gray(path, self.factor) for path in paths[:self.detector.frames_required]]
+        if any(gray is None for gray in grays):
+            self.unreadable += 1
+            self.passed += 1
+            return True
+
+        # 尺寸不一致时缩放到第一帧的尺寸
+        height, width = grays[0].shape[:2]
+        grays = [gray if gray.shape[:2] == (height, width) else cv2.resize(gray, (width, height))
+                 for gray in grays]
+
+        with self.profiler.stage('screen_detect'):
+            passed = motion_fraction(self.detector.detect(grays)) > self.min_motion_fraction
+        if passed:
+            self.passed += 1
+        return passed
+
+    def stats(self):
+        """Returns the screened, passed, rejected and unreadable counts and the pass rate."""
+        return {
+            'screened': self.screened,
+            'passed': self.passed,
+            'rejected': self.screened - self.passed,
+            'unreadable': self.unreadable,
+            'pass_rate': self.passed / self.screened if self.screened else 0.0,
+        }
+
+
+class SignatureScreener:
+    """
+    Cheapest screening stage: compares per-frame signatures (block means on a coarse grid)
+    and rejects frames whose blocks all stay within threshold grey levels of each other.
+
+    Signatures come from the thumbnail embedded in the EXIF data when there is one (only the
+    file header is read), otherwise from a decode at 1/factor size. Each frame's signature is
+    computed once and kept for the last cache_size frames, so frames shared by several
+    windows are not read again. Frames without a signature, or whose signatures come from
+    different sources, pass.
+
+    Parameters:
+    - threshold: Largest block-mean change (grey levels) between consecutive frames that
+      still counts as static.
+    - grid: (columns, rows) of the block grid.
+    - source: 'exif' (EXIF thumbnail, falling back to a reduced decode) or 'reduced'.
+    - factor: Reduction factor of the fallback decode (2, 4 or 8).
+    - cache_size: Number of frame signatures kept.
+    - profiler: Optional motion.profiling.Profiler timing 'signature'.
+    """
+
+    def __init__(self, threshold=3.0, grid=(16, 12), source='exif', factor=8, cache_size=64, profiler=None):
+        if source not in SIGNATURE_SOURCES:
+            raise ValueError(f"Unknown signature source: {source}")
+        if factor not in REDUCED_GRAYSCALE:
+            raise ValueError(f"Unsupported reduction factor: {factor}")
+        self.threshold = threshold
+        self.grid = tuple(grid)
+        self.source = source
+        self.factor = factor
+        self.cache_size = cache_size
+        self.profiler = profiler or NULL_PROFILER
+        self.screened = 0
+        self.passed = 0
+        self.unreadable = 0
+        self.mixed = 0
+        self.from_exif = 0
+        self.computed = 0
+        self._cache = OrderedDict()
+
+    def signature(self, path):
+        """Returns (source, block means) for the frame at path, or None if it cannot be read."""
+        if path in self._cache:
+            self._cache.move_to_end(path)
+            return self._cache[path]
+        gray = None
+        source = 'exif'
+        if self.source == 'exif':
+            thumbnail = read_exif_thumbnail(path)
+            if thumbnail is not None:
+                gray = cv2.imdecode(np.frombuffer(thumbnail, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            source = 'reduced'
+            gray = read_reduced_gray(path, self.factor)
+        signature = None if gray is None else (source, block_means(gray, self.grid))
+        self.computed += 1
+        if source == 'exif' and signature is not None:
+            self.from_exif += 1
+        self._cache[path] = signature
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return signature
+
+    def score(self, paths):
+        """
+        Largest block-mean change between consecutive frames, or None if a frame cannot be
+        read or the signatures come from different sources.
+        """
+        with self.profiler.stage('signature'):
+            signatures = [self.signature(path) for path in paths]
+        if any(signature is None for signature in signatures):
+            self.unreadable += 1
+            return None
+        if len({source for source, _ in signatures}) > 1:
+            self.mixed += 1
+            return None
+        return max(float(cv2.norm(a[1], b[1], cv2.NORM_INF)) for a, b in zip(signatures, signatures[1:]))
+
+    def passes(self, paths):
+        """Returns False if the frames at paths are clearly static, True otherwise."""
+        self.screened += 1
+        score = self.score(paths)
+        passed = score is None or score > self.threshold
+        if passed:
+            self.passed += 1
+        return passed
+
+    def stats(self):
+        """Returns the screened, passed and rejected counts, the pass rate and the signature counts."""
+        return {
+            'screened': self.screened,
+            'passed': self.passed,
+            'rejected': self.screened - self.passed,
+            'unreadable': self.unreadable,
+            'mixed': self.mixed,
+            'pass_rate': self.passed / self.screened if self.screened else 0.0,
+            'signatures': self.computed,
+            'from_exif': self.from_exif,
+        }
+
+
+class ScreenCascade:
+    """
+    Runs screening stages from the cheapest to the most expensive; frames pass only if every
+    stage passes them, and each stage only sees what the previous stages passed.
+
+    Parameters:
+    - stages: List of (name, screener) pairs, e.g. a SignatureScreener followed by a Screener.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    @property
+    def profiler(self):
+        return self.stages[0][1].profiler if self.stages else NULL_PROFILER
+
+    @profiler.setter
+    def profiler(self, profiler):
+        for _, screener in self.stages:
+            screener.profiler = profiler or NULL_PROFILER
+
+    def passes(self, paths):
+        return all(screener.passes(paths) for _, screener in self.stages)
+
+    def stats(self):
+        """
+        Returns the counts of the whole cascade (as Screener.stats()), with the per-stage
+        stats under 'stages' as (name, stats) pairs.
+        """
+        stages = [(name, screener.stats()) for name, screener in self.stages]
+        screened = stages[0][1]['screened'] if stages else 0
+        passed = stages[-1][1]['passed'] if stages else 0
+        return {
+            'screened': screened,
+            'passed': passed,
+            'rejected': screened - passed,
+            'pass_rate': passed / screened if screened else 0.0,
+            'stages': stages,
+        }
+
+    def summary(self):
+        """One line with the pass rate of every stage."""
+        return cascade_summary(self.stats())
+
+
+def merge_cascade_stats(cascades):
+    """
+    Adds up the stats of cascades with the same stages (e.g. one per pipeline thread), in
+    the form of ScreenCascade.stats().
+    """
+    merged = None
+    for cascade in cascades:
+        stats = cascade.stats()
+        if merged is None:
+            merged = stats
+            continue
+        for key in ('screened', 'passed', 'rejected'):
+            merged[key] += stats[key]
+        for (_, total), (_, stage) in zip(merged['stages'], stats['stages']):
+            for key, value in stage.items():
+                if key != 'pass_rate':
+                    total[key] += value
+    if merged is None:
+        return {'screened': 0, 'passed': 0, 'rejected': 0, 'pass_rate': 0.0, 'stages': []}
+    merged['pass_rate'] = merged['passed'] / merged['screened'] if merged['screened'] else 0.0
+    for _, stage in merged['stages']:
+        stage['pass_rate'] = stage['passed'] / stage['screened'] if stage['screened'] else 0.0
+    return merged
+
+
+def cascade_summary(stats):
+    """One line with the pass rate of every stage of ScreenCascade.stats()."""
+    return ', '.join(f"{name}: {stage['passed']} of {stage['screened']} passed ({stage['pass_rate']:.1%})"
+                     for name, stage in stats['stages'])
+
+
+def make_cascade(detector=None, factor=None, signature_threshold=None, signature_options=None, profiler=None):
+    """
+    Builds the screening cascade of the scripts, or returns None if no stage is enabled.
+
+    Parameters:
+    - detector: Detector for the reduced-resolution stage (see screening_diff_detector()).
+    - factor: Reduction factor of that stage; None leaves it out.
+    - signature_threshold: Threshold of the SignatureScreener stage; None leaves it out.
+    - signature_options: Extra SignatureScreener keyword arguments (grid, source, ...).
+    """
+    stages = []
+    if signature_threshold is not None:
+        stages.append(('signature', SignatureScreener(signature_threshold, profiler=profiler,
+                                                      **(signature_options or {}))))
+    if factor is not None:
+        stages.append((f'screen 1/{factor}', Screener(detector, factor, profiler=profiler)))
+    return ScreenCascade(stages) if stages else None
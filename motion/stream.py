@@ -0,0 +1,98 @@
+from collections import deque, namedtuple
+
+import cv2
+
+from motion.flow import WINSIZE, WarmStartFlow, flow_motion_mask
+
+# 一个滑动窗口的结果：names/images 为窗口内的帧，diff_mask 与 flow_mask 为合并后的掩码（未计算时为 None）
+Window = namedtuple('Window', ['names', 'images', 'grays', 'diff_mask', 'flow_mask'])
+
+
+def iter_frames(paths, store=None):
+    """
+    Reads each path once and yields (path, bgr, gray); unreadable files yield (path, None, None).
+
+    Parameters:
+    - paths: Image paths in burst order.
+    - store: Optional motion.framestore.FrameStore to read through.
+    """
+    for path in paths:
+        if store is not None:
+            image = store.bgr(path)
+            gray = None if image is None else store.gray(path)
+        else:
+            image = cv2.imread(path)
+            gray = None if image is None else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        yield path, image, gray
+
+
+def stream_windows(paths, window=3, diff_threshold=25, use_diff=True, flow_threshold=1,
+                   use_flow=False, flow_combine='and', winsize=WINSIZE, flow_options=None,
+                   store=None):
+    """
+    Walks a burst of any length with an overlapping window and yields one Window per step.
+
+    Every frame is decoded and converted to gray once, and the per-pair difference and flow
+    masks are computed once and shared by all windows containing that pair, so an N-frame
+    burst costs N decodes and N-1 pair computations. An unreadable frame restarts the window
+    after it.
+
+    Parameters:
+    - paths: Image paths in burst order.
+    - window: Number of frames per window (3 for the three-frame methods).
+    - diff_threshold: Threshold for the frame difference masks.
+    - use_diff: Compute the OR of the thresholded pair differences.
+    - flow_threshold: Threshold on the Farneback flow magnitude.
+    - use_flow: Compute the flow masks.
+    - flow_combine: 'and' or 'or' to merge the pair flow masks of a window.
+    - winsize: Farneback window size.
+    - flow_options: Extra keyword arguments for motion.flow.flow_motion_mask (mode, scale...).
+      In 'warm' mode each pair starts from the flow of the previous pair.
+    - store: Optional motion.framestore.FrameStore to read through.
+
+    Yields:
+    - Window(names, images, grays, diff_mask, flow_mask).
+    """
+    if window < 2:
+        raise ValueError("window must cover at least two frames")
+    flow_options = flow_options or {}
+    warm_start = WarmStartFlow() if flow_options.get('mode') == 'warm' else None
+    frames = deque(maxlen=window)
+    pairs = deque(maxlen=window - 1)  # 相邻帧对的 (diff_mask, flow_mask)
+
+    for path, image, gray in iter_frames(paths, store):
+        if image is None:
+            frames.clear()
+            pairs.clear()
+            continue
+
+        if frames:
+            prev_gray = frames[-1][2]
+            diff_mask = None
+            flow_mask = None
+            if use_diff:
+                _, diff_mask = cv2.threshold(cv2.absdiff(prev_gray, gray), diff_threshold, 255, cv2.THRESH_BINARY)
+            if use_flow:
+                flow_mask = flow_motion_mask(prev_gray, gray, flow_threshold, winsize, warm_start=warm_start,
+                                             **flow_options)
+            pairs.append((diff_mask, flow_mask))
+        frames.append((path, image, gray))
+
+        if len(frames) == window:
+            yield Window([f[0] for f in frames], [f[1] for f in frames], [f[2] for f in frames],
+                         _combine_diff(pairs) if use_diff else None,
+                         _combine_flow(pairs, flow_combine) if use_flow else None)
+
+
+def _combine_diff(pairs):
+    combined = pairs[0][0]
+    for diff_mask, _ in list(pairs)[1:]:
+        combined = cv2.bitwise_or(combined, diff_mask)
+    return combined
+
+
+def _combine_flow(pairs, how):
+    combined = pairs[0][1]
+    for _, flow_mask in list(pairs)[1:]:
+        combined = combined & flow_mask if how == 'and' else combined | flow_mask
+    return combined
@@ -0,0 +1,261 @@
+"""
+Threshold sweep: motion-area fractions for many thresholds from one diff/flow computation.
+
+Usage:
+    python -m motion.sweep D:\\RPCA\\cai --method diff --thresholds 10,15,20,25,30 --output sweep.csv
+    python -m motion.sweep D:\\RPCA\\cai --method flow --winsize 45 --frames 2 --labels labels.csv --precision precision.csv
+"""
+import argparse
+import csv
+import logging
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from motion.flow import WINSIZE, WarmStartFlow, compute_flow, flow_magnitude
+from motion.framestack import open_frame_store
+from motion.grouping import split_bursts
+from motion.index import list_images
+
+DIFF_THRESHOLDS = tuple(range(5, 65, 5))
+FLOW_THRESHOLDS = (0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 2.5, 3.0)
+
+# 浮点分数按块统计，避免为整幅图像分配下标数组
+CHUNK_PIXELS = 1 << 20
+
+
+def diff_score(grays, merge='threshold_first'):
+    """
+    Per-pixel score of the frame difference detectors: their mask at threshold t is exactly
+    score > t. Two frames give |f1 - f2|; three frames give max(|f1 - f2|, |f2 - f3|) for
+    merge='threshold_first' (new.py) or their bitwise OR for 'or_first' (帧差法.py).
+    """
+    diff1 = cv2.absdiff(grays[0], grays[1])
+    if len(grays) == 2:
+        return diff1
+    diff2 = cv2.absdiff(grays[1], grays[2])
+    if merge == 'threshold_first':
+        return cv2.max(diff1, diff2)
+    return cv2.bitwise_or(diff1, diff2)
+
+
+def flow_score(grays, winsize=WINSIZE, combine='and', flow_options=None):
+    """
+    Per-pixel score of the Farneback detectors: the flow magnitude of one pair, or the
+    minimum ('and') / maximum ('or') of the magnitudes of consecutive pairs, so the mask at
+    threshold t is score > t.
+    """
+    flow_options = flow_options or {}
+    # 'warm' 模式：第二个帧对以第一个帧对的光流为初值
+    warm_start = WarmStartFlow() if flow_options.get('mode') == 'warm' else None
+    magnitudes = [flow_magnitude(compute_flow(a, b, winsize, warm_start=warm_start, **flow_options))
+                  for a, b in zip(grays, grays[1:])]
+    if len(magnitudes) == 1:
+        return magnitudes[0]
+    reduce = np.minimum if combine == 'and' else np.maximum
+    return reduce.reduce(magnitudes)
+
+
+def exceedance_fractions(score, thresholds):
+    """
+    Fraction of pixels with score > t for every threshold t, in one pass over score.
+
+    uint8 scores use a 256-bin histogram; float scores are binned against the sorted
+    thresholds, so the cost does not grow with the number of thresholds.
+
+    Returns:
+    - Array of fractions in the order of thresholds.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(thresholds)
+    sorted_thresholds = thresholds[order]
+    values = score.reshape(-1)
+
+    if values.dtype == np.uint8:
+        histogram = np.bincount(values, minlength=256)
+        # at_least[v] 为分数 >= v 的像素数
+        at_least = np.concatenate([np.cumsum(histogram[::-1])[::-1], [0]])
+        first_above = np.clip(np.floor(sorted_thresholds).astype(np.int64) + 1, 0, 256)
+        counts = at_least[first_above]
+    else:
+        histogram = np.zeros(len(sorted_thresholds) + 1, dtype=np.int64)
+        for start in range(0, values.size, CHUNK_PIXELS):
+            bins = np.searchsorted(sorted_thresholds, values[start:start + CHUNK_PIXELS], side='left')
+            histogram += np.bincount(bins, minlength=len(histogram))
+        # 分数落在第 i 个区间时，它大于前 i 个阈值
+        counts = np.cumsum(histogram[::-1])[::-1][1:]
+
+    fractions = np.empty(len(thresholds))
+    fractions[order] = counts / float(values.size)
+    return fractions
+
+
+def iter_triplets(sorted_files, sliding=False):
+    """
+    Triplets of file names: strides of 3 over the sorted files (as the scripts), or every
+    window of 3 inside each burst of consecutive numbers when sliding.
+    """
+    if sliding:
+        for burst in split_bursts(sorted_files, min_length=3):
+            for i in range(len(burst) - 2):
+                yield burst[i:i + 3]
+        return
+    for i in range(0, len(sorted_files) - 2, 3):
+        yield sorted_files[i:i + 3]
+
+
+def sweep_folder(input_folder, method='diff', thresholds=None, merge='threshold_first', winsize=WINSIZE,
+                 frames=3, combine='and', flow_options=None, sliding=False, frame_stack_path=None):
+    """
+    Computes the diff or flow score of every triplet once and evaluates all thresholds on it.
+
+    Parameters:
+    - input_folder: Folder with the images.
+    - method: 'diff' (frame difference) or 'flow' (Farneback magnitude).
+    - thresholds: Thresholds to evaluate (default DIFF_THRESHOLDS or FLOW_THRESHOLDS).
+    - merge: Three-frame difference variant, see diff_score.
+    - winsize: Farneback window size.
+    - frames: Frames of each triplet used (2 = first pair only, as in main_tf.py).
+    - combine: 'and' / 'or' for 3-frame flow, see flow_score.
+    - flow_options: Extra keyword arguments for motion.flow.compute_flow (mode, scale, ...).
+    - sliding: Slide over bursts instead of stepping in strides of 3.
+    - frame_stack_path: Optional motion.framestack stack of input_folder to read frames from.
+
+    Returns:
+    - (names, thresholds, fractions): the middle file name of each triplet, the thresholds,
+      and a (len(names), len(thresholds)) array of motion-area fractions.
+    """
+    if method not in ('diff', 'flow'):
+        raise ValueError(f"Unknown method: {method}")
+    if thresholds is None:
+        thresholds = DIFF_THRESHOLDS if method == 'diff' else FLOW_THRESHOLDS
+    thresholds = list(thresholds)
+    store = open_frame_store(frame_stack_path)
+
+    names = []
+    rows = []
+    for triplet in iter_triplets(list_images(input_folder), sliding):
+        paths = [os.path.join(input_folder, name) for name in triplet[:frames]]
+        grays = [store.gray(path) for path in paths]
+        if any(gray is None for gray in grays):
+            logging.warning(f"Could not read one or more images of {triplet}. Skipping.")
+            continue
+        if method == 'diff':
+            score = diff_score(grays, merge)
+        else:
+            score = flow_score(grays, winsize, combine, flow_options)
+        names.append(triplet[1])
+        rows.append(exceedance_fractions(score, thresholds))
+    fractions = np.array(rows).reshape(len(rows), len(thresholds))
+    return names, thresholds, fractions
+
+
+def read_labels(path):
+    """
+    Reads 'name,label' rows (label 1/true for motion, 0/false for empty); a header row is
+    skipped. Names are the middle file of each triplet.
+    """
+    labels = {}
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2:
+                continue
+            value = row[1].strip().lower()
+            if value in ('1', 'true', 'yes', 'motion'):
+                labels[row[0].strip()] = True
+            elif value in ('0', 'false', 'no', 'empty'):
+                labels[row[0].strip()] = False
+    return labels
+
+
+def precision_table(names, thresholds, fractions, labels, min_fraction=0.0):
+    """
+    Detection quality per threshold against labels, calling a triplet positive when its
+    motion-area fraction exceeds min_fraction. Unlabelled triplets are ignored.
+
+    Returns:
+    - List of dicts with threshold, tp, fp, fn, tn, precision and recall.
+    """
+    labelled = [i for i, name in enumerate(names) if name in labels]
+    truth = np.array([labels[names[i]] for i in labelled], dtype=bool)
+    predicted = fractions[labelled] > min_fraction if labelled else np.zeros((0, len(thresholds)), bool)
+    table = []
+    for k, threshold in enumerate(thresholds):
+        positive = predicted[:, k]
+        tp = int(np.count_nonzero(positive & truth))
+        fp = int(np.count_nonzero(positive & ~truth))
+        fn = int(np.count_nonzero(~positive & truth))
+        tn = int(np.count_nonzero(~positive & ~truth))
+        table.append({
+            'threshold': threshold, 'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn,
+            'precision': tp / (tp + fp) if tp + fp else None,
+            'recall': tp / (tp + fn) if tp + fn else None,
+        })
+    return table
+
+
+def write_fractions(f, names, thresholds, fractions):
+    """Writes one CSV row per triplet with its motion-area fraction at every threshold."""
+    writer = csv.writer(f)
+    writer.writerow(['name'] + [f't{threshold:g}' for threshold in thresholds])
+    for name, row in zip(names, fractions):
+        writer.writerow([name] + [f'{value:.6g}' for value in row])
+
+
+def write_table(f, table):
+    """Writes a list of dicts as CSV."""
+    writer = csv.DictWriter(f, fieldnames=list(table[0]) if table else ['threshold'])
+    writer.writeheader()
+    writer.writerows(table)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m motion.sweep', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help='folder with the images')
+    parser.add_argument('--method', choices=['diff', 'flow'], default='diff')
+    parser.add_argument('--thresholds', default=None, help='comma separated thresholds')
+    parser.add_argument('--merge', choices=['threshold_first', 'or_first'], default='threshold_first')
+    parser.add_argument('--winsize', type=int, default=WINSIZE)
+    parser.add_argument('--frames', type=int, choices=[2, 3], default=3)
+    parser.add_argument('--combine', choices=['and', 'or'], default='and')
+    parser.add_argument('--flow-mode', choices=['full', 'downscale', 'tiled', 'warm'], default='full')
+    parser.add_argument('--flow-scale', type=float, default=0.25)
+    parser.add_argument('--sliding', action='store_true')
+    parser.add_argument('--stack', default=None, help='frame stack of the input folder (motion.framestack)')
+    parser.add_argument('--output', default=None, help='CSV of per-triplet fractions (default: stdout)')
+    parser.add_argument('--labels', default=None, help="CSV of 'name,label' for the middle frames")
+    parser.add_argument('--min-fraction', type=float, default=0.0,
+                        help='motion-area fraction above which a triplet counts as motion')
+    parser.add_argument('--precision', default=None, help='CSV of the per-threshold precision table')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    thresholds = None if args.thresholds is None else [float(t) for t in args.thresholds.split(',')]
+    names, thresholds, fractions = sweep_folder(
+        args.input, args.method, thresholds, args.merge, args.winsize, args.frames, args.combine,
+        dict(mode=args.flow_mode, scale=args.flow_scale), args.sliding, args.stack)
+
+    if args.output:
+        with open(args.output, 'w', newline='', encoding='utf-8') as f:
+            write_fractions(f, names, thresholds, fractions)
+    else:
+        write_fractions(sys.stdout, names, thresholds, fractions)
+
+    for k, threshold in enumerate(thresholds):
+        column = fractions[:, k]
+        logging.info(f"Threshold {threshold:g}: mean motion area {column.mean() if len(column) else 0:.4%}, "
+                     f"{np.count_nonzero(column > args.min_fraction)} of {len(column)} triplets with motion")
+
+    if args.labels:
+        table = precision_table(names, thresholds, fractions, read_labels(args.labels), args.min_fraction)
+        if args.precision:
+            with open(args.precision, 'w', newline='', encoding='utf-8') as f:
+                write_table(f, table)
+        else:
+            write_table(sys.stdout, table)
+
+
+if __name__ == '__main__':
+    main()
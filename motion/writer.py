@@ -0,0 +1,222 @@
+import atexit
+import logging
+import os
+import queue
+import shutil
+import threading
+
+import cv2
+
+from motion.profiling import NULL_PROFILER
+
+
+def encode_image(path, image, params=None):
+    """
+    Encodes image in the format given by the extension of path.
+
+    Parameters:
+    - path: Output path; only its extension is used ('.jpg' if it has none).
+    - image: Image to encode.
+    - params: Optional OpenCV encoder flags, e.g. [cv2.IMWRITE_JPEG_QUALITY, 90].
+
+    Returns:
+    - The encoded bytes as a numpy array, or None if encoding failed.
+    """
+    extension = os.path.splitext(path)[1] or '.jpg'
+    ok, data = cv2.imencode(extension, image, params or [])
+    return data if ok else None
+
+
+def encoder_params(path, jpeg_quality=None, png_compression=None):
+    """
+    OpenCV encoder flags for path's format: IMWRITE_JPEG_QUALITY (0-100) for JPEG and
+    IMWRITE_PNG_COMPRESSION (0-9) for PNG. None keeps OpenCV's default.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jpg', '.jpeg') and jpeg_quality is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+    if extension == '.png' and png_compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    return []
+
+
+def save_image(path, image, params=None, profiler=None):
+    """
+    Encodes and writes image, timing the 'encode' and 'write' stages separately.
+
+    The bytes go to a temporary file that is renamed over path once complete, so an
+    interrupted run never leaves a truncated image behind.
+
+    Raises:
+    - OSError if the image cannot be encoded or written.
+    """
+    profiler = profiler or NULL_PROFILER
+    with profiler.stage('encode'):
+        data = encode_image(path, image, params)
+    if data is None:
+        raise OSError(f"Could not encode image: {path}")
+    temp_path = path + '.tmp'
+    with profiler.stage('write'):
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def write_image(path, image, params=None, profiler=None):
+    """
+    Same as cv2.imwrite, with encoding and writing timed as separate stages of the optional
+    motion.profiling.Profiler.
+
+    Returns:
+    - True if the file was written, False otherwise (logged as a warning).
+    """
+    try:
+        save_image(path, image, params, profiler)
+    except OSError as e:
+        logging.warning(f"Could not write image {path}: {e}")
+        return False
+    return True
+
+
+class ImageWriter:
+    """
+    Write-behind stage: images are encoded and written by a pool of threads fed from a
+    bounded queue, so the compute loop does not wait for JPEG encoding or slow storage.
+
+    write() blocks while the queue is full (backpressure), so memory stays bounded by
+    max_queue images. close() (or leaving a `with` block) waits for every queued write and
+    returns a report of what was written and what failed; it also runs at interpreter exit
+    if it was not called.
+
+    Parameters:
+    - workers: Number of writer threads; 0 writes synchronously in the calling thread.
+    - max_queue: Number of queued writes after which write() blocks.
+    - jpeg_quality: JPEG quality (0-100) for .jpg outputs; None keeps OpenCV's default (95).
+    - png_compression: PNG compression level (0-9) for .png outputs; None keeps the default.
+    - profiler: Optional motion.profiling.Profiler; encode and write are timed in the writer
+      threads and time spent blocked on a full queue as 'write_wait'.
+    """
+
+    def __init__(self, workers=2, max_queue=32, jpeg_quality=None, png_compression=None, profiler=None):
+        self.workers = workers
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self.profiler = profiler or NULL_PROFILER
+        self.written = 0
+        self.copied = 0
+        self.errors = []  # (path, message)
+        self.max_queue_depth = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(max(1, max_queue))
+        self._threads = [threading.Thread(target=self._worker, name=f'image-writer-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+        if self._threads:
+            atexit.register(self.close)
+
+    def write(self, path, image, copy=True):
+        """
+        Queues image to be written to path (format from the extension).
+
+        Parameters:
+        - path: Output file path.
+        - image: Image to write.
+        - copy: Copy the image before queuing it. Leave True for arrays that are reused
+          afterwards, such as motion.buffers.BufferSet buffers.
+        """
+        if not self._threads:
+            self._run(('write', path, image))
+            return
+        self._put(('write', path, image.copy() if copy else image))
+
+    def copy(self, src, dst):
+        """Queues a byte-for-byte copy of the file src to dst."""
+        if not self._threads:
+            self._run(('copy', dst, src))
+            return
+        self._put(('copy', dst, src))
+
+    def flush(self):
+        """Waits until every queued write has finished."""
+        if self._threads:
+            self._queue.join()
+
+    def close(self):
+        """
+        Flushes the queue, stops the writer threads and logs any failed writes.
+
+        Returns:
+        - The report() dict.
+        """
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            if self._threads:
+                atexit.unregister(self.close)
+            for path, message in self.errors:
+                logging.error(f"Failed to write {path}: {message}")
+        return self.report()
+
+    def report(self):
+        """Returns the written, copied and failed counts, the failures and the peak queue depth."""
+        with self._lock:
+            return {
+                'written': self.written,
+                'copied': self.copied,
+                'failed': len(self.errors),
+                'errors': list(self.errors),
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _put(self, item):
+        if self._closed:
+            raise RuntimeError("ImageWriter is closed")
+        with self.profiler.stage('write_wait'):
+            self._queue.put(item)
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._run(item)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, item):
+        # 任务格式：(类型, 输出路径, 图像或源文件路径)
+        kind, path, payload = item
+        try:
+            if kind == 'write':
+                save_image(path, payload, encoder_params(path, self.jpeg_quality, self.png_compression),
+                           self.profiler)
+            else:
+                with self.profiler.stage('copy'):
+                    shutil.copyfile(payload, path)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((path, f"{type(e).__name__}: {e}"))
+            return
+        with self._lock:
+            if kind == 'write':
+                self.written += 1
+            else:
+                self.copied += 1
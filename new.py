@@ -1,9 +1,138 @@
 import cv2
 import os
-import re
 import logging
 
-def process_three_frame_difference(input_folder, output_folder, threshold=25):
+from motion.background import open_background
+from motion.buffers import BufferSet
+from motion.detect import motion_fraction
+from motion.detectors import ThreeFrameDiffDetector
+from motion.grouping import complete_triplets, group_frames
+from motion.illumination import IlluminationNormalizer, NormalizedDetector
+from motion.index import folder_files
+from motion.manifest import open_manifest
+from motion.memory import format_bytes, memory_report
+from motion.overlay import OverlayRenderer
+from motion.parallel import run_in_pool
+from motion.profiling import NULL_PROFILER, Profiler, log_profile, open_profiler
+from motion.writer import write_image
+
+# 同一进程内各组共享的工作缓冲区
+_buffers = BufferSet()
+
+# 运动区域以白色半透明叠加在中间帧上（只处理掩码内的像素）
+_renderer = OverlayRenderer(color=(255, 255, 255), alpha=0.5, image_weight=1, buffers=_buffers)
+
+# 同一进程内按方法共享的光照归一化器（累计各组的统计）
+_normalizers = {}
+
+
+def get_normalizer(method):
+    """Returns this process's IlluminationNormalizer for a method, creating it once."""
+    if method not in _normalizers:
+        _normalizers[method] = IlluminationNormalizer(method)
+    return _normalizers[method]
+
+
+def process_group(input_folder, output_folder, prefix, group, threshold=25, illumination=None, profiler=None,
+                  background=None):
+    """
+    Runs the three-frame difference on one (_1, _2, _3) group and saves the result image.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where output images will be saved.
+    - prefix: Group prefix shared by the three file names.
+    - group: Mapping of frame number (1, 2, 3) to file name.
+    - threshold: Threshold for motion detection in the difference images.
+    - illumination: 'gain' or 'histogram' to match the brightness of the outer frames to the
+      middle frame before differencing (None: no normalization).
+    - profiler: Optional motion.profiling.Profiler timing each stage.
+    - background: Optional motion.background.BackgroundModel of the camera. Once it has warmed
+      up, groups whose middle frame matches the background are skipped, and only pixels that
+      also differ from the background are marked as motion. The model learns every group.
+
+    Returns:
+    - The saved output file name, or None if the group was skipped.
+    """
+    img1_path = os.path.join(input_folder, group[1])
+    img2_path = os.path.join(input_folder, group[2])
+    img3_path = os.path.join(input_folder, group[3])
+
+    logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
+    profiler = profiler or NULL_PROFILER
+
+    # 读取图像
+    with profiler.stage('decode'):
+        img1 = cv2.imread(img1_path)
+        img2 = cv2.imread(img2_path)
+        img3 = cv2.imread(img3_path)
+
+    # 检查图像是否成功读取
+    if img1 is None:
+        logging.warning(f"Could not read image: {img1_path}")
+    if img2 is None:
+        logging.warning(f"Could not read image: {img2_path}")
+    if img3 is None:
+        logging.warning(f"Could not read image: {img3_path}")
+
+    # 跳过如果有任何图像未能读取
+    if img1 is None or img2 is None or img3 is None:
+        logging.warning(f"Skipping group {prefix} due to unreadable images.")
+        return None
+
+    # 检查并调整图像尺寸
+    if img1.shape != img2.shape or img1.shape != img3.shape:
+        # 获取第一张图的尺寸
+        height, width = img1.shape[:2]
+        img2 = cv2.resize(img2, (width, height))
+        img3 = cv2.resize(img3, (width, height))
+
+    # 与背景模型比较：中间帧与背景一致的组不再计算差分
+    foreground = None
+    if background is not None:
+        foreground = background.apply([img1, img2, img3])
+        if foreground is not None and motion_fraction(foreground) == 0:
+            logging.info(f"No change against the background in group {prefix}. Skipping.")
+            return None
+
+    # 灰度化、差分、阈值化并合并差分结果（工作缓冲区在多次调用间复用）
+    detector = ThreeFrameDiffDetector(threshold, buffers=_buffers, profiler=profiler)
+    if illumination is not None:
+        # 差分前进行光照归一化，曝光变化不再被当作运动
+        normalizer = get_normalizer(illumination)
+        normalizer.profiler = profiler
+        detector = NormalizedDetector(detector, normalizer)
+    combined_motion = detector.detect([img1, img2, img3])
+    if foreground is not None:
+        # 只保留相对背景也有变化的像素，抑制随风摆动的植被等
+        cv2.bitwise_and(combined_motion, foreground, dst=combined_motion)
+
+    # 将运动区域直接叠加在中间帧上（img2 为本组单独读取的图像，可原地修改）
+    with profiler.stage('overlay'):
+        result_img = _renderer.render(img2, combined_motion, in_place=True)
+
+    # 保存结果图像
+    output_file_name = f"motion_{prefix}_{group[2]}"
+    write_image(os.path.join(output_folder, output_file_name), result_img, profiler=profiler)
+    logging.info(f"Saved motion detected image: {output_file_name}")
+    return output_file_name
+
+
+def process_group_profiled(*args):
+    """
+    Runs process_group in a worker process with its own profiler.
+
+    Returns:
+    - (process_group result, profiler snapshot) for merging into the parent's profiler.
+    """
+    profiler = Profiler()
+    return process_group(*args, profiler=profiler), profiler.snapshot()
+
+
+def process_three_frame_difference(input_folder, output_folder, threshold=25, workers=1,
+                                   max_in_flight=None, ordered=True, manifest_path=None,
+                                   index_path=None, profile_path=None, background_dir=None,
+                                   background_options=None, illumination=None):
     """
     Processes images in the specified input folder using the three-frame difference method,
     and saves the motion detected images to the output folder.
@@ -12,98 +141,131 @@ def process_three_frame_difference(input_folder, output_folder, threshold=25):
     - input_folder: Path to the folder containing input images.
     - output_folder: Path to the folder where output images will be saved.
     - threshold: Threshold for motion detection in the difference images.
+    - workers: Number of worker processes; 1 runs serially, None uses every CPU core.
+    - max_in_flight: Maximum number of groups queued on the pool at once.
+    - ordered: Report parallel results in group order instead of completion order.
+    - index_path: Optional motion.index.FolderIndex database to read the file list from.
+    - manifest_path: SQLite file recording finished groups; groups already done with the same
+      inputs, threshold and output folder are skipped on re-runs.
+    - profile_path: If set, per-stage timing histograms are written here at the end of the
+      run and on SIGUSR1 (Prometheus text for .prom/.txt, JSON otherwise).
+    - background_dir: Folder of per-camera background models (one .npz per input folder).
+      The model is loaded, updated by every group and saved at the end of the run; groups
+      then run serially since the model learns them in order.
+    - background_options: Keyword arguments for motion.background.BackgroundModel.
+    - illumination: 'gain' or 'histogram' illumination normalization before differencing
+      (None: off). Serial runs log how many groups it moved from motion to static.
     """
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    profiler = open_profiler(profile_path)
 
     if not os.path.exists(input_folder):
         logging.error(f"Input folder {input_folder} does not exist.")
         return
 
+    background, background_file = open_background(background_dir, input_folder, profiler,
+                                                  **(background_options or {}))
+    if background is not None and workers != 1:
+        logging.warning("The background model learns groups in order; processing serially.")
+        workers = 1
+
+    manifest_params = {'threshold': threshold, 'output_folder': os.path.abspath(output_folder)}
+    if background is not None:
+        manifest_params['background'] = background.params
+    if illumination is not None:
+        manifest_params['illumination'] = illumination
+    manifest = open_manifest(manifest_path, 'new.three_frame_difference', manifest_params)
+
+    def group_paths(group):
+        return [os.path.join(input_folder, group[k]) for k in [1, 2, 3]]
+
+    def is_done(group):
+        return manifest is not None and manifest.is_done(os.path.abspath(group_paths(group)[1]), group_paths(group))
+
+    def mark_done(group, output_file_name):
+        if manifest is not None and output_file_name is not None:
+            manifest.mark_done(os.path.abspath(group_paths(group)[1]), group_paths(group),
+                               [os.path.join(output_folder, output_file_name)])
+
     try:
         # 获取输入文件夹中所有图像文件并排序
-        files = [f for f in os.listdir(input_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        logging.info(f"Files found: {files}")
-
-        # 正则表达式提取文件名前缀和后缀（_1, _2, _3）
-        pattern = re.compile(r'(.*)_(\d)\.jpg')
-        grouped_files = {}
+        files = folder_files(input_folder, index_path)
+        logging.info(f"Found {len(files)} image files in {input_folder}")
 
         # 将相同前缀的文件进行分组
-        for file in files:
-            match = pattern.match(file)
-            if match:
-                prefix = match.group(1)
-                suffix = int(match.group(2))
-                if prefix not in grouped_files:
-                    grouped_files[prefix] = {}
-                grouped_files[prefix][suffix] = file
+        grouped_files = group_frames(files)
 
         # 确保输出文件夹存在
         os.makedirs(output_folder, exist_ok=True)
 
-        # 对每组文件（_1, _2, _3）进行处理
-        for prefix, group in grouped_files.items():
-            if all(k in group for k in [1, 2, 3]):  # 检查是否存在所有帧
-                img1_path = os.path.join(input_folder, group[1])
-                img2_path = os.path.join(input_folder, group[2])
-                img3_path = os.path.join(input_folder, group[3])
-
-                logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
-
-                # 读取图像
-                img1 = cv2.imread(img1_path)
-                img2 = cv2.imread(img2_path)
-                img3 = cv2.imread(img3_path)
-
-                # 检查图像是否成功读取
-                if img1 is None:
-                    logging.warning(f"Could not read image: {img1_path}")
-                if img2 is None:
-                    logging.warning(f"Could not read image: {img2_path}")
-                if img3 is None:
-                    logging.warning(f"Could not read image: {img3_path}")
-
-                # 跳过如果有任何图像未能读取
-                if img1 is None or img2 is None or img3 is None:
-                    logging.warning(f"Skipping group {prefix} due to unreadable images.")
-                    continue
-
-                # 检查并调整图像尺寸
-                if img1.shape != img2.shape or img1.shape != img3.shape:
-                    # 获取第一张图的尺寸
-                    height, width = img1.shape[:2]
-                    img2 = cv2.resize(img2, (width, height))
-                    img3 = cv2.resize(img3, (width, height))
-
-                # 转换为灰度图像
-                gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-                gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-                gray3 = cv2.cvtColor(img3, cv2.COLOR_BGR2GRAY)
-
-                # 计算差分图像
-                diff1 = cv2.absdiff(gray1, gray2)
-                diff2 = cv2.absdiff(gray2, gray3)
-
-                # 应用阈值
-                _, diff1_t = cv2.threshold(diff1, threshold, 255, cv2.THRESH_BINARY)
-                _, diff2_t = cv2.threshold(diff2, threshold, 255, cv2.THRESH_BINARY)
-
-                # 合并差分结果
-                combined_motion = cv2.bitwise_or(diff1_t, diff2_t)
-
-                # 将运动区域叠加在中间帧上
-                result_img = cv2.addWeighted(img2, 1, combined_motion, 0.5, 0)
-
-                # 保存结果图像
-                output_file_name = f"motion_{prefix}_{group[2]}"
-                cv2.imwrite(os.path.join(output_folder, output_file_name), result_img)
-                logging.info(f"Saved motion detected image: {output_file_name}")
+        if workers == 1:
+            # 对每组文件（_1, _2, _3）进行处理
+            for prefix, group in grouped_files.items():
+                if all(k in group for k in [1, 2, 3]):  # 检查是否存在所有帧
+                    if is_done(group):  # 已处理过的组直接跳过
+                        continue
+                    mark_done(group, process_group(input_folder, output_folder, prefix, group, threshold,
+                                                   illumination, profiler, background))
+                else:
+                    logging.warning(f"Missing frames for group {prefix}. Skipping.")
+            return
+
+        triplets, missing = complete_triplets(grouped_files)
+        for prefix in missing:
+            logging.warning(f"Missing frames for group {prefix}. Skipping.")
+
+        # 多进程并行处理，每个进程独立读写自己的组
+        tasks = ((input_folder, output_folder, prefix, group, threshold, illumination)
+                 for prefix, group in triplets if not is_done(group))
+        func = process_group_profiled if profiler.enabled else process_group
+        for result in run_in_pool(func, tasks, workers=workers,
+                                  max_in_flight=max_in_flight, ordered=ordered):
+            if result.error is not None:
+                logging.error(f"Failed group {result.args[2]}: {result.error}")
+            elif profiler.enabled:
+                output_file_name, snapshot = result.value
+                profiler.merge(snapshot)
+                mark_done(result.args[3], output_file_name)
             else:
-                logging.warning(f"Missing frames for group {prefix}. Skipping.")
+                mark_done(result.args[3], result.value)
 
     except Exception as e:
         logging.error(f"Error occurred: {e}")
 
+    finally:
+        if background is not None:
+            background.save(background_file)
+            logging.info(f"Saved background model {background_file} ({background.frames_seen} frames learned, "
+                         f"{background.resets} restarts)")
+        if illumination is not None and workers == 1:
+            log_illumination(get_normalizer(illumination))
+        if manifest is not None:
+            logging.info(f"Skipped {manifest.skipped} groups already in the manifest.")
+            manifest.close()
+        log_memory_report()
+        log_profile(profiler, profile_path)
+
+
+def log_illumination(normalizer):
+    """
+    Logs how many groups were illumination-normalized and how many of them lost their motion.
+    """
+    stats = normalizer.stats()
+    logging.info(f"Illumination ({normalizer.method}): normalized {stats['normalized']} of {stats['triplets']} groups "
+                 f"({stats['infrared']} IR, {stats['mode_switches']} day/IR switches), "
+                 f"{stats['moved_to_static']} moved from motion to static")
+
+
+def log_memory_report():
+    """
+    Logs the peak memory of the run and the size of the reused work buffers.
+    """
+    report = memory_report(_buffers)
+    logging.info(f"Peak RSS: {format_bytes(report['peak_rss_bytes'])}, "
+                 f"workers: {format_bytes(report['peak_rss_children_bytes'])}, "
+                 f"work buffers: {format_bytes(report['buffer_bytes'])} "
+                 f"({report['buffer_allocations']} allocations)")
+
 if __name__ == "__main__":
     input_folder = r"D:\RPCA\cai"  # 修改为包含图片文件的文件夹路径
     output_folder = r"D:\RPCA\cai3"  # 替换为输出文件夹的路径
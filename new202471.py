@@ -1,9 +1,17 @@
 import os
-import cv2
 from PIL import Image
 from ultralytics import YOLO
 import numpy as np
 
+from motion.detect import GatedDetector, has_boxes
+from motion.flow import WarmStartFlow, flow_motion_mask
+from motion.framestore import FrameStore, copy_through
+from motion.grouping import split_bursts
+from motion.illumination import IlluminationNormalizer
+from motion.overlay import OverlayRenderer
+from motion.roi import crop_rois, mask_to_rois, roi_pixel_fraction, to_full_frame
+from motion.stream import stream_windows
+
 # 假设YOLO模型文件路径已经正确设置
 model_file = "runs/detect/train/weights/best.pt"  # 请替换为实际的模型文件路径
 model = YOLO(model_file)
@@ -12,58 +20,150 @@ model = YOLO(model_file)
 image_folder = r"C:\Users\cai_y\Desktop\测试"
 output_folder = r"C:\Users\cai_y\Desktop\测试\测试"
 
+# 光流计算方式：'full' / 'downscale' / 'tiled' / 'sparse'（只跟踪帧差变化处的点）/
+# 'warm'（以上一帧对的光流为初值），见 motion.flow.flow_motion_mask
+flow_mode = 'full'
+flow_scale = 0.25
+warm_start = WarmStartFlow() if flow_mode == 'warm' else None
+
+# 滑动窗口模式：在连续编号的连拍内逐帧滑动，相邻帧对的光流只计算一次
+sliding_window = False
+
+# 运动面积占比低于该值的三联图像不送入模型；通过的图像按批次推理。
+# 0.0 表示不跳过（所有三联都送入模型）；建议设为 0.001，跳过几乎没有运动的三联
+min_motion_fraction = 0.0
+batch_size = 8
+detector = GatedDetector(model, min_motion_fraction, batch_size)
+
+# 光照归一化：'gain'（全局增益/偏移）或 'histogram'（直方图匹配），计算光流前将首尾两帧的亮度匹配到中间帧，
+# 自动曝光变化或日夜模式切换不再被当作运动送入模型；None 表示不归一化（仅用于非滑动窗口模式）。
+# 统计被归一化从“运动”改判为“静止”的三联图像时，这些三联会在原始帧上再计算一次光流
+illumination = None
+illumination_audit = True
+normalizer = None
+if illumination is not None:
+    normalizer = IlluminationNormalizer(illumination, min_motion_fraction=min_motion_fraction,
+                                        audit=illumination_audit)
+
+# ROI 模式：只把运动区域（合并并外扩后的矩形）裁剪送入模型，检测框映射回整幅图像坐标
+use_roi = False
+roi_padding = 32
+copied = set()  # 已复制到输出目录的文件名
+roi_fractions = []  # 每组送入模型的像素占整幅图像的比例
+
+# 运动区域叠加：半透明，标记通道取 255 * alpha 的整数部分，其余区域亮度减半（与 addWeighted 结果一致）。
+# 只需要检测结果、不需要把运动区域画进模型输入时设为 False，直接将中间帧送入模型
+overlay_for_model = True
+alpha = 0.5
+renderer = OverlayRenderer(color=(0, 0, int(255 * alpha)), alpha=alpha, image_weight=1 - alpha,
+                           unmasked_weight=1 - alpha)
+
 # 确保输出目录存在
 os.makedirs(output_folder, exist_ok=True)
 
+# 每张图像只解码一次，彩色与灰度平面共享缓存
+frame_store = FrameStore()
+
+# 光流法处理，并将光流结果合并
+def flow_mask(grays):
+    motion_mask = np.zeros_like(grays[0], dtype=bool)
+    for i in range(len(grays) - 1):
+        motion_mask |= flow_motion_mask(grays[i], grays[i + 1], 1, winsize=30, mode=flow_mode, scale=flow_scale,
+                                        warm_start=warm_start)
+    return motion_mask
+
+
 # 光流法处理连续的三张图像并进行预测
-def optical_flow_and_predict(images, filenames):
+def optical_flow_and_predict(images, grays, filenames):
+    motion_mask = None
+    if normalizer is not None:
+        # 亮度有变化时在归一化后的帧上计算光流
+        normalized, changed = normalizer.normalize(images, grays)
+        if changed:
+            motion_mask = flow_mask(normalized)
+            if normalizer.audit:
+                normalizer.record(flow_mask(grays), motion_mask)
+    if motion_mask is None:
+        motion_mask = flow_mask(grays)
+    predict_and_copy(images, motion_mask, filenames)
+
+
+# 将运动区域叠加后送入检测批次，运动过少的三联图像直接跳过
+def predict_and_copy(images, motion_mask, filenames):
     try:
-        # 光流法处理
-        flows = []
-        for i in range(len(images) - 1):
-            gray1 = cv2.cvtColor(images[i], cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(images[i + 1], cv2.COLOR_BGR2GRAY)
-            flow = cv2.calcOpticalFlowFarneback(gray1, gray2, None, 0.5, 3, 30, 3, 5, 1.2, 0)
-            flows.append(flow)
-
-        # 将光流结果合并
-        motion_mask = np.zeros_like(images[0][:, :, 0], dtype=bool)
-        for flow in flows:
-            magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-            motion_mask |= magnitude > 1
-
-        # 可视化运动区域到图像
-        alpha = 0.5
-        color_mask = np.zeros_like(images[0])
-        color_mask[:, :, 2] = 255 * motion_mask * alpha  # 设置蓝色色通道为运动区域
-        image_with_motion = cv2.addWeighted(images[1], 1 - alpha, color_mask, alpha, 0)
-
-        # 将处理后的图像传递给模型进行预测
-        image_with_motion_pil = Image.fromarray(image_with_motion)
-        results = model(image_with_motion_pil)
+        if not detector.gate(motion_mask):
+            return
+
+        # 可视化运动区域到图像（设置蓝色通道为运动区域）；批次中的图像需各自独立，结果写入新数组
+        if overlay_for_model:
+            image_with_motion = renderer.render(images[1], motion_mask, dst=np.empty_like(images[1]))
+        else:
+            image_with_motion = images[1]
 
-        # 检查是否有检测结果
-        if results and any(len(result.boxes) > 0 for result in results):  # 如果至少检测到一个目标
-            # 复制图像到输出目录
-            for filename, image in zip(filenames, images):
-                output_path = os.path.join(output_folder, filename)
-                cv2.imwrite(output_path, image)  # 保存原始图像的副本
+        if use_roi:
+            # 只将运动区域的裁剪图加入批次
+            rois = mask_to_rois(motion_mask, padding=roi_padding)
+            roi_fractions.append(roi_pixel_fraction(rois, motion_mask.shape))
+            for roi, crop in zip(rois, crop_rois(image_with_motion, rois)):
+                copy_detected(detector.submit((filenames, roi), Image.fromarray(crop)))
+            return
+
+        # 将处理后的图像加入批次，批次满时统一预测
+        image_with_motion_pil = Image.fromarray(image_with_motion)
+        copy_detected(detector.submit((filenames, None), image_with_motion_pil))
 
     except Exception as e:
         print(f"处理图像时出错：{str(e)}")
 
+
+# 有检测结果时复制原图
+def copy_detected(batch_results):
+    for (filenames, roi), result in batch_results:
+        if not has_boxes(result):  # 没有检测到目标则跳过
+            continue
+        if roi is not None:
+            boxes = to_full_frame(result.boxes.xyxy, roi)
+            print(f"检测到目标：{filenames[1]} {boxes.astype(int).tolist()}")
+        # 复制原始文件到输出目录，无需重新编码；同一组的多个区域、滑动窗口中重叠的帧都只复制一次
+        for filename in filenames:
+            if filename in copied:
+                continue
+            copied.add(filename)
+            copy_through(os.path.join(image_folder, filename), os.path.join(output_folder, filename))
+
 # 遍历输入目录中的所有图像文件
 files = os.listdir(image_folder)
 sorted_files = sorted([f for f in files if f.endswith('.jpg') or f.endswith('.JPG')])
 
 # 处理连续的三张图像并进行预测
-for i in range(0, len(sorted_files) - 2, 3):  # 每次处理三张图片
-    current_image = cv2.imread(os.path.join(image_folder, sorted_files[i]))
-    next_image = cv2.imread(os.path.join(image_folder, sorted_files[i + 1]))
-    after_next_image = cv2.imread(os.path.join(image_folder, sorted_files[i + 2]))
+if sliding_window:
+    # 每个连拍内的三帧窗口逐帧滑动，合并后的光流掩码直接复用
+    for burst in split_bursts(sorted_files, min_length=3):
+        paths = [os.path.join(image_folder, f) for f in burst]
+        for window in stream_windows(paths, window=3, use_diff=False, use_flow=True, flow_combine='or',
+                                     winsize=30, flow_options=dict(mode=flow_mode, scale=flow_scale),
+                                     store=frame_store):
+            predict_and_copy(window.images, window.flow_mask, [os.path.basename(p) for p in window.names])
+else:
+    for i in range(0, len(sorted_files) - 2, 3):  # 每次处理三张图片
+        filenames = [sorted_files[i], sorted_files[i + 1], sorted_files[i + 2]]  # 保存文件名列表
+        images, grays = frame_store.frames([os.path.join(image_folder, f) for f in filenames])
+        if images is None:
+            print(f"无法读取图像：{filenames}")
+            continue
 
-    images = [current_image, next_image, after_next_image]
-    filenames = [sorted_files[i], sorted_files[i + 1], sorted_files[i + 2]]  # 保存文件名列表
+        # 调用函数进行光流法处理和预测
+        optical_flow_and_predict(images, grays, filenames)
 
-    # 调用函数进行光流法处理和预测
-    optical_flow_and_predict(images, filenames)
\ No newline at end of file
+# 处理最后一个不满的批次
+copy_detected(detector.flush())
+stats = detector.stats()
+print(f"共 {stats['total']} 组，跳过 {stats['gated']} 组，推理 {stats['inferred']} 组，"
+      f"推理耗时 {stats['inference_seconds']:.2f} 秒，预计节省 {stats['estimated_seconds_saved']:.2f} 秒")
+if normalizer is not None:
+    illumination_stats = normalizer.stats()
+    print(f"光照归一化 {illumination_stats['normalized']} 组（红外 {illumination_stats['infrared']} 组，"
+          f"日夜切换 {illumination_stats['mode_switches']} 组），"
+          f"其中 {illumination_stats['moved_to_static']} 组由运动改判为静止")
+if roi_fractions:
+    print(f"ROI 平均像素占比 {sum(roi_fractions) / len(roi_fractions):.2%}")
@@ -3,6 +3,10 @@ from PIL import Image
 from ultralytics import YOLO
 import cv2
 
+from motion.detect import GatedDetector
+from motion.index import FolderIndex, iter_image_folders, list_images
+from motion.manifest import open_manifest
+
 # 假设您已经有了一个训练好的 YOLO 模型文件路径
 model_file = "MODELUSER/34/best.pt"  # 请替换为您的模型文件路径
 
@@ -10,7 +14,8 @@ model_file = "MODELUSER/34/best.pt"  # 请替换为您的模型文件路径
 model = YOLO(model_file)
 
 
-def list_images_and_save(input_folder, output_folder, model):
+def list_images_and_save(input_folder, output_folder, model, batch_size=8, manifest_path=None,
+                         index_path=None):
     """
     Walks through all subfolders in the specified input folder, finds image files,
     performs object detection using YOLO, and saves the detected images based on confidence.
@@ -19,41 +24,80 @@ def list_images_and_save(input_folder, output_folder, model):
     - input_folder: Path to the root folder to search for images.
     - output_folder: Path to the folder where detected images will be saved.
     - model: YOLO model instance for object detection.
+    - batch_size: Number of images passed to the model per call.
+    - manifest_path: SQLite file recording finished images; images already done with the same
+      model and output folder are skipped on re-runs.
+    - index_path: Optional motion.index.FolderIndex database; unchanged folders are then not
+      rescanned.
     """
     # 确保输出文件夹存在
     os.makedirs(output_folder, exist_ok=True)
 
-    # 遍历input_folder及其所有子文件夹
-    for root, dirs, files in os.walk(input_folder):
+    # 图像按批次送入模型
+    detector = GatedDetector(model, batch_size=batch_size)
+
+    # 记录已处理的图像，重新运行时跳过
+    manifest = open_manifest(manifest_path, 'new5.list_images_and_save', {
+        'model_file': getattr(model, 'ckpt_path', None) or model_file,
+        'output_folder': os.path.abspath(output_folder)})
+
+    # 遍历input_folder及其所有子文件夹（使用索引时只重新扫描有变化的文件夹）
+    index = FolderIndex(index_path) if index_path is not None else None
+    folders = index.update_tree(input_folder) if index is not None else iter_image_folders(input_folder)
+    for root in folders:
+        files = index.files(root) if index is not None else list_images(root)
         for file in files:
             if file.lower().endswith(('.jpg', '.jpeg', '.png')):
                 # 构建输入和输出文件的完整路径
                 input_file_path = os.path.join(root, file)
                 relative_path = os.path.relpath(root, input_folder)
                 output_subfolder = os.path.join(output_folder, relative_path)
-                output_file_path = os.path.join(output_subfolder, file)
 
                 # 确保输出子文件夹存在
                 os.makedirs(output_subfolder, exist_ok=True)
 
-                # 读取图片并进行对象检测
+                if manifest is not None and manifest.is_done(os.path.abspath(input_file_path), [input_file_path]):
+                    continue
+
+                # 读取图片并加入检测批次
                 image = Image.open(input_file_path)
-                results = model(image)
-
-                # 处理预测结果，并将置信度大于0.5的目标放入指定路径中
-                if results:
-                    for result in results:
-                        if result.boxes is not None:
-                            for box in result.boxes:
-                                confidence = box.conf
-                                if confidence > 0.5:
-                                    # 截取置信度为四位小数的字符串
-                                    confidence_str = f"{confidence:.4f}"
-                                    output_path = os.path.join(output_folder, confidence_str + "_" + file)
-
-                                    # 将目标图像保存至指定路径
-                                    image.save(output_path)
-                                    print(f"Detected image saved: {output_path}")
+                save_detected(detector.submit((file, input_file_path, image), image), output_folder, manifest)
+
+    # 处理最后一个不满的批次
+    save_detected(detector.flush(), output_folder, manifest)
+    if manifest is not None:
+        print(f"Skipped {manifest.skipped} images already in the manifest.")
+        manifest.close()
+    if index is not None:
+        index.close()
+
+
+def save_detected(batch_results, output_folder, manifest=None):
+    """
+    Saves every image whose detection result has a box with confidence above 0.5.
+
+    Parameters:
+    - batch_results: (key, result) pairs from GatedDetector, keyed by (file name, path, image).
+    - output_folder: Path to the folder where detected images will be saved.
+    - manifest: Optional motion.manifest.Manifest to record the finished images in.
+    """
+    # 处理预测结果，并将置信度大于0.5的目标放入指定路径中
+    for (file, input_file_path, image), result in batch_results:
+        outputs = []
+        if result.boxes is not None:
+            for box in result.boxes:
+                confidence = box.conf
+                if confidence > 0.5:
+                    # 截取置信度为四位小数的字符串
+                    confidence_str = f"{confidence:.4f}"
+                    output_path = os.path.join(output_folder, confidence_str + "_" + file)
+
+                    # 将目标图像保存至指定路径
+                    image.save(output_path)
+                    outputs.append(output_path)
+                    print(f"Detected image saved: {output_path}")
+        if manifest is not None:
+            manifest.mark_done(os.path.abspath(input_file_path), [input_file_path], outputs)
 
 
 if __name__ == "__main__":
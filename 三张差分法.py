@@ -3,7 +3,181 @@ import numpy as np
 import os
 import logging
 
-def process_three_frame_difference(input_folder, output_folder, threshold=25):
+from motion.buffers import BufferSet
+from motion.detectors import ThreeFrameDiffDetector
+from motion.framestack import open_frame_store
+from motion.grouping import split_bursts
+from motion.memory import format_bytes, memory_report
+from motion.overlay import OverlayRenderer
+from motion.parallel import run_in_pool
+from motion.pipeline import PerThread, three_stage_pipeline
+from motion.stream import stream_windows
+
+# 同一进程内各组共享的工作缓冲区
+_buffers = BufferSet()
+
+# 运动区域以白色半透明叠加在中间帧上（只处理掩码内的像素）
+_renderer = OverlayRenderer(color=(255, 255, 255), alpha=0.5, image_weight=1, buffers=_buffers)
+
+# 同一进程内按路径共享的帧堆栈
+_frame_stacks = {}
+
+
+def get_frame_stack(path):
+    """Returns this process's reader for the frame stack at path, opening it once."""
+    if path not in _frame_stacks:
+        _frame_stacks[path] = open_frame_store(path)
+    return _frame_stacks[path]
+
+
+def process_triplet(input_folder, output_folder, names, threshold=25, frame_stack_path=None):
+    """
+    Runs the three-frame difference on three consecutive files and saves the result image.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where output images will be saved.
+    - names: The three consecutive file names.
+    - threshold: Threshold for motion detection in the difference images.
+    - frame_stack_path: Optional frame stack of input_folder (motion.framestack) to read the
+      frames from instead of decoding them.
+
+    Returns:
+    - The saved output file name, or None if the triplet was skipped.
+    """
+    img1_path = os.path.join(input_folder, names[0])
+    img2_path = os.path.join(input_folder, names[1])
+    img3_path = os.path.join(input_folder, names[2])
+
+    logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
+
+    detector = ThreeFrameDiffDetector(threshold, buffers=_buffers)
+
+    if frame_stack_path is not None:
+        # 从帧堆栈中直接取灰度帧的视图，不再解码；只有叠加用的中间帧需要彩色图像
+        stack = get_frame_stack(frame_stack_path)
+        grays = [stack.gray(path) for path in (img1_path, img2_path, img3_path)]
+        img2 = stack.bgr(img2_path)
+        if img2 is None or any(gray is None for gray in grays):
+            logging.warning("Some images could not be read and will be skipped.")
+            return None
+        combined_motion = detector.detect(grays)
+        return save_motion_image(output_folder, names[1], img2, combined_motion)
+
+    # 读取图像
+    img1 = cv2.imread(img1_path)
+    img2 = cv2.imread(img2_path)
+    img3 = cv2.imread(img3_path)
+
+    if img1 is None or img2 is None or img3 is None:
+        logging.warning("Some images could not be read and will be skipped.")
+        return None
+
+    # 灰度化、差分、阈值化并合并差分结果（工作缓冲区在多次调用间复用）
+    combined_motion = detector.detect([img1, img2, img3])
+
+    return save_motion_image(output_folder, names[1], img2, combined_motion)
+
+
+def save_motion_image(output_folder, name, img2, combined_motion):
+    """
+    Overlays the combined motion mask on the middle frame and saves it as motion_<name>.
+    """
+    # 将运动区域叠加在中间帧上（中间帧可能是缓存或帧堆栈中的只读图像，结果写入复用的缓冲区）
+    result_img = _renderer.render(img2, combined_motion)
+
+    # 保存结果图像
+    output_file_name = f"motion_{name}"
+    cv2.imwrite(os.path.join(output_folder, output_file_name), result_img)
+    logging.info(f"Saved motion detected image for {name}")
+    return output_file_name
+
+
+def process_bursts_sliding(input_folder, output_folder, sorted_files, threshold=25, frame_stack_path=None):
+    """
+    Runs the three-frame difference over every window of 3 inside each burst of consecutively
+    numbered files, reading each frame and computing each pair difference only once.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where output images will be saved.
+    - sorted_files: Image file names in ascending order.
+    - threshold: Threshold for motion detection in the difference images.
+    - frame_stack_path: Optional frame stack of input_folder to read the frames from.
+    """
+    store = None if frame_stack_path is None else get_frame_stack(frame_stack_path)
+    for burst in split_bursts(sorted_files, min_length=3):
+        paths = [os.path.join(input_folder, name) for name in burst]
+        for window in stream_windows(paths, window=3, diff_threshold=threshold, store=store):
+            middle = os.path.basename(window.names[1])
+            save_motion_image(output_folder, middle, window.images[1], window.diff_mask)
+
+
+def process_pipelined(input_folder, output_folder, triplets, threshold=25, frame_stack_path=None,
+                      pipeline_options=None):
+    """
+    Runs the triplets on a threaded pipeline: reader threads decode the frames, compute threads
+    difference them and render the overlay, writer threads encode and save the result, with
+    bounded queues between the stages.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where output images will be saved.
+    - triplets: Lists of three consecutive file names.
+    - threshold: Threshold for motion detection in the difference images.
+    - frame_stack_path: Optional frame stack of input_folder to read the frames from.
+    - pipeline_options: Keyword arguments for motion.pipeline.three_stage_pipeline
+      (readers, compute_workers, writers, queue_size).
+
+    Returns:
+    - The motion.pipeline.Pipeline, whose report shows the bottleneck stage.
+    """
+    # 每个线程使用自己的帧堆栈读取器、检测器与工作缓冲区
+    stacks = PerThread(lambda: open_frame_store(frame_stack_path))
+
+    def make_worker():
+        buffers = BufferSet()
+        return (ThreeFrameDiffDetector(threshold, buffers=buffers),
+                OverlayRenderer(color=(255, 255, 255), alpha=0.5, image_weight=1, buffers=buffers))
+    workers = PerThread(make_worker)
+
+    def read(names):
+        paths = [os.path.join(input_folder, name) for name in names]
+        if frame_stack_path is not None:
+            # 三帧都取灰度平面，只有叠加用的中间帧需要彩色图像
+            stack = stacks.get()
+            frames = [stack.gray(path) for path in paths]
+            image2 = stack.bgr(paths[1])
+        else:
+            frames = [cv2.imread(path) for path in paths]
+            image2 = frames[1]
+        if image2 is None or any(frame is None for frame in frames):
+            logging.warning(f"Some images of {names} could not be read and will be skipped.")
+            return None
+        return names[1], image2, frames
+
+    def compute(item):
+        name, image2, frames = item
+        detector, renderer = workers.get()
+        combined_motion = detector.detect(frames)
+        # 结果交给写线程，每组写入新的数组
+        return name, renderer.render(image2, combined_motion, dst=np.empty_like(image2))
+
+    def write(item):
+        name, result_img = item
+        output_file_name = f"motion_{name}"
+        cv2.imwrite(os.path.join(output_folder, output_file_name), result_img)
+        return name
+
+    pipeline = three_stage_pipeline(read, compute, write, **(pipeline_options or {}))
+    for name in pipeline.run(triplets):
+        logging.info(f"Saved motion detected image for {name}")
+    return pipeline
+
+
+def process_three_frame_difference(input_folder, output_folder, threshold=25, workers=1,
+                                   max_in_flight=None, ordered=True, sliding=False, frame_stack_path=None,
+                                   pipeline_options=None):
     """
     Processes images in the specified input folder using three-frame difference method,
     and saves the motion detected images to the output folder.
@@ -12,6 +186,16 @@ def process_three_frame_difference(input_folder, output_folder, threshold=25):
     - input_folder: Path to the folder containing input images.
     - output_folder: Path to the folder where output images will be saved.
     - threshold: Threshold for motion detection in the difference images.
+    - workers: Number of worker processes; 1 runs serially, None uses every CPU core.
+    - max_in_flight: Maximum number of triplets queued on the pool at once.
+    - ordered: Report parallel results in file order instead of completion order.
+    - sliding: Slide a 3-frame window over each burst of consecutive numbers instead of
+      stepping through the sorted files in strides of 3.
+    - frame_stack_path: Frame stack exported from input_folder with motion.framestack; frames
+      are then read from its memory-mapped planes instead of being decoded on every run.
+    - pipeline_options: If set, a dict of motion.pipeline.three_stage_pipeline arguments, e.g.
+      {'readers': 2, 'compute_workers': 2, 'writers': 2, 'queue_size': 8}; the triplets then run
+      on reader, compute and writer threads instead of workers (not with sliding).
     """
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -23,48 +207,47 @@ def process_three_frame_difference(input_folder, output_folder, threshold=25):
         # 确保输出文件夹存在
         os.makedirs(output_folder, exist_ok=True)
 
-        # 按组读取三张图像
-        for i in range(0, len(sorted_files) - 2, 3):
-            img1_path = os.path.join(input_folder, sorted_files[i])
-            img2_path = os.path.join(input_folder, sorted_files[i + 1])
-            img3_path = os.path.join(input_folder, sorted_files[i + 2])
-
-            logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
-
-            # 读取图像
-            img1 = cv2.imread(img1_path)
-            img2 = cv2.imread(img2_path)
-            img3 = cv2.imread(img3_path)
+        if sliding:
+            process_bursts_sliding(input_folder, output_folder, sorted_files, threshold, frame_stack_path)
+            return
 
-            if img1 is None or img2 is None or img3 is None:
-                logging.warning("Some images could not be read and will be skipped.")
-                continue
+        # 按组读取三张图像
+        triplets = [sorted_files[i:i + 3] for i in range(0, len(sorted_files) - 2, 3)]
 
-            # 转换为灰度图像
-            gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-            gray3 = cv2.cvtColor(img3, cv2.COLOR_BGR2GRAY)
+        if pipeline_options is not None:
+            pipeline = process_pipelined(input_folder, output_folder, triplets, threshold, frame_stack_path,
+                                         pipeline_options)
+            logging.info(pipeline.summary())
+            return
 
-            # 计算差分图像
-            diff1 = cv2.absdiff(gray1, gray2)
-            diff2 = cv2.absdiff(gray2, gray3)
+        if workers == 1:
+            for names in triplets:
+                process_triplet(input_folder, output_folder, names, threshold, frame_stack_path)
+            return
 
-            # 应用阈值
-            _, diff1_t = cv2.threshold(diff1, threshold, 255, cv2.THRESH_BINARY)
-            _, diff2_t = cv2.threshold(diff2, threshold, 255, cv2.THRESH_BINARY)+-
+        # 多进程并行处理，每个进程独立读写自己的三联图像
+        tasks = ((input_folder, output_folder, names, threshold, frame_stack_path) for names in triplets)
+        for result in run_in_pool(process_triplet, tasks, workers=workers,
+                                  max_in_flight=max_in_flight, ordered=ordered):
+            if result.error is not None:
+                logging.error(f"Failed triplet {result.args[2]}: {result.error}")
 
-            # 合并差分结果
-            combined_motion = cv2.bitwise_or(diff1_t, diff2_t)
+    except Exception as e:
+        logging.error(f"Error occurred: {e}")
 
-            # 将运动区域叠加在中间帧上
-            result_img = cv2.addWeighted(img2, 1, combined_motion, 0.5, 0)
+    finally:
+        log_memory_report()
 
-            # 保存结果图像
-            cv2.imwrite(os.path.join(output_folder, f"motion_{sorted_files[i+1]}"), result_img)
-            logging.info(f"Saved motion detected image for {sorted_files[i+1]}")
 
-    except Exception as e:
-        logging.error(f"Error occurred: {e}")
+def log_memory_report():
+    """
+    Logs the peak memory of the run and the size of the reused work buffers.
+    """
+    report = memory_report(_buffers)
+    logging.info(f"Peak RSS: {format_bytes(report['peak_rss_bytes'])}, "
+                 f"workers: {format_bytes(report['peak_rss_children_bytes'])}, "
+                 f"work buffers: {format_bytes(report['buffer_bytes'])} "
+                 f"({report['buffer_allocations']} allocations)")
 
 if __name__ == "__main__":
     input_folder = r"D:\光流照片"  # 修改为包含图片文件的文件夹路径
@@ -1,9 +1,18 @@
-import cv2
 import numpy as np
 import os
 import logging
 
-def extract_and_save_images(input_folder, output_folder, flow_output_folder, threshold=1):
+from motion.flow import WarmStartFlow, flow_motion_mask
+from motion.framestack import open_frame_store
+from motion.manifest import open_manifest
+from motion.overlay import OverlayRenderer
+from motion.profiling import log_profile, open_profiler
+from motion.writer import ImageWriter
+
+def extract_and_save_images(input_folder, output_folder, flow_output_folder, threshold=1,
+                            flow_mode='full', flow_scale=0.25, flow_tile_size=1024, manifest_path=None,
+                            profile_path=None, write_workers=2, write_queue_size=32, jpeg_quality=None,
+                            frame_stack_path=None, save_overlay=True):
     """
     Processes images in the specified input folder, calculates optical flow,
     and saves the results to the output folder.
@@ -13,8 +22,40 @@ def extract_and_save_images(input_folder, output_folder, flow_output_folder, thr
     - output_folder: Path to the folder where output images will be saved.
     - flow_output_folder: Path to the folder where flow images will be saved.
     - threshold: Threshold for motion detection.
+    - flow_mode: 'full', 'downscale', 'tiled', 'sparse' or 'warm' (see motion.flow.flow_motion_mask);
+      'warm' starts flow2 from flow1 with fewer iterations (motion.flow.WarmStartFlow).
+    - flow_scale: Resize factor used by the 'downscale' mode.
+    - flow_tile_size: Tile edge length used by the 'tiled' mode.
+    - manifest_path: SQLite file recording finished triplets; triplets already done with the
+      same inputs and parameters are skipped on re-runs.
+    - profile_path: If set, per-stage timing histograms are written here at the end of the
+      run and on SIGUSR1 (Prometheus text for .prom/.txt, JSON otherwise).
+    - write_workers: Threads copying the triplets and writing the flow images in the
+      background (0 writes synchronously).
+    - write_queue_size: Number of pending writes before processing waits for the writers.
+    - jpeg_quality: JPEG quality of the flow images (None: OpenCV default of 95).
+    - frame_stack_path: Frame stack exported from input_folder with motion.framestack; frames
+      are then read from it instead of being decoded again.
+    - save_overlay: Render and save the flow images; False only copies the triplets.
     """
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    profiler = open_profiler(profile_path)
+    # 复制原图与保存光流图像都在后台线程中完成
+    writer = ImageWriter(write_workers, write_queue_size, jpeg_quality, profiler=profiler)
+
+    manifest_params = {
+        'threshold': threshold, 'flow_mode': flow_mode, 'flow_scale': flow_scale,
+        'flow_tile_size': flow_tile_size, 'output_folder': os.path.abspath(output_folder),
+        'flow_output_folder': os.path.abspath(flow_output_folder)}
+    if not save_overlay:
+        manifest_params['save_overlay'] = False
+    manifest = open_manifest(manifest_path, 'three_frame_flow.extract_and_save_images', manifest_params)
+
+    # 透明度和标记颜色：0.5 表示半透明，运动区域叠加在第一个通道上，其余区域亮度减半
+    alpha = 0.5
+    renderer = OverlayRenderer(color=(255, 0, 0), alpha=alpha, image_weight=1 - alpha, unmasked_weight=1 - alpha)
+    # 'warm' 模式下 gray2→gray3 的光流以 gray1→gray2 的光流为初值
+    warm_start = WarmStartFlow() if flow_mode == 'warm' else None
 
     try:
         # 获取输入文件夹中所有图像文件
@@ -25,6 +66,9 @@ def extract_and_save_images(input_folder, output_folder, flow_output_folder, thr
         os.makedirs(output_folder, exist_ok=True)
         os.makedirs(flow_output_folder, exist_ok=True)
 
+        # 每张图像只解码一次，彩色与灰度平面共享缓存（或直接读取帧堆栈）
+        frame_store = open_frame_store(frame_stack_path, profiler)
+
         for i in range(0, len(sorted_files) - 2, 3):
             img1_path = os.path.join(input_folder, sorted_files[i])
             img2_path = os.path.join(input_folder, sorted_files[i + 1])
@@ -36,50 +80,57 @@ def extract_and_save_images(input_folder, output_folder, flow_output_folder, thr
                 logging.warning(f"File not found: {img1_path}, {img2_path}, {img3_path}")
                 continue
 
-            img1 = cv2.imread(img1_path)
-            img2 = cv2.imread(img2_path)
-            img3 = cv2.imread(img3_path)
-
-            if img1 is None or img2 is None or img3 is None:
-                logging.warning(f"Could not read one or more images: {img1_path}, {img2_path}, {img3_path}")
+            input_paths = [img1_path, img2_path, img3_path]
+            if manifest is not None and manifest.is_done(os.path.abspath(img2_path), input_paths):
                 continue
 
-            # 保存提取的三张图像到指定文件夹
-            cv2.imwrite(os.path.join(output_folder, sorted_files[i]), img1)
-            cv2.imwrite(os.path.join(output_folder, sorted_files[i + 1]), img2)
-            cv2.imwrite(os.path.join(output_folder, sorted_files[i + 2]), img3)
-
-            # 计算光流图像
-            gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-            gray3 = cv2.cvtColor(img3, cv2.COLOR_BGR2GRAY)
-
-            flow1 = cv2.calcOpticalFlowFarneback(gray1, gray2, None, 0.5, 3, 35, 3, 5, 1.2, 0)
-            flow2 = cv2.calcOpticalFlowFarneback(gray2, gray3, None, 0.5, 3, 35, 3, 5, 1.2, 0)
+            # 光流只用灰度图像，只有叠加用的中间帧需要彩色图像（帧堆栈无彩色平面时不必解码另外两张）
+            gray1, gray2, gray3 = [frame_store.gray(path) for path in (img1_path, img2_path, img3_path)]
+            img2 = frame_store.bgr(img2_path)
 
-            magnitude1, _ = cv2.cartToPolar(flow1[..., 0], flow1[..., 1])
-            magnitude2, _ = cv2.cartToPolar(flow2[..., 0], flow2[..., 1])
+            if img2 is None or gray1 is None or gray2 is None or gray3 is None:
+                logging.warning(f"Could not read one or more images: {img1_path}, {img2_path}, {img3_path}")
+                continue
 
-            motion_mask1 = magnitude1 > threshold
-            motion_mask2 = magnitude2 > threshold
+            # 保存提取的三张图像到指定文件夹（直接复制原文件，不重新编码）
+            for name in sorted_files[i:i + 3]:
+                writer.copy(os.path.join(input_folder, name), os.path.join(output_folder, name))
 
-            motion_mask = np.logical_and(motion_mask1, motion_mask2)
+            flow_options = dict(winsize=35, mode=flow_mode, scale=flow_scale, tile_size=flow_tile_size)
+            with profiler.stage('flow'):
+                motion_mask1 = flow_motion_mask(gray1, gray2, threshold, warm_start=warm_start, **flow_options)
+                motion_mask2 = flow_motion_mask(gray2, gray3, threshold, warm_start=warm_start, **flow_options)
 
-            # 透明度和标记颜色的应用
-            alpha = 0.5  # 透明度，0.5表示半透明
-            color_mask = np.zeros_like(img2)
-            color_mask[:, :, 0] = 255 * motion_mask.astype(np.uint8)  # 使用运动掩码的蓝色通道
+            with profiler.stage('threshold'):
+                motion_mask = np.logical_and(motion_mask1, motion_mask2)
 
-            # 将标记的颜色叠加到原始图像上
-            masked_img = cv2.addWeighted(img2, 1 - alpha, color_mask, alpha, 0)
+            if save_overlay:
+                # 将标记的颜色叠加到原始图像上（每组一个新数组，写入器无需再复制）
+                with profiler.stage('overlay'):
+                    masked_img = renderer.render(img2, motion_mask, dst=np.empty_like(img2))
 
-            # 保存光流图像和带遮罩的图像到指定文件夹，并与被遮罩的图像同名
-            cv2.imwrite(os.path.join(flow_output_folder, sorted_files[i + 1]), masked_img)
+                # 保存光流图像和带遮罩的图像到指定文件夹，并与被遮罩的图像同名
+                writer.write(os.path.join(flow_output_folder, sorted_files[i + 1]), masked_img, copy=False)
             logging.info(f"Processed {sorted_files[i:i + 3]} and saved as {sorted_files[i + 1]}")
 
+            if manifest is not None:
+                outputs = [os.path.join(output_folder, name) for name in sorted_files[i:i + 3]]
+                if save_overlay:
+                    outputs.append(os.path.join(flow_output_folder, sorted_files[i + 1]))
+                manifest.mark_done(os.path.abspath(img2_path), input_paths, outputs)
+
     except Exception as e:
         logging.error(f"Error occurred: {e}")
 
+    finally:
+        report = writer.close()
+        logging.info(f"Wrote {report['written']} images and copied {report['copied']} "
+                     f"({report['failed']} failed), peak write queue: {report['max_queue_depth']}")
+        if manifest is not None:
+            logging.info(f"Skipped {manifest.skipped} triplets already in the manifest.")
+            manifest.close()
+        log_profile(profiler, profile_path)
+
 if __name__ == "__main__":
     input_folder = r"D:\光流照片"  # 修改为包含图片文件的文件夹路径
     output_folder = r"D:\光输出文件夹路径" # 修改为输出文件夹的路径
@@ -1,98 +1,408 @@
 import cv2
 import os
-import re
 import logging
 
-def process_three_frame_difference(input_folder, output_folder, threshold=30):
+from motion.background import open_background
+from motion.buffers import BufferSet
+from motion.detect import motion_fraction
+from motion.detectors import ThreeFrameDiffDetector
+from motion.grouping import complete_triplets, group_frames
+from motion.index import folder_files
+from motion.maskstore import open_mask_store
+from motion.memory import format_bytes, memory_report
+from motion.overlay import OverlayRenderer
+from motion.parallel import run_in_pool
+from motion.pipeline import PerThread, three_stage_pipeline
+from motion.profiling import NULL_PROFILER, Profiler, log_profile, open_profiler
+from motion.screen import cascade_summary, make_cascade, merge_cascade_stats, screening_diff_detector
+from motion.writer import ImageWriter
+
+# 同一进程内各组共享的工作缓冲区
+_buffers = BufferSet()
+
+# 运动区域只在第一个通道上半透明高亮（只处理掩码内的像素）
+_renderer = OverlayRenderer(color=(255, 0, 0), alpha=0.5, image_weight=1, buffers=_buffers)
+
+# 同一进程内按 (阈值, 缩小倍数, 块均值阈值) 共享的筛选级联
+_screeners = {}
+
+
+def get_screener(threshold, factor, signature_threshold=None):
     """
-    Processes images in the specified input folder using the three-frame difference method,
-    and saves the motion detected images and masks to the output folder.
+    Returns this process's screening cascade (block-mean signatures, then the reduced-resolution
+    difference) for a threshold, reduction factor and signature threshold, creating it once.
+    """
+    key = (threshold, factor, signature_threshold)
+    if key not in _screeners:
+        detector = None if factor is None else screening_diff_detector(threshold, 'or_first', buffers=_buffers)
+        _screeners[key] = make_cascade(detector, factor, signature_threshold)
+    return _screeners[key]
+
+
+def read_group(input_folder, prefix, group, threshold=30, screen_factor=None, signature_threshold=None,
+               profiler=None, screener=None):
+    """
+    Screens a (_1, _2, _3) group (if enabled) and decodes its three frames.
+
+    Parameters:
+    - screener: Screening cascade to use instead of this process's shared one (e.g. one per
+      thread); see process_group for the other parameters.
+
+    Returns:
+    - [img1, img2, img3], or None if the group was screened out or could not be read.
+    """
+    img1_path = os.path.join(input_folder, group[1])
+    img2_path = os.path.join(input_folder, group[2])
+    img3_path = os.path.join(input_folder, group[3])
+
+    logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
+    profiler = profiler or NULL_PROFILER
+
+    # 先比较块均值、再以低分辨率解码筛选，无运动的组不再进行全分辨率解码
+    if screen_factor is not None or signature_threshold is not None:
+        screener = screener or get_screener(threshold, screen_factor, signature_threshold)
+        screener.profiler = profiler
+        if not screener.passes([img1_path, img2_path, img3_path]):
+            logging.info(f"No motion in group {prefix} in screening. Skipping.")
+            return None
+
+    # 读取图像
+    with profiler.stage('decode'):
+        img1 = cv2.imread(img1_path)
+        img2 = cv2.imread(img2_path)
+        img3 = cv2.imread(img3_path)
+
+    # 检查图像是否成功读取
+    if img1 is None or img2 is None or img3 is None:
+        logging.warning(f"Could not read one or more images for group {prefix}. Skipping.")
+        return None
+    return [img1, img2, img3]
+
+
+def process_group(input_folder, output_folder, prefix, group, threshold=30, jpeg_quality=None,
+                  screen_factor=None, signature_threshold=None, mask_encoder=None, save_overlay=True,
+                  profiler=None, writer=None, background=None):
+    """
+    Runs the three-frame difference on one (_1, _2, _3) group and saves the mask and
+    highlighted image.
 
     Parameters:
     - input_folder: Path to the folder containing input images.
     - output_folder: Path to the folder where output images will be saved.
+    - prefix: Group prefix shared by the three file names.
+    - group: Mapping of frame number (1, 2, 3) to file name.
     - threshold: Threshold for motion detection in the difference images.
+    - jpeg_quality: JPEG quality of the saved images when no writer is given (None: OpenCV default).
+    - screen_factor: If set (2, 4 or 8), the group is first checked for motion on frames
+      decoded at 1/screen_factor size, and skipped without a full decode if there is none.
+    - signature_threshold: If set, the group is first compared on coarse block means (from the
+      EXIF thumbnails where available) and skipped when no block changes by more than this.
+    - mask_encoder: Optional motion.maskstore.MaskEncoder; the mask is then encoded and
+      returned for a MaskStore instead of being saved as a JPEG.
+    - save_overlay: Render and save the highlighted image; False saves only the mask.
+    - profiler: Optional motion.profiling.Profiler timing each stage.
+    - writer: Optional motion.writer.ImageWriter; without it the images are written
+      synchronously before returning.
+    - background: Optional motion.background.BackgroundModel of the camera. Once it has warmed
+      up, groups whose middle frame matches the background are skipped, and only pixels that
+      also differ from the background are kept in the mask. The model learns every group.
+
+    Returns:
+    - (mask_output_path, result_output_path), or (EncodedMask, result_output_path) with a
+      mask_encoder, or None if the group was skipped. result_output_path is None when
+      save_overlay is False.
     """
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    profiler = profiler or NULL_PROFILER
+    images = read_group(input_folder, prefix, group, threshold, screen_factor, signature_threshold, profiler)
+    if images is None:
+        return None
+    img1, img2, img3 = images
 
-    try:
-        # 获取输入文件夹中所有图像文件并排序
-        files = [f for f in os.listdir(input_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-        logging.info(f"Files found: {files}")
+    # 与背景模型比较：中间帧与背景一致的组不再计算差分
+    foreground = None
+    if background is not None:
+        foreground = background.apply([img1, img2, img3])
+        if foreground is not None and motion_fraction(foreground) == 0:
+            logging.info(f"No change against the background in group {prefix}. Skipping.")
+            return None
 
-        # 正则表达式提取文件名前缀和后缀（_1, _2, _3）
-        pattern = re.compile(r'(.*)_(\d)\.jpg')
-        grouped_files = {}
+    # 灰度化、计算两个连续帧之间的差异并结合，再设定阈值来确定运动物体
+    detector = ThreeFrameDiffDetector(threshold, merge='or_first', buffers=_buffers, profiler=profiler)
+    motion_mask = detector.detect([img1, img2, img3])
+    if foreground is not None:
+        # 只保留相对背景也有变化的像素，抑制随风摆动的植被等
+        cv2.bitwise_and(motion_mask, foreground, dst=motion_mask)
 
-        # 将相同前缀的文件进行分组
-        for file in files:
-            match = pattern.match(file)
-            if match:
-                prefix = match.group(1)
-                suffix = int(match.group(2))
-                if prefix not in grouped_files:
-                    grouped_files[prefix] = {}
-                grouped_files[prefix][suffix] = file
+    # 未提供写入器时同步写入
+    own_writer = writer is None
+    if own_writer:
+        writer = ImageWriter(0, jpeg_quality=jpeg_quality, profiler=profiler)
 
-        # 确保输出文件夹存在
-        os.makedirs(output_folder, exist_ok=True)
+    # 保存运动掩码图像（或编码后交给掩码存储）
+    if mask_encoder is not None:
+        with profiler.stage('encode'):
+            mask_output = mask_encoder.encode(motion_mask)
+    else:
+        mask_output = os.path.join(output_folder, f'motion_mask_{prefix}.jpg')
+        writer.write(mask_output, motion_mask)
+        logging.info(f"Saved motion mask: {mask_output}")
 
-        # 对每组文件（_1, _2, _3）进行处理
-        for prefix, group in grouped_files.items():
-            if all(k in group for k in [1, 2, 3]):  # 检查是否存在所有帧
-                img1_path = os.path.join(input_folder, group[1])
-                img2_path = os.path.join(input_folder, group[2])
-                img3_path = os.path.join(input_folder, group[3])
+    # 可选：将运动区域高亮显示在原始图像上（img2 为本组单独读取的图像，可原地修改）
+    result_output_path = None
+    if save_overlay:
+        with profiler.stage('overlay'):
+            result_image = _renderer.render(img2, motion_mask, in_place=True)
 
-                logging.info(f"Processing files: {img1_path}, {img2_path}, {img3_path}")
+        # 保存带有运动高亮的图像
+        result_output_path = os.path.join(output_folder, f'highlighted_motion_{prefix}.jpg')
+        writer.write(result_output_path, result_image)
+        logging.info(f"Saved highlighted motion image: {result_output_path}")
+    if own_writer:
+        writer.close()
+    return mask_output, result_output_path
 
-                # 读取图像
-                img1 = cv2.imread(img1_path)
-                img2 = cv2.imread(img2_path)
-                img3 = cv2.imread(img3_path)
 
-                # 检查图像是否成功读取
-                if img1 is None or img2 is None or img3 is None:
-                    logging.warning(f"Could not read one or more images for group {prefix}. Skipping.")
-                    continue
+def process_group_profiled(*args):
+    """
+    Runs process_group in a worker process with its own profiler.
 
-                # 将照片转换为灰度图像
-                gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-                gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-                gray3 = cv2.cvtColor(img3, cv2.COLOR_BGR2GRAY)
+    Returns:
+    - (process_group result, profiler snapshot) for merging into the parent's profiler.
+    """
+    profiler = Profiler()
+    return process_group(*args, profiler=profiler), profiler.snapshot()
 
-                # 计算两个连续帧之间的差异
-                diff1 = cv2.absdiff(gray1, gray2)
-                diff2 = cv2.absdiff(gray2, gray3)
 
-                # 结合两个帧之间的差异
-                motion_mask = cv2.bitwise_or(diff1, diff2)
+def process_pipelined(input_folder, output_folder, triplets, threshold=30, jpeg_quality=None, screen_factor=None,
+                      signature_threshold=None, mask_encoder=None, save_overlay=True, profiler=None,
+                      pipeline_options=None, on_result=None):
+    """
+    Runs the groups on a threaded pipeline: reader threads screen and decode, compute threads
+    difference the frames and render the overlay, writer threads encode and save, with
+    bounded queues between the stages. See process_group for the parameters.
 
-                # 设定阈值来确定运动物体
-                _, motion_mask = cv2.threshold(motion_mask, threshold, 255, cv2.THRESH_BINARY)
+    Parameters:
+    - triplets: (prefix, group) pairs of complete groups.
+    - pipeline_options: Keyword arguments for motion.pipeline.three_stage_pipeline.
+    - on_result: Called as on_result(prefix, process_group result) in the calling thread for
+      every saved group, in completion order (e.g. to put the mask into a MaskStore).
 
-                # 保存运动掩码图像
-                mask_output_path = os.path.join(output_folder, f'motion_mask_{prefix}.jpg')
-                cv2.imwrite(mask_output_path, motion_mask)
-                logging.info(f"Saved motion mask: {mask_output_path}")
+    Returns:
+    - The motion.pipeline.Pipeline, whose report shows the bottleneck stage.
+    """
+    profiler = profiler or NULL_PROFILER
+    writer = ImageWriter(0, jpeg_quality=jpeg_quality, profiler=profiler)
+    screen = screen_factor is not None or signature_threshold is not None
 
-                # 可选：将运动区域以红色高亮显示在原始图像上
-                color_mask = cv2.cvtColor(motion_mask, cv2.COLOR_GRAY2BGR)
-                color_mask[:, :, 1] = 0  # 将绿色通道置为0
-                color_mask[:, :, 2] = 0  # 将蓝色通道置为0
-                result_image = cv2.addWeighted(img2, 1, color_mask, 0.5, 0)
+    # 每个线程使用自己的筛选级联、检测器与工作缓冲区
+    def make_screener():
+        detector = None if screen_factor is None else screening_diff_detector(threshold, 'or_first',
+                                                                             buffers=BufferSet())
+        return make_cascade(detector, screen_factor, signature_threshold)
+    screeners = PerThread(make_screener)
 
-                # 保存带有运动高亮的图像
-                result_output_path = os.path.join(output_folder, f'highlighted_motion_{prefix}.jpg')
-                cv2.imwrite(result_output_path, result_image)
-                logging.info(f"Saved highlighted motion image: {result_output_path}")
+    def make_worker():
+        buffers = BufferSet()
+        return (ThreeFrameDiffDetector(threshold, merge='or_first', buffers=buffers, profiler=profiler),
+                OverlayRenderer(color=(255, 0, 0), alpha=0.5, image_weight=1, buffers=buffers))
+    workers = PerThread(make_worker)
 
-            else:
+    def read(task):
+        prefix, group = task
+        images = read_group(input_folder, prefix, group, threshold, screen_factor, signature_threshold, profiler,
+                            screeners.get() if screen else None)
+        return None if images is None else (prefix, images)
+
+    def compute(item):
+        prefix, (img1, img2, img3) = item
+        detector, renderer = workers.get()
+        motion_mask = detector.detect([img1, img2, img3])
+        # 交给写线程的 (路径, 图像)；掩码缓冲区会被本线程的下一组覆盖，需复制
+        outputs = []
+        if mask_encoder is not None:
+            with profiler.stage('encode'):
+                mask_output = mask_encoder.encode(motion_mask)
+        else:
+            mask_output = os.path.join(output_folder, f'motion_mask_{prefix}.jpg')
+            outputs.append((mask_output, motion_mask.copy()))
+        result_output_path = None
+        if save_overlay:
+            with profiler.stage('overlay'):
+                result_image = renderer.render(img2, motion_mask, in_place=True)
+            result_output_path = os.path.join(output_folder, f'highlighted_motion_{prefix}.jpg')
+            outputs.append((result_output_path, result_image))
+        return prefix, (mask_output, result_output_path), outputs
+
+    def write(item):
+        prefix, result, outputs = item
+        for path, image in outputs:
+            writer.write(path, image, copy=False)
+        return prefix, result
+
+    pipeline = three_stage_pipeline(read, compute, write, profiler=profiler, **(pipeline_options or {}))
+    for prefix, result in pipeline.run(triplets):
+        logging.info(f"Saved the outputs of group {prefix}")
+        if on_result is not None:
+            on_result(prefix, result)
+    report = writer.close()
+    logging.info(f"Wrote {report['written']} images ({report['failed']} failed)")
+    if screen:
+        stats = merge_cascade_stats(screeners.values())
+        logging.info(f"Screening: {stats['passed']} of {stats['screened']} groups passed "
+                     f"({stats['rejected']} skipped); {cascade_summary(stats)}")
+    return pipeline
+
+
+def process_three_frame_difference(input_folder, output_folder, threshold=30, workers=1,
+                                   max_in_flight=None, ordered=True, index_path=None,
+                                   profile_path=None, write_workers=2, write_queue_size=32,
+                                   jpeg_quality=None, screen_factor=None, background_dir=None,
+                                   background_options=None, mask_store_path=None, mask_encoding='packbits',
+                                   mask_scale=1.0, save_overlay=True, signature_threshold=None,
+                                   pipeline_options=None):
+    """
+    Processes images in the specified input folder using the three-frame difference method,
+    and saves the motion detected images and masks to the output folder.
+
+    Parameters:
+    - input_folder: Path to the folder containing input images.
+    - output_folder: Path to the folder where output images will be saved.
+    - threshold: Threshold for motion detection in the difference images.
+    - workers: Number of worker processes; 1 runs serially, None uses every CPU core.
+    - max_in_flight: Maximum number of groups queued on the pool at once.
+    - ordered: Report parallel results in group order instead of completion order.
+    - index_path: Optional motion.index.FolderIndex database to read the file list from.
+    - profile_path: If set, per-stage timing histograms are written here at the end of the
+      run and on SIGUSR1 (Prometheus text for .prom/.txt, JSON otherwise).
+    - write_workers: Threads encoding and writing the outputs behind the serial loop (0 writes
+      synchronously). Worker processes always write their own outputs synchronously.
+    - write_queue_size: Number of pending writes before the loop waits for the writers.
+    - jpeg_quality: JPEG quality of the saved images (None: OpenCV default of 95).
+    - screen_factor: Screen every group at 1/2, 1/4 or 1/8 resolution first and write
+      outputs only for groups with motion (None: process every group at full resolution).
+    - signature_threshold: Before that, skip groups whose coarse block means (EXIF thumbnails
+      or 1/8 decodes) change by no more than this many grey levels (None: no such stage).
+    - background_dir: Folder of per-camera background models (one .npz per input folder).
+      The model is loaded, updated by every group and saved at the end of the run; groups
+      then run serially since the model learns them in order.
+    - background_options: Keyword arguments for motion.background.BackgroundModel.
+    - mask_store_path: Folder of a motion.maskstore.MaskStore; masks are stored there
+      losslessly under 'motion_mask_<prefix>' instead of as JPEGs (None: JPEG masks).
+    - mask_encoding: 'packbits' or 'rle' for the mask store.
+    - mask_scale: Resolution of the stored masks relative to the frames.
+    - save_overlay: Also save the highlighted images (False: masks only, no overlay rendering).
+    - pipeline_options: If set, a dict of motion.pipeline.three_stage_pipeline arguments, e.g.
+      {'readers': 2, 'compute_workers': 2, 'writers': 2, 'queue_size': 8}; the groups then run
+      on reader, compute and writer threads instead of workers.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    profiler = open_profiler(profile_path)
+    writer = None
+    background, background_file = open_background(background_dir, input_folder, profiler,
+                                                  **(background_options or {}))
+    if background is not None and (workers != 1 or pipeline_options is not None):
+        logging.warning("The background model learns groups in order; processing serially.")
+        workers = 1
+        pipeline_options = None
+    mask_store = open_mask_store(mask_store_path, mask_encoding, mask_scale)
+    mask_encoder = None if mask_store is None else mask_store.encoder
+
+    def store_mask(prefix, result):
+        if mask_store is not None and result is not None:
+            mask_store.put_encoded(f'motion_mask_{prefix}', result[0])
+
+    try:
+        # 获取输入文件夹中所有图像文件并排序
+        files = folder_files(input_folder, index_path)
+        logging.info(f"Found {len(files)} image files in {input_folder}")
+
+        # 将相同前缀的文件进行分组
+        grouped_files = group_frames(files)
+
+        # 确保输出文件夹存在
+        os.makedirs(output_folder, exist_ok=True)
+
+        if pipeline_options is not None:
+            triplets, missing = complete_triplets(grouped_files)
+            for prefix in missing:
                 logging.warning(f"Missing frames for group {prefix}. Skipping.")
+            pipeline = process_pipelined(input_folder, output_folder, triplets, threshold, jpeg_quality,
+                                         screen_factor, signature_threshold, mask_encoder, save_overlay, profiler,
+                                         pipeline_options, on_result=store_mask)
+            logging.info(pipeline.summary())
+            return
+
+        if workers == 1:
+            # 编码与写文件放在后台线程中进行，不阻塞差分计算
+            writer = ImageWriter(write_workers, write_queue_size, jpeg_quality, profiler=profiler)
+            # 对每组文件（_1, _2, _3）进行处理
+            for prefix, group in grouped_files.items():
+                if all(k in group for k in [1, 2, 3]):  # 检查是否存在所有帧
+                    store_mask(prefix, process_group(input_folder, output_folder, prefix, group, threshold,
+                                                     screen_factor=screen_factor,
+                                                     signature_threshold=signature_threshold,
+                                                     mask_encoder=mask_encoder,
+                                                     save_overlay=save_overlay, profiler=profiler, writer=writer,
+                                                     background=background))
+                else:
+                    logging.warning(f"Missing frames for group {prefix}. Skipping.")
+            return
+
+        triplets, missing = complete_triplets(grouped_files)
+        for prefix in missing:
+            logging.warning(f"Missing frames for group {prefix}. Skipping.")
+
+        # 多进程并行处理，每个进程独立读写自己的组
+        tasks = ((input_folder, output_folder, prefix, group, threshold, jpeg_quality, screen_factor,
+                  signature_threshold, mask_encoder, save_overlay)
+                 for prefix, group in triplets)
+        func = process_group_profiled if profiler.enabled else process_group
+        for result in run_in_pool(func, tasks, workers=workers,
+                                  max_in_flight=max_in_flight, ordered=ordered):
+            if result.error is not None:
+                logging.error(f"Failed group {result.args[2]}: {result.error}")
+            elif profiler.enabled:
+                profiler.merge(result.value[1])
+                store_mask(result.args[2], result.value[0])
+            else:
+                store_mask(result.args[2], result.value)
 
     except Exception as e:
         logging.error(f"Error occurred: {e}")
 
+    finally:
+        if background is not None:
+            background.save(background_file)
+            logging.info(f"Saved background model {background_file} ({background.frames_seen} frames learned, "
+                         f"{background.resets} restarts)")
+        if mask_store is not None:
+            mask_report = mask_store.close()
+            logging.info(f"Stored {mask_report['stored']} masks in {format_bytes(mask_report['stored_bytes'])} "
+                         f"({mask_report['ratio']:.0f}x smaller than 8-bit masks)")
+        if writer is not None:
+            report = writer.close()
+            logging.info(f"Wrote {report['written']} images ({report['failed']} failed), "
+                         f"peak write queue: {report['max_queue_depth']}")
+        if (screen_factor is not None or signature_threshold is not None) and workers == 1 \
+                and pipeline_options is None:
+            screener = get_screener(threshold, screen_factor, signature_threshold)
+            stats = screener.stats()
+            logging.info(f"Screening: {stats['passed']} of {stats['screened']} groups passed "
+                         f"({stats['rejected']} skipped); {screener.summary()}")
+        log_memory_report()
+        log_profile(profiler, profile_path)
+
+
+def log_memory_report():
+    """
+    Logs the peak memory of the run and the size of the reused work buffers.
+    """
+    report = memory_report(_buffers)
+    logging.info(f"Peak RSS: {format_bytes(report['peak_rss_bytes'])}, "
+                 f"workers: {format_bytes(report['peak_rss_children_bytes'])}, "
+                 f"work buffers: {format_bytes(report['buffer_bytes'])} "
+                 f"({report['buffer_allocations']} allocations)")
+
 if __name__ == "__main__":
     input_folder = r"D:\RPCA\cai"  # 修改为包含图片文件的文件夹路径
     output_folder = r"D:\RPCA\cai3"  # 替换为输出文件夹的路径
@@ -1,8 +1,48 @@
 import os
 import shutil
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-def find_and_copy_consecutive_images(folders, target_folder, prefix='sp'):
+from motion.extract import WindowEntry, store_files, write_window_manifest
+from motion.index import FolderIndex, list_images
+
+# Regular expression to match file names like 'IMG_0001.JPG'
+IMAGE_PATTERN = re.compile(r'(IMG_)(\d+)\.JPG', re.IGNORECASE)
+
+# Manifest of the deduplicated extraction, written to the target folder
+WINDOW_MANIFEST = 'windows.csv'
+
+
+def consecutive_windows(files):
+    """
+    Finds every window of three consecutively numbered images.
+
+    Parameters:
+    - files: Sorted file names of one folder.
+
+    Returns:
+    - List of (number, names): the number of the first image and the three file names.
+      Windows overlap, so a run of 5 images gives 3 windows.
+    """
+    # List to hold file names and their extracted numbers
+    file_data = []
+
+    # Extract number parts and store them with the filename
+    for file in files:
+        match = IMAGE_PATTERN.match(file)
+        if match:
+            num_part = int(match.group(2))  # Convert the numeric part to an integer
+            file_data.append((file, num_part))
+
+    windows = []
+    for i in range(len(file_data) - 2):
+        # Check if the next two files are consecutive
+        if file_data[i + 1][1] == file_data[i][1] + 1 and file_data[i + 2][1] == file_data[i][1] + 2:
+            windows.append((file_data[i][1], [name for name, _ in file_data[i:i + 3]]))
+    return windows
+
+
+def find_and_copy_consecutive_images(folders, target_folder, prefix='sp', index_path=None):
     """
     Find consecutive images in the given folders, rename and copy them to the target folder.
 
@@ -10,38 +50,135 @@ def find_and_copy_consecutive_images(folders, target_folder, prefix='sp'):
     - folders: A list of folder paths to search for consecutive images.
     - target_folder: The folder path where the consecutive images will be copied.
     - prefix: The prefix to add to the filenames when copying.
+    - index_path: Optional motion.index.FolderIndex database; folders are then listed from the
+      index, which only rescans folders that changed since the last run.
     """
     # Ensure the target folder exists
     if not os.path.exists(target_folder):
         os.makedirs(target_folder, exist_ok=True)
 
-    # Regular expression to match file names like 'ECSP0001.JPG'
-    pattern = re.compile(r'(IMG_)(\d+)\.JPG', re.IGNORECASE)
+    index = FolderIndex(index_path) if index_path is not None else None
 
     for folder in folders:
-        # Get a list of all JPG files in the folder
-        files = [f for f in os.listdir(folder) if f.lower().endswith('.jpg')]
-        files.sort()  # Sort files alphabetically by name
-
-        # List to hold file names and their extracted numbers
-        file_data = []
-
-        # Extract number parts and store them with the filename
-        for file in files:
-            match = pattern.match(file)
-            if match:
-                num_part = int(match.group(2))  # Convert the numeric part to an integer
-                file_data.append((file, num_part))
-
-        # Check for consecutive files and copy them
-        for i in range(len(file_data) - 2):
-            # Check if the next two files are consecutive
-            if file_data[i + 1][1] == file_data[i][1] + 1 and file_data[i + 2][1] == file_data[i][1] + 2:
-                # Copy and rename the consecutive files to the target folder
-                for index, (old_name, _) in enumerate(file_data[i:i+3], start=1):
-                    new_name = f"{prefix}{file_data[i][1]}_{index}.jpg"
-                    shutil.copy(os.path.join(folder, old_name), os.path.join(target_folder, new_name))
-                    print(f"Copied and renamed {old_name} to {target_folder}/{new_name}")
+        # Get a sorted list of all JPG files in the folder
+        if index is not None:
+            index.update(folder)
+            files = index.files(folder)
+        else:
+            files = list_images(folder)
+        files = [f for f in files if f.lower().endswith('.jpg')]
+
+        # Copy and rename the consecutive files to the target folder
+        for number, names in consecutive_windows(files):
+            for position, old_name in enumerate(names, start=1):
+                new_name = f"{prefix}{number}_{position}.jpg"
+                shutil.copy(os.path.join(folder, old_name), os.path.join(target_folder, new_name))
+                print(f"Copied and renamed {old_name} to {target_folder}/{new_name}")
+
+    if index is not None:
+        index.close()
+
+
+def stored_folder_names(folders):
+    """
+    Subfolder of the target folder for each source folder: its path relative to the common
+    parent of all folders (e.g. 'TTZ-013'), so equal file names from different cameras
+    never collide. Folders on different drives have no common parent; their subfolders
+    then start with the drive (e.g. 'D/TTZ-013', 'E/TTZ-013').
+    """
+    paths = [os.path.abspath(folder) for folder in folders]
+    if len(paths) == 1:
+        return {folders[0]: os.path.basename(paths[0].rstrip(os.sep)) or 'images'}
+    try:
+        parent = os.path.commonpath(paths)
+    except ValueError:
+        # Paths on different drives (D:\, E:\): relative to the common parent on each drive
+        drives = {}
+        for path in paths:
+            drives.setdefault(os.path.splitdrive(path)[0], []).append(path)
+        names = {}
+        for folder, path in zip(folders, paths):
+            drive = os.path.splitdrive(path)[0]
+            group = drives[drive]
+            parent = os.path.commonpath(group) if len(group) > 1 else os.path.dirname(path)
+            label = drive.strip('\\/:').replace('\\', '_').replace('/', '_') or 'root'
+            names[folder] = os.path.normpath(os.path.join(label, os.path.relpath(path, parent)))
+        return names
+    return {folder: os.path.relpath(path, parent) for folder, path in zip(folders, paths)}
+
+
+def extract_consecutive_windows(folders, target_folder, prefix='sp', index_path=None, workers=8,
+                                link_mode='auto'):
+    """
+    Deduplicating version of find_and_copy_consecutive_images: plans the windows of all
+    folders first, then stores every source image once, however many windows it belongs to.
+
+    Images are stored under their original names in one subfolder per source folder (see
+    stored_folder_names), as hard links or reflinks where the filesystems allow and as
+    parallel copies otherwise (see motion.extract.FileStorer). The windows are written to
+    the manifest WINDOW_MANIFEST in the target folder, one row per window image: the window
+    name used by find_and_copy_consecutive_images ('sp{n}_1.jpg'...) and the stored file.
+    Files already stored by an earlier run are kept unless their source has changed, so
+    interrupted runs can be resumed.
+
+    Parameters:
+    - folders: A list of folder paths to search for consecutive images.
+    - target_folder: The folder path where the images and the manifest are stored.
+    - prefix: The prefix of the window names.
+    - index_path: Optional motion.index.FolderIndex database to list the folders from.
+    - workers: Threads listing folders and storing files concurrently.
+    - link_mode: 'auto' (hard link, reflink, copy), 'reflink' or 'copy'.
+
+    Returns:
+    - (counts, failed): the stored file counts per method, and a dict of stored path -> error.
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    subfolders = stored_folder_names(folders)
+
+    # List the folders concurrently; the index database is only used from this thread
+    if index_path is not None:
+        with FolderIndex(index_path) as index:
+            listings = []
+            for folder in folders:
+                index.update(folder)
+                listings.append(index.files(folder))
+    else:
+        with ThreadPoolExecutor(max(1, workers)) as pool:
+            listings = list(pool.map(list_images, folders))
+
+    # Plan every window first, then store each source image once
+    entries = []
+    pairs = {}
+    for folder, files in zip(folders, listings):
+        files = [f for f in files if f.lower().endswith('.jpg')]
+        windows = consecutive_windows(files)
+        for number, names in windows:
+            for position, name in enumerate(names, start=1):
+                stored = os.path.join(subfolders[folder], name)
+                source = os.path.join(folder, name)
+                pairs[os.path.join(target_folder, stored)] = source
+                entries.append(WindowEntry(folder, f"{prefix}{number}", position,
+                                           f"{prefix}{number}_{position}.jpg", source, stored))
+        images = {name for _, names in windows for name in names}
+        print(f"{folder}: {len(windows)} windows, {len(images)} images")
+
+    for subfolder in set(subfolders.values()):
+        os.makedirs(os.path.join(target_folder, subfolder), exist_ok=True)
+    counts, failed = store_files([(src, dst) for dst, src in pairs.items()], link_mode, workers)
+
+    # Windows with an image that could not be stored are left out of the manifest
+    broken = {(entry.folder, entry.window) for entry in entries
+              if os.path.join(target_folder, entry.stored) in failed}
+    write_window_manifest(os.path.join(target_folder, WINDOW_MANIFEST),
+                          [entry for entry in entries if (entry.folder, entry.window) not in broken])
+
+    for path, error in failed.items():
+        print(f"Failed to store {path}: {error}")
+    print(f"Stored {len(pairs)} images for {len(entries) // 3} windows ({len(entries)} window images): "
+          f"{counts['hardlink']} hard links, {counts['reflink']} reflinks, {counts['copy']} copies, "
+          f"{counts['existing']} already stored, {len(failed)} failed; "
+          f"{len(broken)} windows left out of the manifest")
+    return counts, failed
 
 if __name__ == "__main__":
     # List of folders to search for consecutive images
@@ -53,5 +190,12 @@ if __name__ == "__main__":
     # Target folder where consecutive images will be copied
     target_folder_path = r"D:\光流照片"
 
+    # Store each image once (hard link / reflink / parallel copy) and map the windows to
+    # the stored files in windows.csv, instead of copying every window under its own names
+    deduplicate = False
+
     # Call the function
-    find_and_copy_consecutive_images(folders_to_search, target_folder_path)
+    if deduplicate:
+        extract_consecutive_windows(folders_to_search, target_folder_path)
+    else:
+        find_and_copy_consecutive_images(folders_to_search, target_folder_path)